@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+
+import loguru
+
+from bgp_loc_rib import LocRib
+from bgp_session import BgpSession
+from bgp_simulator import SIMULATOR_BASE_ADDRESS, SIMULATOR_PORT, Simulator
+from bgp_update_group import UpdateGroups
+
+LOCAL_ID = "1.1.1.1"
+LOCAL_ASN = 65000
+
+
+def simulator_process(peer_count, prefix_count, port, base_address, recorded, extended_message, graceful_restart, connection):
+    """ Simulator runs in its own process so it does not take event loop time of the measured speaker """
+
+    asyncio.run(simulator_main(peer_count, prefix_count, port, base_address, recorded, extended_message, graceful_restart, connection))
+
+
+async def simulator_main(peer_count, prefix_count, port, base_address, recorded, extended_message, graceful_restart, connection):
+    """ Start simulated peers and execute commands received from the benchmark """
+
+    loop = asyncio.get_running_loop()
+    simulator = Simulator(peer_count, prefix_count, port, base_address, recorded=recorded, extended_message=extended_message, graceful_restart=graceful_restart)
+    await simulator.start()
+
+    stopped = loop.create_future()
+
+    def command():
+        message = connection.recv()
+        if message == "flap":
+            simulator.flap(0)
+        if message == "stop":
+            loop.remove_reader(connection.fileno())
+            stopped.set_result(None)
+
+    loop.add_reader(connection.fileno(), command)
+    # Benchmark needs to know how many prefixes to wait for when they come from recorded table
+    connection.send(simulator.prefix_count)
+    await stopped
+    await simulator.stop()
+
+
+class LoopLag:
+    """ Event loop lag sampler """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def summary(self):
+        samples = sorted(self.samples) or [0.0]
+        return {"loop_lag_max_ms": round(samples[-1] * 1000, 2), "loop_lag_p99_ms": round(samples[int(len(samples) * 0.99)] * 1000, 2)}
+
+
+def converged(sessions, loc_rib, update_groups, prefix_count):
+    """ Every table received and selected, no stale routes left, every update group member caught up with the shared stream """
+
+    if len(loc_rib) != prefix_count or any(len(_.adj_rib_in) != prefix_count for _ in sessions):
+        return False
+
+    # Routes kept over restart of the peer have to be refreshed or swept first
+    if any(_.adj_rib_in.stale for _ in sessions):
+        return False
+
+    for group in update_groups.groups.values():
+        if any(_.backlog or _.position != group.log_base + len(group.log) for _ in group.members.values()):
+            return False
+
+    return all(_.active_fsm.event_queue.empty() for _ in sessions)
+
+
+async def wait_for(condition, timeout):
+    """ Poll condition, return time it took to become true """
+
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError
+        await asyncio.sleep(0.005)
+    return time.perf_counter() - start
+
+
+async def benchmark(args, connection):
+    """ Run the speaker against simulated peers and collect the results """
+
+    loguru.logger.remove()
+    loguru.logger.add(lambda _: None, level="WARNING")
+
+    lag = LoopLag()
+    loc_rib = LocRib()
+    update_groups = UpdateGroups(loc_rib)
+    # Same addresses and ASNs the simulator process uses, without the tables
+    simulator = Simulator(args.peers, 0, args.port, args.address)
+
+    start = time.perf_counter()
+    sessions = [
+        BgpSession(
+            local_id=LOCAL_ID,
+            local_asn=LOCAL_ASN,
+            local_hold_time=180,
+            peer_ip=_.address,
+            peer_asn=_.asn,
+            bgp_listeners={},
+            active_mode=True,
+            passive_mode=False,
+            loc_rib=loc_rib,
+            update_groups=update_groups,
+            bgp_port=args.port,
+        )
+        for _ in simulator.peers
+    ]
+
+    await wait_for(lambda: all(_.active_fsm.state == "Established" for _ in sessions), args.timeout)
+    established = time.perf_counter() - start
+    await wait_for(lambda: any(len(_.adj_rib_in) for _ in sessions), args.timeout)
+    first_update = time.perf_counter() - start
+    await wait_for(lambda: all(len(_.adj_rib_in) == args.prefixes for _ in sessions), args.timeout)
+    received = time.perf_counter() - start
+    await wait_for(lambda: converged(sessions, loc_rib, update_groups, args.prefixes), args.timeout)
+    convergence = time.perf_counter() - start
+
+    results = {
+        "established_s": round(established, 3),
+        "convergence_s": round(convergence, 3),
+        "update_prefixes_per_s": round(args.peers * args.prefixes / max(received - first_update, 1e-6)),
+    }
+
+    if args.flap:
+        connection.send("flap")
+        await wait_for(lambda: sessions[0].active_fsm.state != "Established", args.timeout)
+        results["flap_reconvergence_s"] = round(await wait_for(lambda: converged(sessions, loc_rib, update_groups, args.prefixes), args.timeout), 3)
+
+    results["peak_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    results.update(lag.summary())
+
+    # Connections need to be closed while the loop still runs
+    for session in sessions:
+        session.active_fsm.close_connection()
+        session.passive_fsm.close_connection()
+
+    return results
+
+
+def git_commit():
+    """ Commit the benchmark runs against, so results of different commits can be compared """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(record, path):
+    """ Print results next to the previous run with the same parameters """
+
+    previous = None
+    try:
+        with open(path) as _:
+            for line in _:
+                entry = json.loads(line)
+                if entry["parameters"] == record["parameters"]:
+                    previous = entry
+    except FileNotFoundError:
+        pass
+
+    print(f"{'metric':24} {'current':>12} {'previous':>12} {'change':>8}")
+    for name, value in record["results"].items():
+        old = previous["results"].get(name) if previous else None
+        change = f"{(value - old) / old * 100:+7.1f}%" if old else ""
+        print(f"{name:24} {value:12} {'' if old is None else old:>12} {change:>8}")
+
+    if previous:
+        print(f"previous run: commit {previous['commit']} at {previous['time']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convergence benchmark against simulated peers on loopback")
+    parser.add_argument("--peers", type=int, default=4, help="number of simulated peers")
+    parser.add_argument("--prefixes", type=int, default=100000, help="number of prefixes each peer announces")
+    parser.add_argument("--port", type=int, default=SIMULATOR_PORT, help="TCP port simulated peers listen on")
+    parser.add_argument("--address", default=SIMULATOR_BASE_ADDRESS, help="address of the first simulated peer")
+    parser.add_argument("--recorded", help="raw BGP messages or MRT file every peer announces instead of synthetic table")
+    parser.add_argument("--extended-message", action="store_true", help="simulated peers negotiate Extended Message capability")
+    parser.add_argument("--graceful-restart", action="store_true", help="simulated peers negotiate Graceful Restart and send End-of-RIB")
+    parser.add_argument("--flap", action="store_true", help="flap first peer after convergence and measure reconvergence")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for each phase")
+    parser.add_argument("--results", default="bench_convergence.jsonl", help="file results get appended to")
+    args = parser.parse_args()
+
+    connection, simulator_connection = multiprocessing.Pipe()
+    simulator = multiprocessing.get_context("spawn").Process(
+        target=simulator_process,
+        args=(args.peers, args.prefixes, args.port, args.address, args.recorded, args.extended_message, args.graceful_restart, simulator_connection),
+        daemon=True,
+    )
+    simulator.start()
+    args.prefixes = connection.recv()
+
+    try:
+        results = asyncio.run(benchmark(args, connection))
+    finally:
+        connection.send("stop")
+        simulator.join(5)
+
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "parameters": {
+            "peers": args.peers,
+            "prefixes": args.prefixes,
+            "flap": args.flap,
+            "recorded": args.recorded,
+            "extended_message": args.extended_message,
+            "graceful_restart": args.graceful_restart,
+        },
+        "results": results,
+    }
+
+    compare(record, args.results)
+
+    with open(args.results, "a") as _:
+        _.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import struct
+import time
+
+import loguru
+
+import bgp_event
+import bgp_message
+from bgp_event import BgpEvent
+from bgp_fsm import BgpFsm
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, 0])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 4, 2, 1])
+    + struct.pack("!H", 65001)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+PREFIXES_PER_UPDATE = 500
+
+
+class Writer:
+    """ Stream writer stand-in recording time the first KEEPALIVE got sent """
+
+    def __init__(self):
+        self.keepalive_sent = None
+
+    def write(self, data):
+        if self.keepalive_sent is None and data[18] == bgp_message.KEEPALIVE:
+            self.keepalive_sent = time.perf_counter()
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def build_update(index):
+    """ Build UPDATE message announcing block of /24 prefixes """
+
+    nlri = b"".join(struct.pack("!BL", 24, (10 << 24) + (_ << 8))[:4] for _ in range(index * PREFIXES_PER_UPDATE, (index + 1) * PREFIXES_PER_UPDATE))
+    return bgp_message.Update(attributes=ATTRIBUTES, nlri=nlri).write()
+
+
+async def keepalive_latency(backlog, priority):
+    """ Queue backlog of UPDATE events, then let KEEPALIVE timer expire and measure how long it takes to send the KEEPALIVE """
+
+    fsm = BgpFsm("1.1.1.1", 65000, 180, "127.0.0.2", 65000, mode="A")
+    fsm.state = "Established"
+    fsm.hold_time = 3
+    fsm.writer = Writer()
+    fsm.tcp_connection_established = True
+
+    # Messages are decoded up front so only the processing of the backlog gets measured
+    updates = [bgp_message.DecodeMessage(build_update(_ % 120)) for _ in range(backlog)]
+    for update in updates:
+        fsm.enqueue_event(BgpEvent(bgp_event.UPDATE_MSG, messages=[update]))
+
+    # Without priority lane the expiry lands at the end of the regular queue
+    if priority:
+        expire = fsm.enqueue_event
+    else:
+        expire = fsm.event_queue.put_nowait
+
+    await asyncio.sleep(0.01)
+    expired = time.perf_counter()
+    event = BgpEvent(bgp_event.KEEPALIVE_TIMER_EXPIRES)
+    event.serial_number = 0
+    expire(event)
+
+    while fsm.writer.keepalive_sent is None:
+        await asyncio.sleep(0.001)
+
+    latency = fsm.writer.keepalive_sent - expired
+
+    fsm.task_fsm.cancel()
+    fsm.task_message_input_loop.cancel()
+    fsm.cancel_timers()
+    return latency
+
+
+async def main():
+    loguru.logger.remove()
+
+    print(f"UPDATE backlog of {PREFIXES_PER_UPDATE} prefix messages, time from KEEPALIVE timer expiry to KEEPALIVE sent")
+    for backlog in (100, 1000, 3000):
+        regular = await keepalive_latency(backlog, priority=False)
+        priority = await keepalive_latency(backlog, priority=True)
+        print(f"backlog {backlog:5}  regular queue {regular * 1000:9.1f} ms  priority lane {priority * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
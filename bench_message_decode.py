@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import struct
+import timeit
+
+import bgp_message
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, 0])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 6, 2, 2])
+    + struct.pack("!HH", 65001, 65002)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+
+def build_update(size=bgp_message.MAX_MESSAGE_SIZE):
+    """ Build UPDATE message of given size packed with /24 prefixes """
+
+    prefix_count = (size - bgp_message.HEADER_SIZE - 4 - len(ATTRIBUTES)) // 4
+    nlri = b"".join(struct.pack("!BL", 24, (10 << 24) + (_ << 8))[:4] for _ in range(prefix_count))
+    body = struct.pack("!HH", 0, len(ATTRIBUTES)) + ATTRIBUTES + nlri
+    return bgp_message.MARKER + struct.pack("!HB", bgp_message.HEADER_SIZE + len(body), bgp_message.UPDATE) + body
+
+
+def decode_update_sliced(data):
+    """ Reference decoder passing a copied tail of the message to every constructor """
+
+    prefixes_del_len = struct.unpack("!H", data[19:21])[0]
+    attributes_len = struct.unpack("!H", data[21 + prefixes_del_len : 23 + prefixes_del_len])[0]
+    attributes_raw = data[23 + prefixes_del_len : 23 + prefixes_del_len + attributes_len]
+    attributes = []
+    i = 0
+    while i < attributes_len:
+        attribute = bgp_message.ATTRIBUTE_CLASSES.get(attributes_raw[i + 1], bgp_message.AttrUnk)(attributes_raw[i:])
+        attributes.append(attribute)
+        i += len(attribute)
+
+    prefixes_add_raw = data[23 + prefixes_del_len + attributes_len :]
+    prefixes_add = []
+    i = 0
+    while i < len(prefixes_add_raw):
+        prefix = bgp_message.IPv4Prefix(prefixes_add_raw[i:])
+        prefixes_add.append(prefix)
+        i += prefix.size + 1
+
+    return attributes, prefixes_add
+
+
+def main():
+    # Copies made by the slicing decoder grow with the message, extended message shows it the most
+    for size in (bgp_message.MAX_MESSAGE_SIZE, bgp_message.EXTENDED_MESSAGE_SIZE):
+        data = build_update(size)
+        update = bgp_message.DecodeMessage(data, max_size=size).update
+        assert update.keys_add == [_.key for _ in decode_update_sliced(data)[1]]
+
+        print(f"UPDATE size {len(data)} bytes, {len(update.keys_add)} prefixes")
+
+        # Lazy row decodes no prefixes, it shows per message cost of validation and attribute lookup only
+        for name, stmt, decodes_prefixes in (
+            ("sliced", lambda: decode_update_sliced(data), True),
+            ("view", lambda: bgp_message.DecodeMessage(data, max_size=size).update.prefixes_add, True),
+            ("view keys", lambda: bgp_message.DecodeMessage(data, max_size=size).update.keys_add, True),
+            ("view lazy", lambda: bgp_message.DecodeMessage(data, max_size=size).update.attribute_set, False),
+        ):
+            number = 200 * bgp_message.MAX_MESSAGE_SIZE // size
+            best = min(timeit.repeat(stmt, number=number, repeat=5)) / number
+            throughput = f"{len(update.keys_add) / best:12.0f} prefixes/s" if decodes_prefixes else f"{'n/a':>12} prefixes not decoded"
+            print(f"{name:12} {best * 1_000_000:9.1f} us/message {throughput}")
+
+
+if __name__ == "__main__":
+    main()
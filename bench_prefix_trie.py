@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import random
+import sys
+import time
+
+from bgp_prefix_trie import MASKS, PrefixTrie
+
+
+def random_table(count):
+    """ Synthetic table with prefix length distribution resembling the Internet table """
+
+    lengths = [24] * 60 + [23] * 8 + [22] * 10 + [21] * 5 + [20] * 5 + [19] * 4 + [18] * 2 + [17] * 2 + [16] * 4
+    table = {}
+    while len(table) < count:
+        length = random.choice(lengths)
+        table[(random.getrandbits(32) & MASKS[length]) << 8 | length] = len(table)
+    return table
+
+
+def dict_longest_match(table, address):
+    """ Baseline longest prefix match, probe the dict for every prefix length starting from the longest one """
+
+    for length in range(32, -1, -1):
+        key = (address & MASKS[length]) << 8 | length
+        if key in table:
+            return key, table[key]
+    return None
+
+
+def dict_more_specifics(table, key):
+    """ Baseline subtree lookup, scan the whole dict """
+
+    length = key & 0xFF
+    address = key >> 8
+    return [(_, value) for _, value in table.items() if _ & 0xFF >= length and (_ >> 8) & MASKS[length] == address]
+
+
+def measure(name, function, arguments):
+    """ Run function for every argument and print time per call """
+
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    elapsed = (time.perf_counter() - start) / len(arguments)
+    print(f"{name:36} {elapsed * 1_000_000:12.2f} us/lookup")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(0)
+
+    table = random_table(count)
+
+    trie = PrefixTrie()
+    start = time.perf_counter()
+    trie.bulk_load(table.items())
+    print(f"Bulk load of {count} prefixes: {time.perf_counter() - start:.2f} s, {len(trie.values)} nodes")
+
+    addresses = [random.getrandbits(32) for _ in range(100_000)]
+    for address in addresses[:1000]:
+        assert trie.longest_match(address) == dict_longest_match(table, address)
+
+    measure("longest match - trie", trie.longest_match, addresses)
+    measure("longest match - dict + length scan", lambda _: dict_longest_match(table, _), addresses)
+
+    keys = list(table)[:100_000]
+    measure("exact match - trie", trie.get, keys)
+    measure("exact match - dict", table.get, keys)
+
+    covering = [(random.getrandbits(32) & MASKS[16]) << 8 | 16 for _ in range(20)]
+    for key in covering[:3]:
+        assert sorted(trie.more_specifics(key)) == sorted(dict_more_specifics(table, key))
+
+    measure("more specifics of /16 - trie", lambda _: list(trie.more_specifics(_)), covering)
+    measure("more specifics of /16 - dict scan", lambda _: dict_more_specifics(table, _), covering)
+
+
+if __name__ == "__main__":
+    main()
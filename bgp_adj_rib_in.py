@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import socket
+
+import loguru
+
+from bgp_timers import Timer, timer_wheel
+
+
+def prefix_str(key):
+    """ Convert packed prefix key into its text representation """
+
+    return f"{socket.inet_ntoa((key >> 8).to_bytes(4, 'big'))}/{key & 0xFF}"
+
+
+class AdjRibIn:
+    """ Routes received from single peer, stored as packed prefix key -> shared attribute set mapping """
+
+    def __init__(self, peer_ip, peer_asn, local_asn=None, loc_rib=None, import_policy=None):
+        """ Class constructor """
+
+        self.peer_ip = peer_ip
+        self.peer_asn = peer_asn
+        self.peer_id = None
+        self.ebgp = local_asn is not None and peer_asn != local_asn
+
+        # Every change gets propagated to the Loc-RIB for best route re-evaluation
+        self.loc_rib = loc_rib
+        if self.loc_rib is not None:
+            self.loc_rib.register(self)
+
+        # Prefixes rejected by the policy are treated as withdrawn, policy gets the same arguments as the export one
+        self.import_policy = import_policy
+
+        # Routes refer to attribute sets interned by bgp_message so each distinct set is stored only once
+        self.routes = {}
+
+        # Routes waiting to be refreshed by the peer, they stay in use until refreshed or swept, never in both dicts at once
+        self.stale = {}
+
+        # Stale routes of restarting peer get swept when this expires, unless the peer sends End-of-RIB first
+        self.stale_timer = Timer(self.stale_timer_expires)
+
+    def __len__(self):
+        return len(self.routes) + len(self.stale)
+
+    def get(self, key):
+        """ Return attribute set of the route or None if prefix is not present """
+
+        attribute_set = self.routes.get(key)
+        return self.stale.get(key) if attribute_set is None else attribute_set
+
+    def update(self, messages):
+        """ Apply batch of decoded UPDATE messages, Loc-RIB gets all the affected prefixes at once, return their keys """
+
+        keys = self.receive(messages)
+
+        if self.loc_rib is not None:
+            self.loc_rib.update(keys)
+
+        return keys
+
+    def receive(self, messages):
+        """ Apply batch of decoded UPDATE messages without notifying the Loc-RIB, return keys of all affected prefixes """
+
+        keys = []
+        for message in messages:
+            # Withdraw only message has no attributes worth parsing
+            update = message.update
+            keys_add = update.keys_add
+            keys += self.store(update.attribute_set if keys_add else None, keys_add, update.keys_del)
+
+        return keys
+
+    def apply(self, attribute_set, prefixes_add, prefixes_del):
+        """ Bulk withdraw and insert of packed prefix keys, return keys of all affected prefixes """
+
+        keys = self.store(attribute_set, prefixes_add, prefixes_del)
+
+        if self.loc_rib is not None:
+            self.loc_rib.update(keys)
+
+        return keys
+
+    def store(self, attribute_set, prefixes_add, prefixes_del):
+        """ Withdraw and insert prefixes without notifying the Loc-RIB """
+
+        routes = self.routes
+
+        if prefixes_add and self.import_policy is not None:
+            accepted = []
+            rejected = []
+            for key in prefixes_add:
+                (accepted if self.import_policy(key, self, attribute_set) else rejected).append(key)
+            # Keys decoded by the pool come as arrays, rejected ones are appended to a list copy
+            prefixes_add = accepted
+            prefixes_del = [*prefixes_del, *rejected]
+
+        for key in prefixes_del:
+            routes.pop(key, None)
+
+        if prefixes_add:
+            routes.update(dict.fromkeys(prefixes_add, attribute_set))
+
+        # Prefixes the peer announced or withdrew again are not stale anymore
+        stale = self.stale
+        if stale:
+            for key in prefixes_del:
+                stale.pop(key, None)
+            for key in prefixes_add:
+                stale.pop(key, None)
+
+        return [*prefixes_del, *prefixes_add]
+
+    def mark_stale(self):
+        """ Mark all the routes stale at once, no per prefix work unless there are stale routes already """
+
+        if self.stale:
+            self.stale.update(self.routes)
+        else:
+            self.stale = self.routes
+        self.routes = {}
+
+    @property
+    def restarting(self):
+        """ Stale routes are kept for peer that restarts or has not sent its End-of-RIB yet """
+
+        return self.stale_timer.deadline is not None
+
+    def retain(self, seconds):
+        """ Keep all the routes as stale while the peer restarts, sweep them if it does not come back in time """
+
+        self.mark_stale()
+        timer_wheel.arm(self.stale_timer, seconds)
+
+    def stale_timer_expires(self):
+        """ Peer did not refresh its routes in time """
+
+        stale = self.sweep_stale()
+        loguru.logger.bind(peer=f"R {self.peer_ip}", state="").info(f"Stale timer expired, {len(stale)} stale routes removed")
+
+    def sweep_stale(self):
+        """ Drop routes the peer did not refresh, return the dropped routes """
+
+        timer_wheel.cancel(self.stale_timer)
+
+        stale = self.stale
+        self.stale = {}
+
+        if stale and self.loc_rib is not None:
+            self.loc_rib.flush(self, stale)
+
+        return stale
+
+    def flush(self):
+        """ Drop all the routes at once, return the dropped routes """
+
+        routes = self.routes
+        self.routes = {}
+
+        if self.stale:
+            routes.update(self.stale)
+            self.stale = {}
+        timer_wheel.cancel(self.stale_timer)
+
+        if self.loc_rib is not None:
+            self.loc_rib.flush(self, routes)
+
+        return routes
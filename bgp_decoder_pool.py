@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import collections
+import multiprocessing
+import struct
+from array import array
+from multiprocessing import shared_memory
+
+import loguru
+
+from bgp_message import decode_prefix_keys
+
+# Raw UPDATE messages waiting for decoder
+INPUT_RING_SIZE = 1 << 20
+
+# Decoded prefix keys, each prefix takes at least one byte on the wire and eight bytes as key
+OUTPUT_RING_SIZE = INPUT_RING_SIZE * 8
+
+# Input offset, message length, end of withdrawn routes, end of attributes, output offset
+REQUEST = struct.Struct("!LLLLL")
+
+# Number of withdrawn and announced prefix keys written to output ring
+RESULT = struct.Struct("!LL")
+
+# Withdrawn prefix count reported for message with malformed NLRI
+DECODE_ERROR = 0xFFFFFFFF
+
+
+class Ring:
+    """ Space allocator for ring buffer, regions get released in the same order they were allocated """
+
+    def __init__(self, size):
+        """ Class constructor """
+
+        self.size = size
+        self.head = 0
+        self.tail = 0
+
+    def reserve(self, length):
+        """ Return offset of contiguous region and position it ends at, None if there is not enough space """
+
+        offset = self.head % self.size
+        head = self.head
+
+        # Region never wraps around, rest of the ring is skipped instead
+        if offset + length > self.size:
+            head += self.size - offset
+            offset = 0
+
+        if head + length - self.tail > self.size:
+            return None
+
+        return offset, head + length
+
+    def commit(self, end):
+        """ Mark reserved region as used """
+
+        self.head = end
+
+    def release(self, end):
+        """ Release all regions up to given position """
+
+        self.tail = end
+
+
+class Decoder:
+    """ Single decoder process with its pair of shared memory rings """
+
+    def __init__(self, context):
+        """ Class constructor """
+
+        self.input = shared_memory.SharedMemory(create=True, size=INPUT_RING_SIZE)
+        self.output = shared_memory.SharedMemory(create=True, size=OUTPUT_RING_SIZE)
+        self.input_ring = Ring(INPUT_RING_SIZE)
+        self.output_ring = Ring(OUTPUT_RING_SIZE)
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=decoder_main, args=(child_connection, self.input.name, self.output.name), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        # Requests are answered in order, each entry is (update view, future, input end, output offset, output end)
+        self.pending = collections.deque()
+
+
+class DecoderPool:
+    """ Pool of processes decoding NLRI of received UPDATE messages, event loop only does framing """
+
+    def __init__(self, processes):
+        """ Class constructor """
+
+        self.logger = loguru.logger.bind(peer="Decoder pool", state="")
+        self.loop = asyncio.get_running_loop()
+
+        context = multiprocessing.get_context("spawn")
+        self.decoders = [Decoder(context) for _ in range(processes)]
+
+        for decoder in self.decoders:
+            self.loop.add_reader(decoder.connection.fileno(), self.receive, decoder)
+
+        self.logger.info(f"Started {processes} decoder processes")
+
+    def submit(self, update):
+        """ Hand UPDATE view over to the least busy decoder, return False if it needs to be decoded on the loop instead """
+
+        data = update.data
+        decoder = min(self.decoders, key=lambda _: len(_.pending))
+
+        input_region = decoder.input_ring.reserve(len(data))
+        output_region = decoder.output_ring.reserve(len(data) * 8)
+        if input_region is None or output_region is None:
+            return False
+
+        decoder.input_ring.commit(input_region[1])
+        decoder.output_ring.commit(output_region[1])
+
+        decoder.input.buf[input_region[0] : input_region[0] + len(data)] = data
+        decoder.connection.send_bytes(REQUEST.pack(input_region[0], len(data), update.withdrawn_end, update.attributes_end, output_region[0]))
+
+        update.decoding = self.loop.create_future()
+        decoder.pending.append((update, update.decoding, input_region[1], output_region[0], output_region[1]))
+        return True
+
+    def receive(self, decoder):
+        """ Collect results of decoder and complete the futures """
+
+        try:
+            while decoder.connection.poll():
+                prefixes_del_count, prefixes_add_count = RESULT.unpack(decoder.connection.recv_bytes())
+                update, future, input_end, output_offset, output_end = decoder.pending.popleft()
+
+                # Malformed NLRI is left to the loop so it gets handled the same way as without the pool
+                if prefixes_del_count != DECODE_ERROR:
+                    keys = array("Q")
+                    keys.frombytes(decoder.output.buf[output_offset : output_offset + (prefixes_del_count + prefixes_add_count) * 8])
+                    update._keys_del = keys[:prefixes_del_count]
+                    update._keys_add = keys[prefixes_del_count:]
+
+                decoder.input_ring.release(input_end)
+                decoder.output_ring.release(output_end)
+                update.decoding = None
+                future.set_result(None)
+
+        except (EOFError, OSError):
+            # Decoder is gone, messages it did not finish get decoded on the loop when accessed
+            self.logger.error("Decoder process terminated")
+            self.loop.remove_reader(decoder.connection.fileno())
+            self.decoders.remove(decoder)
+            for update, future, *_ in decoder.pending:
+                update.decoding = None
+                future.set_result(None)
+            decoder.pending.clear()
+
+    async def wait(self, messages):
+        """ Wait until all the UPDATE messages handed to decoders are decoded """
+
+        for message in messages:
+            if message.update.decoding is not None:
+                await message.update.decoding
+
+    def close(self):
+        """ Stop decoder processes and release shared memory """
+
+        for decoder in self.decoders:
+            self.loop.remove_reader(decoder.connection.fileno())
+            decoder.connection.close()
+            decoder.process.join()
+            for memory in (decoder.input, decoder.output):
+                memory.close()
+                memory.unlink()
+        self.decoders = []
+
+
+def decoder_main(connection, input_name, output_name):
+    """ Decoder process entry point """
+
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    input_buf = input_memory.buf
+    output_buf = output_memory.buf
+
+    while True:
+        try:
+            request = connection.recv_bytes()
+        except EOFError:
+            break
+
+        input_offset, length, withdrawn_end, attributes_end, output_offset = REQUEST.unpack(request)
+        data = input_buf[input_offset : input_offset + length]
+
+        try:
+            keys = array("Q", decode_prefix_keys(data, 21, withdrawn_end))
+            prefixes_del_count = len(keys)
+            keys.extend(decode_prefix_keys(data, attributes_end, length))
+
+        except (ValueError, OverflowError):
+            connection.send_bytes(RESULT.pack(DECODE_ERROR, 0))
+
+        else:
+            output_buf[output_offset : output_offset + len(keys) * 8] = memoryview(keys).cast("B")
+            connection.send_bytes(RESULT.pack(prefixes_del_count, len(keys) - prefixes_del_count))
+
+        del data
+
+    input_buf.release()
+    output_buf.release()
+    input_memory.close()
+    output_memory.close()
@@ -24,11 +24,92 @@
 ############################################################################
 
 
+import time
+
+
 class BgpEvent:
-    def __init__(self, name, message=None, reader=None, writer=None, peer_ip=None, peer_port=None):
-        self.name = name
+    def __init__(self, code, message=None, reader=None, writer=None, peer_ip=None, peer_port=None, messages=None):
+        self.timestamp = time.monotonic()
+        self.code = code
         self.message = message
+        self.messages = messages
         self.reader = reader
         self.writer = writer
         self.peer_ip = peer_ip
         self.peer_port = peer_port
+
+    @property
+    def name(self):
+        """ Human readable event name, to be used for logging only """
+
+        return EVENT_NAMES.get(self.code, f"Event {self.code}: Unknown")
+
+
+# FSM event codes as defined in RFC4271
+MANUAL_START = 1
+MANUAL_STOP = 2
+AUTOMATIC_START = 3
+MANUAL_START_WITH_PASSIVE_TCP_ESTABLISHMENT = 4
+AUTOMATIC_START_WITH_PASSIVE_TCP_ESTABLISHMENT = 5
+AUTOMATIC_START_WITH_DAMP_PEER_OSCILLATIONS = 6
+AUTOMATIC_START_WITH_DAMP_PEER_OSCILLATIONS_AND_PASSIVE_TCP_ESTABLISHMENT = 7
+AUTOMATIC_STOP = 8
+CONNECT_RETRY_TIMER_EXPIRES = 9
+HOLD_TIMER_EXPIRES = 10
+KEEPALIVE_TIMER_EXPIRES = 11
+DELAY_OPEN_TIMER_EXPIRES = 12
+IDLE_HOLD_TIMER_EXPIRES = 13
+TCP_CONNECTION_VALID = 14
+TCP_CR_INVALID = 15
+TCP_CR_ACKED = 16
+TCP_CONNECTION_CONFIRMED = 17
+TCP_CONNECTION_FAILS = 18
+BGP_OPEN = 19
+BGP_OPEN_WITH_DELAY_OPEN_TIMER_RUNNING = 20
+BGP_HEADER_ERR = 21
+BGP_OPEN_MSG_ERR = 22
+OPEN_COLLISION_DUMP = 23
+NOTIF_MSG_VER_ERR = 24
+NOTIF_MSG = 25
+KEEPALIVE_MSG = 26
+UPDATE_MSG = 27
+UPDATE_MSG_ERR = 28
+
+# Events not defined in RFC4271, numbered after the standard ones
+ROUTE_REFRESH_MSG = 29
+ROUTE_REFRESH_MSG_ERR = 30
+ROUTE_REFRESH_REQUEST = 31
+
+EVENT_NAMES = {
+    MANUAL_START: "Event 1: ManualStart",
+    MANUAL_STOP: "Event 2: ManualStop",
+    AUTOMATIC_START: "Event 3: AutomaticStart",
+    MANUAL_START_WITH_PASSIVE_TCP_ESTABLISHMENT: "Event 4: ManualStart_with_PassiveTcpEstablishment",
+    AUTOMATIC_START_WITH_PASSIVE_TCP_ESTABLISHMENT: "Event 5: AutomaticStart_with_PassiveTcpEstablishment",
+    AUTOMATIC_START_WITH_DAMP_PEER_OSCILLATIONS: "Event 6: AutomaticStart_with_DampPeerOscillations",
+    AUTOMATIC_START_WITH_DAMP_PEER_OSCILLATIONS_AND_PASSIVE_TCP_ESTABLISHMENT: "Event 7: AutomaticStart_with_DampPeerOscillations_and_PassiveTcpEstablishment",
+    AUTOMATIC_STOP: "Event 8: AutomaticStop",
+    CONNECT_RETRY_TIMER_EXPIRES: "Event 9: ConnectRetryTimer_Expires",
+    HOLD_TIMER_EXPIRES: "Event 10: HoldTimer_Expires",
+    KEEPALIVE_TIMER_EXPIRES: "Event 11: KeepaliveTimer_Expires",
+    DELAY_OPEN_TIMER_EXPIRES: "Event 12: DelayOpenTimer_Expires",
+    IDLE_HOLD_TIMER_EXPIRES: "Event 13: IdleHoldTimer_Expires",
+    TCP_CONNECTION_VALID: "Event 14: TcpConnection_Valid",
+    TCP_CR_INVALID: "Event 15: Tcp_CR_Invalid",
+    TCP_CR_ACKED: "Event 16: Tcp_CR_Acked",
+    TCP_CONNECTION_CONFIRMED: "Event 17: TcpConnectionConfirmed",
+    TCP_CONNECTION_FAILS: "Event 18: TcpConnectionFails",
+    BGP_OPEN: "Event 19: BGPOpen",
+    BGP_OPEN_WITH_DELAY_OPEN_TIMER_RUNNING: "Event 20: BGPOpen with DelayOpenTimer running",
+    BGP_HEADER_ERR: "Event 21: BGPHeaderErr",
+    BGP_OPEN_MSG_ERR: "Event 22: BGPOpenMsgErr",
+    OPEN_COLLISION_DUMP: "Event 23: OpenCollisionDump",
+    NOTIF_MSG_VER_ERR: "Event 24: NotifMsgVerErr",
+    NOTIF_MSG: "Event 25: NotifMsg",
+    KEEPALIVE_MSG: "Event 26: KeepAliveMsg",
+    UPDATE_MSG: "Event 27: UpdateMsg",
+    UPDATE_MSG_ERR: "Event 28: UpdateMsgErr",
+    ROUTE_REFRESH_MSG: "Event 29: RouteRefreshMsg",
+    ROUTE_REFRESH_MSG_ERR: "Event 30: RouteRefreshMsgErr",
+    ROUTE_REFRESH_REQUEST: "Event 31: RouteRefreshRequest",
+}
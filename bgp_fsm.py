@@ -25,34 +25,93 @@
 
 
 import asyncio
+import collections
+import time
 
 import loguru
 
+import bgp_event
+import bgp_message
+import bgp_metrics
+import network_io
+from bgp_adj_rib_in import AdjRibIn
+from bgp_fsm_active import FSM_ACTIVE
+from bgp_fsm_connect import FSM_CONNECT
+from bgp_fsm_established import FSM_ESTABLISHED
+from bgp_fsm_idle import FSM_IDLE
+from bgp_fsm_openconfirm import FSM_OPENCONFIRM
+from bgp_fsm_opensent import FSM_OPENSENT
+
+# Prebuilt (state, event) -> handler table, events not present in the table are ignored in given state
+FSM_HANDLERS = {
+    (state, event): handler
+    for state, handlers in (
+        ("Idle", FSM_IDLE),
+        ("Connect", FSM_CONNECT),
+        ("Active", FSM_ACTIVE),
+        ("OpenSent", FSM_OPENSENT),
+        ("OpenConfirm", FSM_OPENCONFIRM),
+        ("Established", FSM_ESTABLISHED),
+    )
+    for event, handler in handlers.items()
+}
+
+# Liveness events of established session skip ahead of everything else waiting in the event queue
+PRIORITY_EVENTS = {bgp_event.KEEPALIVE_MSG, bgp_event.KEEPALIVE_TIMER_EXPIRES, bgp_event.HOLD_TIMER_EXPIRES}
+
+# Token put into event queue to wake up the FSM when event gets added to the priority lane
+PRIORITY_WAKEUP = None
+
+# Seconds peers are asked to keep our routes for while we restart, advertised in Graceful Restart capability
+GRACEFUL_RESTART_TIME = 120
+
+# Seconds routes of restarted peer stay stale after the session comes back, End-of-RIB from the peer sweeps them earlier
+STALE_ROUTES_TIME = 360
+
 
 class BgpFsm:
 
-    from bgp_fsm_active import fsm_active
-    from bgp_fsm_connect import fsm_connect
-    from bgp_fsm_established import fsm_established
-    from bgp_fsm_idle import fsm_idle
-    from bgp_fsm_openconfirm import fsm_openconfirm
-    from bgp_fsm_opensent import fsm_opensent
     from bgp_timers import (
-        decrease_connect_retry_timer,
-        decrease_hold_timer,
-        decrease_keepalive_timer,
+        cancel_timers,
+        connect_retry_timer,
+        hold_timer,
+        keepalive_timer,
     )
     from network_io import (
         close_connection,
+        drain_output,
+        enqueue_updates,
+        flush_output,
         message_input_loop,
         open_connection,
+        queue_output,
         send_keepalive_message,
         send_notification_message,
+        send_route_refresh_message,
         send_open_message,
         send_update_message,
+        trace_update,
     )
 
-    def __init__(self, local_id, local_asn, local_hold_time, peer_ip, peer_asn, mode):
+    def __init__(
+        self,
+        local_id,
+        local_asn,
+        local_hold_time,
+        peer_ip,
+        peer_asn,
+        mode,
+        adj_rib_in=None,
+        update_groups=None,
+        export_policy=None,
+        decoder_pool=None,
+        trace_prefixes=False,
+        bgp_port=179,
+        mrt_writer=None,
+        extended_message=True,
+        route_refresh=True,
+        graceful_restart=True,
+    ):
         """ Class constructor """
 
         self.local_id = local_id
@@ -62,18 +121,84 @@ class BgpFsm:
         self.peer_asn = peer_asn
         self.mode = mode
 
+        # Capabilities advertised to the peer
+        self.extended_message = extended_message
+        self.route_refresh = route_refresh
+        self.graceful_restart = graceful_restart
+        self.graceful_restart_time = GRACEFUL_RESTART_TIME
+        self.stale_routes_time = STALE_ROUTES_TIME
+        self.capabilities = []
+        if self.extended_message:
+            self.capabilities.append((bgp_message.CAPABILITY_EXTENDED_MESSAGE, b""))
+        if self.route_refresh:
+            self.capabilities.append((bgp_message.CAPABILITY_ROUTE_REFRESH, b""))
+            self.capabilities.append((bgp_message.CAPABILITY_ENHANCED_ROUTE_REFRESH, b""))
+        if self.graceful_restart:
+            # No forwarding state is kept across restart, peers keep our routes only until the session comes back
+            self.capabilities.append((bgp_message.CAPABILITY_GRACEFUL_RESTART, bgp_message.encode_graceful_restart(self.graceful_restart_time)))
+
+        # Capabilities both sides advertised
+        self.route_refresh_negotiated = False
+        self.enhanced_route_refresh_negotiated = False
+        self.graceful_restart_negotiated = False
+
+        # Seconds routes of the peer are kept stale for when the session drops, zero unless the peer advertised Graceful Restart for IPv4 unicast
+        self.peer_restart_time = 0
+
+        # Peer kept its forwarding state across restart, otherwise its stale routes are swept as soon as it comes back
+        self.peer_forwarding_state = False
+
+        # OPEN message depends on configuration only so it gets encoded once
+        self.open_message = bgp_message.Open(
+            local_id=self.local_id, local_asn=self.local_asn, local_hold_time=self.local_hold_time, opt=bgp_message.encode_capabilities(self.capabilities)
+        ).write()
+
         self.peer_port = 0
 
+        # Port active connections are opened to
+        self.bgp_port = bgp_port
+
         self.peer_id = None
 
-        self.event_queue = []
+        # Routes received from the peer, may be shared with the other FSM of the same session
+        self.adj_rib_in = AdjRibIn(self.peer_ip, self.peer_asn, self.local_asn) if adj_rib_in is None else adj_rib_in
+
+        # Established peer joins the update group matching its export policy and receives routes from the Loc-RIB through it
+        self.update_groups = update_groups
+        self.update_group = None
+        self.export_policy = export_policy
+
+        # Received UPDATE messages get their NLRI decoded by the pool processes if there is one
+        self.decoder_pool = decoder_pool
+
+        # Every received prefix gets logged, meant for troubleshooting of single peer only
+        self.trace_prefixes = trace_prefixes
+
+        # Received messages and state changes get recorded in MRT format if there is a writer
+        self.mrt_writer = mrt_writer
+
+        self.event_queue = asyncio.Queue()
+        self.priority_events = collections.deque()
         self.event_serial_number = 0
 
         self.reader = None
         self.writer = None
         self.tcp_connection_established = False
+        self.rx_buffer = bytearray()
+
+        # Limit for messages in both directions, raised when both sides advertise Extended Message capability
+        self.max_message_size = bgp_message.MAX_MESSAGE_SIZE
+
+        # Outbound messages waiting to be coalesced into single write
+        self.tx_buffer = []
+        self.tx_buffer_size = 0
+        self.tx_flush_scheduled = False
+        self.output_flush_size = network_io.OUTPUT_FLUSH_SIZE
+        self.output_high_water = network_io.OUTPUT_HIGH_WATER
 
         self.state = "Idle"
+        self.state_time = time.monotonic()
+        self.timers = {}
         self.connect_retry_counter = 0
         self.connect_retry_timer = 0
         self.connect_retry_time = 5
@@ -100,10 +225,11 @@ class BgpFsm:
 
         self.connect_retry_time = 5
 
+        # Counters are updated in place, everything else gets read from the FSM when metrics are scraped
+        self.metrics = bgp_metrics.FsmMetrics()
+        bgp_metrics.registry.register(self)
+
         self.task_fsm = asyncio.create_task(self.fsm())
-        self.task_decrease_hold_timer = asyncio.create_task(self.decrease_hold_timer())
-        self.task_decrease_connect_retry_timer = asyncio.create_task(self.decrease_connect_retry_timer())
-        self.task_decrease_keepalive_timer = asyncio.create_task(self.decrease_keepalive_timer())
         self.task_message_input_loop = asyncio.create_task(self.message_input_loop())
 
     def __del__(self):
@@ -111,9 +237,7 @@ class BgpFsm:
 
         self.close_connection()
         self.task_fsm.cancel()
-        self.task_decrease_hold_timer.cancel()
-        self.task_decrease_connect_retry_timer.cancel()
-        self.task_decrease_keepalive_timer.cancel()
+        self.cancel_timers()
         self.task_message_input_loop.cancel()
 
     def enqueue_event(self, event):
@@ -123,22 +247,45 @@ class BgpFsm:
         self.event_serial_number += 1
 
         if self.event_serial_number > 65535:
-            event_serial_number = 1
+            self.event_serial_number = 1
 
         event.serial_number = self.event_serial_number
 
         # In case Stop event is being enqueued flush the queue to expedite it
-        if event.name in {"Event 2: ManualStop", "Event 8: AutomaticStop"}:
-            self.event_queue.clear()
-        self.event_queue.append(event)
+        if event.code in {bgp_event.MANUAL_STOP, bgp_event.AUTOMATIC_STOP}:
+            self.priority_events.clear()
+            while not self.event_queue.empty():
+                self.event_queue.get_nowait()
+
+        if self.state == "Established":
+            # Received UPDATE proves the peer is alive even if it has to wait behind other UPDATEs to be processed
+            if event.code == bgp_event.UPDATE_MSG:
+                self.hold_timer = self.hold_time
+
+            if event.code in PRIORITY_EVENTS:
+                self.priority_events.append(event)
+                self.event_queue.put_nowait(PRIORITY_WAKEUP)
+                self.logger.opt(ansi=True, depth=1).debug("<cyan>[ENQ]</cyan> {} [#{}] priority", event.name, event.serial_number)
+                return
+
+        self.event_queue.put_nowait(event)
+
+        self.logger.opt(ansi=True, depth=1).debug("<cyan>[ENQ]</cyan> {} [#{}]", event.name, event.serial_number)
+
+    async def dequeue_event(self):
+        """ Wait for an event to arrive and pick it from the event queue """
 
-        self.logger.opt(ansi=True, depth=1).debug(f"<cyan>[ENQ]</cyan> {event.name} [#{event.serial_number}]")
+        while True:
+            # Priority lane gets served first, its wakeup tokens left in the queue are just skipped
+            if self.priority_events:
+                event = self.priority_events.popleft()
+                break
 
-    def dequeue_event(self):
-        """ Pick an event from the event queue """
+            event = await self.event_queue.get()
+            if event is not PRIORITY_WAKEUP:
+                break
 
-        event = self.event_queue.pop(0)
-        self.logger.opt(ansi=True, depth=1).debug(f"<cyan>[DEQ]</cyan> {event.name} [#{event.serial_number}]")
+        self.logger.opt(ansi=True, depth=1).debug("<cyan>[DEQ]</cyan> {} [#{}]", event.name, event.serial_number)
         return event
 
     def change_state(self, state):
@@ -147,40 +294,48 @@ class BgpFsm:
         assert state in {"Idle", "Connect", "Active", "OpenSent", "OpenConfirm", "Established"}
 
         self.logger.opt(depth=1).info(f"State: {self.state} -> {state}")
+
+        if self.mrt_writer:
+            self.mrt_writer.record_state_change(self, self.state, state)
+
         self.state = state
+        self.state_time = time.monotonic()
 
         self.logger = loguru.logger.bind(peer=f"{self.mode} {self.peer_ip}:{self.peer_port}", state=self.state)
 
+        if self.update_groups is not None:
+            if self.state == "Established":
+                self.update_groups.join(self)
+            elif self.update_group:
+                self.update_groups.leave(self)
+
         if self.state == "Idle":
             self.connect_retry_timer = 0
             self.keepalive_timer = 0
             self.hold_timer = 0
             self.peer_port = 0
+            self.max_message_size = bgp_message.MAX_MESSAGE_SIZE
+            self.route_refresh_negotiated = False
+            self.enhanced_route_refresh_negotiated = False
+            self.graceful_restart_negotiated = False
+            self.peer_restart_time = 0
+            self.peer_forwarding_state = False
             self.close_connection()
 
     async def fsm(self):
         """ Finite State Machine loop """
 
         while True:
-            if self.event_queue:
-                event = self.dequeue_event()
-
-                if self.state == "Idle":
-                    await self.fsm_idle(event)
-
-                if self.state == "Connect":
-                    await self.fsm_connect(event)
-
-                if self.state == "Active":
-                    await self.fsm_active(event)
+            event = await self.dequeue_event()
 
-                if self.state == "OpenSent":
-                    await self.fsm_opensent(event)
+            # Hold timer restarted after its expiry got queued means the peer is alive after all
+            if event.code == bgp_event.HOLD_TIMER_EXPIRES and self.hold_timer:
+                continue
 
-                if self.state == "OpenConfirm":
-                    await self.fsm_openconfirm(event)
+            handler = FSM_HANDLERS.get((self.state, event.code))
 
-                if self.state == "Established":
-                    await self.fsm_established(event)
+            if handler:
+                await handler(self, event)
 
-            await asyncio.sleep(0.1)
+            # Let timers and message input run between events so the priority lane gets filled while backlog is processed
+            await asyncio.sleep(0)
@@ -28,113 +28,148 @@ import asyncio
 
 import loguru
 
+import bgp_event
 
-async def fsm_connect(self, event):
-    """ Finite State Machine - Connect state """
 
-    if event.name == "Event 2: ManualStop":
-        self.logger.info(event.name)
+async def manual_stop(self, event):
+    """ Stop the connection attempt on operator request """
 
-        # Set ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
+    self.logger.info(event.name)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Set ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
 
-    if event.name == "Event 8: AutomaticStop":
-        self.logger.info(event.name)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def automatic_stop(self, event):
+    """ Stop the connection attempt """
 
-    if event.name == "Event 9: ConnectRetryTimer_Expires":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Drop the TCP connection
-        self.task_open_connection.cancel()
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-        # Initiate a TCP connection to the other BGP peer
-        self.task_open_connection = asyncio.create_task(self.open_connection())
-        await asyncio.sleep(0.1)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Restart the ConnectRetryTimer
-        self.connect_retry_timer = self.connect_retry_time
 
-    if event.name in {"Event 16: Tcp_CR_Acked", "Event 17: TcpConnectionConfirmed"}:
+async def connect_retry_timer_expires(self, event):
+    """ Retry the TCP connection """
 
-        # Take an ownership of the connection
-        self.reader = event.reader
-        self.writer = event.writer
-        self.peer_ip = event.peer_ip
-        self.peer_port = event.peer_port
-        self.tcp_connection_established = True
+    self.logger.info(event.name)
 
-        self.logger = loguru.logger.bind(peer=f"{self.mode} {self.peer_ip}:{self.peer_port}", state=self.state)
+    # Drop the TCP connection
+    self.task_open_connection.cancel()
 
-        self.logger.info(event.name)
+    # Initiate a TCP connection to the other BGP peer
+    self.task_open_connection = asyncio.create_task(self.open_connection())
+    await asyncio.sleep(0.1)
 
-        # Stop the ConnectRetryTimer and set the ConnectRetryTimer to zero
-        self.connect_retry_timer = 0
+    # Restart the ConnectRetryTimer
+    self.connect_retry_timer = self.connect_retry_time
 
-        # Send an open message to the peer
-        await self.send_open_message()
 
-        # Set the holdtimer to a large value, holdtimer value of 4 minutes is suggested
-        self.hold_timer = 240
+async def tcp_connection_established(self, event):
+    """ Take over the TCP connection and send OPEN message """
 
-        # Changes state to OpenSent
-        self.change_state("OpenSent")
+    # Take an ownership of the connection
+    self.reader = event.reader
+    self.writer = event.writer
+    self.peer_ip = event.peer_ip
+    self.peer_port = event.peer_port
+    self.tcp_connection_established = True
 
-    if event.name == "Event 18: TcpConnectionFails":
-        self.logger.info(event.name)
+    # Transport buffer limit drives the backpressure applied to UPDATE senders
+    self.writer.transport.set_write_buffer_limits(high=self.output_high_water)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    self.logger = loguru.logger.bind(peer=f"{self.mode} {self.peer_ip}:{self.peer_port}", state=self.state)
 
-    if event.name in {"Event 21: BGPHeaderErr", "Event 22: BGPOpenMsgErr"}:
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        message = event.message
+    # Stop the ConnectRetryTimer and set the ConnectRetryTimer to zero
+    self.connect_retry_timer = 0
 
-        # If the SendNOTIFICATIONwithoutOPEN attribute is set to TRUE, then the local system
-        # sends a NOTIFICATION message with the appropriate error code
-        if self.send_notification_without_open:
-            await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
+    # Send an open message to the peer
+    await self.send_open_message()
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
+    # Set the holdtimer to a large value, holdtimer value of 4 minutes is suggested
+    self.hold_timer = 240
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Changes state to OpenSent
+    self.change_state("OpenSent")
 
-    if event.name == "Event 24: NotifMsgVerErr":
-        self.logger.info(event.name)
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+async def tcp_connection_fails(self, event):
+    """ Give up on the connection """
 
-        # Change state to Idle
-        self.change_state("Idle")
+    self.logger.info(event.name)
 
-    if event.name in {
-        "Event 8: AutomaticStop",
-        "Event 10: HoldTimer_Expires",
-        "Event 11: KeepaliveTimer_Expires",
-        "Event 13: IdleHoldTimer_Expires",
-        "Event 19: BGPOpen",
-        "Event 23: OpenCollisionDump",
-        "Event 25: NotifMsg",
-        "Event 26: KeepAliveMsg",
-        "Event 27: UpdateMsg",
-        "Event 28: UpdateMsgErr",
-    }:
-        self.logger.info(event.name)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def bgp_header_err(self, event):
+    """ Drop connection after receiving malformed message """
+
+    self.logger.info(event.name)
+
+    message = event.message
+
+    # If the SendNOTIFICATIONwithoutOPEN attribute is set to TRUE, then the local system
+    # sends a NOTIFICATION message with the appropriate error code
+    if self.send_notification_without_open:
+        await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
+
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def notif_msg_ver_err(self, event):
+    """ Drop connection after receiving version error notification """
+
+    self.logger.info(event.name)
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def unexpected_event(self, event):
+    """ Drop connection after receiving event not expected in current state """
+
+    self.logger.info(event.name)
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+FSM_CONNECT = {
+    bgp_event.MANUAL_STOP: manual_stop,
+    bgp_event.AUTOMATIC_STOP: automatic_stop,
+    bgp_event.CONNECT_RETRY_TIMER_EXPIRES: connect_retry_timer_expires,
+    bgp_event.TCP_CR_ACKED: tcp_connection_established,
+    bgp_event.TCP_CONNECTION_CONFIRMED: tcp_connection_established,
+    bgp_event.TCP_CONNECTION_FAILS: tcp_connection_fails,
+    bgp_event.BGP_HEADER_ERR: bgp_header_err,
+    bgp_event.BGP_OPEN_MSG_ERR: bgp_header_err,
+    bgp_event.NOTIF_MSG_VER_ERR: notif_msg_ver_err,
+    bgp_event.HOLD_TIMER_EXPIRES: unexpected_event,
+    bgp_event.KEEPALIVE_TIMER_EXPIRES: unexpected_event,
+    bgp_event.IDLE_HOLD_TIMER_EXPIRES: unexpected_event,
+    bgp_event.BGP_OPEN: unexpected_event,
+    bgp_event.OPEN_COLLISION_DUMP: unexpected_event,
+    bgp_event.NOTIF_MSG: unexpected_event,
+    bgp_event.KEEPALIVE_MSG: unexpected_event,
+    bgp_event.UPDATE_MSG: unexpected_event,
+    bgp_event.UPDATE_MSG_ERR: unexpected_event,
+}
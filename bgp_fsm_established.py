@@ -24,129 +24,265 @@
 ############################################################################
 
 
+import asyncio
+import time
+
+import bgp_event
 import bgp_message
+from bgp_fsm_active import tcp_connection_established
+
+# Loc-RIB re-evaluates prefixes of received batch in slices of this size, loop gets released between them
+LOC_RIB_SLICE = 512
+
+
+async def manual_stop(self, event):
+    """ Close the session on operator request """
+
+    self.logger.info(event.name)
+
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
+
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
+
+    # Set ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def automatic_stop(self, event):
+    """ Close the session """
+
+    self.logger.info(event.name)
+
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
+
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def hold_timer_expires(self, event):
+    """ Close the session after peer went silent """
+
+    self.logger.info(event.name)
+
+    # Send a NOTIFICATION message with the error code Hold Timer Expired
+    await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
+
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
+
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def keepalive_timer_expires(self, event):
+    """ Send KEEPALIVE message to the peer """
+
+    self.logger.info(event.name)
+
+    # Send KEEPALIVE message
+    await self.send_keepalive_message()
+
+    # Restart KeepaliveTimer
+    self.keepalive_timer = self.keepalive_time
+
+
+async def tcp_connection_fails(self, event):
+    """ Give up on the session, keep the routes while the peer restarts if it supports Graceful Restart """
+
+    self.logger.info(event.name)
+
+    # Delete all routes associated with this connection, they stay stale instead if the peer is expected to come back
+    if self.peer_restart_time:
+        self.adj_rib_in.retain(self.peer_restart_time)
+        self.logger.info(f"{len(self.adj_rib_in.stale)} routes kept stale for up to {self.peer_restart_time}s")
+    else:
+        self.adj_rib_in.flush()
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def tcp_connection_confirmed(self, event):
+    """ Peer that negotiated Graceful Restart connected again, it restarted and the old connection is gone """
+
+    # Close the old connection, routes stay stale until the peer comes back with End-of-RIB
+    await tcp_connection_fails(self, event)
+
+    # Take over the new connection and send OPEN message
+    await tcp_connection_established(self, event)
+
+
+async def notif_msg(self, event):
+    """ Give up on the session after peer sent NOTIFICATION """
+
+    self.logger.info(event.name)
+
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def keepalive_msg(self, event):
+    """ Refresh the session """
+
+    self.logger.info(event.name)
 
+    # Restart the HoldTimer
+    self.hold_timer = self.hold_time
 
-async def fsm_established(self, event):
-    """ Finite State Machine - Established state """
 
-    if event.name == "Event 2: ManualStop":
-        self.logger.info(event.name)
+async def update_msg(self, event):
+    """ Process batch of UPDATE messages received from the peer """
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+    # Messages passed to decoder pool need their prefixes decoded first, loop stays free meanwhile
+    if self.decoder_pool:
+        await self.decoder_pool.wait(event.messages)
 
-        # Delete all routes associated with this connection
-        pass
+    # Process the messages, single extended message alone may carry over ten thousand prefixes
+    keys = self.adj_rib_in.receive(event.messages)
 
-        # Set ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
+    loc_rib = self.adj_rib_in.loc_rib
+    if loc_rib is not None:
+        for i in range(0, len(keys), LOC_RIB_SLICE):
+            if i:
+                await asyncio.sleep(0)
+            loc_rib.update(keys[i : i + LOC_RIB_SLICE])
 
-        # Change state to Idle
-        self.change_state("Idle")
+    self.logger.info("{} x {} - {} prefixes", event.name, len(event.messages), len(keys))
 
-    if event.name == "Event 8: AutomaticStop":
-        self.logger.info(event.name)
+    # End-of-RIB completes the restart of the peer, routes it did not announce again are gone
+    if self.adj_rib_in.restarting and any(_.update.end_of_rib for _ in event.messages):
+        stale = self.adj_rib_in.sweep_stale()
+        self.logger.info(f"End-of-RIB received, {len(stale)} stale routes removed")
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+    self.metrics.observe_update_latency(time.monotonic() - event.timestamp)
 
-        # Delete all routes associated with this connection
-        pass
+    # Restart HoldTimer
+    self.hold_timer = self.hold_time
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def route_refresh_msg(self, event):
+    """ Send the table again on peer request, track stale routes between BoRR and EoRR sent by the peer """
 
-    if event.name == "Event 10: HoldTimer_Expires":
-        self.logger.info(event.name)
+    message = event.message
 
-        # Send a NOTIFICATION message with the error code Hold Timer Expired
-        await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
+    # Only IPv4 unicast gets exchanged, requests for anything else and messages without negotiated capability are ignored
+    if not self.route_refresh_negotiated or (message.afi, message.safi) != (bgp_message.AFI_IPV4, bgp_message.SAFI_UNICAST):
+        self.logger.info(f"{event.name} - afi: {message.afi}, safi: {message.safi}, subtype: {message.subtype} ignored")
+        return
 
-        # Delete all routes associated with this connection
-        pass
+    if message.subtype == bgp_message.ROUTE_REFRESH_REQUEST:
+        self.logger.info(f"{event.name} - request")
+        if self.update_group:
+            self.update_group.refresh(self, enhanced=self.enhanced_route_refresh_negotiated)
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
+    elif message.subtype == bgp_message.BEGINNING_OF_ROUTE_REFRESH and self.enhanced_route_refresh_negotiated:
+        # Routes not announced again before EoRR are gone
+        self.adj_rib_in.mark_stale()
+        self.logger.info(f"{event.name} - BoRR, {len(self.adj_rib_in.stale)} routes marked stale")
 
-        # Change state to Idle
-        self.change_state("Idle")
+    elif message.subtype == bgp_message.END_OF_ROUTE_REFRESH and self.enhanced_route_refresh_negotiated:
+        stale = self.adj_rib_in.sweep_stale()
+        self.logger.info(f"{event.name} - EoRR, {len(stale)} stale routes removed")
 
-    if event.name == "Event 11: KeepaliveTimer_Expires":
-        self.logger.info(event.name)
+    else:
+        self.logger.info(f"{event.name} - subtype: {message.subtype} ignored")
 
-        # Send KEEPALIVE message
-        await self.send_keepalive_message()
+    # Restart HoldTimer
+    self.hold_timer = self.hold_time
 
-        # Restart KeepaliveTimer
-        self.keepalive_timer = self.keepalive_time
 
-    if event.name in {"Event 18: TcpConnectionFails", "Event 24: NotifMsgVerErr", "Event 25: NotifMsg"}:
-        self.logger.info(event.name)
+async def route_refresh_request(self, event):
+    """ Ask the peer to send its table again """
 
-        # Delete all routes associated with this connection
-        pass
+    self.logger.info(event.name)
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    if self.route_refresh_negotiated:
+        await self.send_route_refresh_message(bgp_message.ROUTE_REFRESH_REQUEST)
 
-        # Change state to Idle
-        self.change_state("Idle")
 
-    if event.name == "Event 26: KeepAliveMsg":
-        self.logger.info(event.name)
+async def update_msg_err(self, event):
+    """ Close the session after receiving malformed UPDATE or ROUTE-REFRESH message """
 
-        # Restart the HoldTimer
-        self.hold_timer = self.hold_time
+    self.logger.info(event.name)
 
-    if event.name == "Event 27: UpdateMsg":
-        self.logger.info(event.name)
+    # Send a NOTIFICATION message with an Update error
+    message = event.message
+    await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
 
-        # Process the message,
-        pass
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
 
-        # Restart HoldTimer
-        self.hold_timer = self.hold_time
+    # Release all BGP resources
+    pass
 
-    if event.name == "Event 28: UpdateMsgErr":
-        self.logger.info(event.name)
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-        # Send a NOTIFICATION message with an Update error
-        pass
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Delete all routes associated with this connection
-        pass
 
-        # Release all BGP resources
-        pass
+async def unexpected_event(self, event):
+    """ Close the session after receiving event not expected in current state """
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    self.logger.info(event.name)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Send a NOTIFICATION message with the Error Code Finite State Machine Error
+    await self.send_notification_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
 
-    if event.name in {
-        "Event 9: ConnectRetryTimer_Expires",
-        "Event 12: DelayOpenTimer_Expires",
-        "Event 13: IdleHoldTimer_Expires",
-        "Event 20: BGPOpen with DelayOpenTimer running",
-        "Event 21: BGPHeaderErr",
-        "Event 22: BGPOpenMsgErr",
-    }:
-        self.logger.info(event.name)
+    # Delete all routes associated with this connection
+    self.adj_rib_in.flush()
 
-        # Send a NOTIFICATION message with the Error Code Finite State Machine Error
-        self.send_notificaion_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-        # Delete all routes associated with this connection
-        pass
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+FSM_ESTABLISHED = {
+    bgp_event.MANUAL_STOP: manual_stop,
+    bgp_event.AUTOMATIC_STOP: automatic_stop,
+    bgp_event.HOLD_TIMER_EXPIRES: hold_timer_expires,
+    bgp_event.KEEPALIVE_TIMER_EXPIRES: keepalive_timer_expires,
+    bgp_event.TCP_CONNECTION_FAILS: tcp_connection_fails,
+    bgp_event.TCP_CONNECTION_CONFIRMED: tcp_connection_confirmed,
+    bgp_event.NOTIF_MSG_VER_ERR: notif_msg,
+    bgp_event.NOTIF_MSG: notif_msg,
+    bgp_event.KEEPALIVE_MSG: keepalive_msg,
+    bgp_event.UPDATE_MSG: update_msg,
+    bgp_event.UPDATE_MSG_ERR: update_msg_err,
+    bgp_event.ROUTE_REFRESH_MSG: route_refresh_msg,
+    bgp_event.ROUTE_REFRESH_MSG_ERR: update_msg_err,
+    bgp_event.ROUTE_REFRESH_REQUEST: route_refresh_request,
+    bgp_event.CONNECT_RETRY_TIMER_EXPIRES: unexpected_event,
+    bgp_event.DELAY_OPEN_TIMER_EXPIRES: unexpected_event,
+    bgp_event.IDLE_HOLD_TIMER_EXPIRES: unexpected_event,
+    bgp_event.BGP_OPEN_WITH_DELAY_OPEN_TIMER_RUNNING: unexpected_event,
+    bgp_event.BGP_HEADER_ERR: unexpected_event,
+    bgp_event.BGP_OPEN_MSG_ERR: unexpected_event,
+}
@@ -26,44 +26,70 @@
 
 import asyncio
 
+import bgp_event
 
-async def fsm_idle(self, event):
-    """ Finite State Machine - Idle state """
 
-    if event.name == "Event 1: ManualStart" or (event.name == "Event 3: AutomaticStart" and self.allow_automatic_start):
-        self.logger.info(event.name)
+async def manual_start(self, event):
+    """ Start connecting to the peer """
 
-        # Sets ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
+    if event.code == bgp_event.AUTOMATIC_START and not self.allow_automatic_start:
+        return
 
-        # Starts the ConnectRetryTimer with the initial value
-        self.connect_retry_timer = self.connect_retry_time
+    self.logger.info(event.name)
 
-        # Initiate a TCP connection to the other BGP peer
-        self.task_open_connection = asyncio.create_task(self.open_connection())
+    # Sets ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
 
-        # Listen for a connection that may be initiated by the remote BGP peer
-        pass
+    # Starts the ConnectRetryTimer with the initial value
+    self.connect_retry_timer = self.connect_retry_time
 
-        # Change state to Connect
-        self.change_state("Connect")
+    # Initiate a TCP connection to the other BGP peer
+    self.task_open_connection = asyncio.create_task(self.open_connection())
 
-    if event.name == "Event 4: ManualStart_with_PassiveTcpEstablishment" or (
-        event.name == "Event 5: AutomaticStart_with_PassiveTcpEstablishment" and self.allow_automatic_start
-    ):
-        self.logger.info(event.name)
+    # Listen for a connection that may be initiated by the remote BGP peer
+    pass
 
-        # Set the PassiveTcpEstablishment attribute to True
-        self.passive_tcp_establishment = True
+    # Change state to Connect
+    self.change_state("Connect")
 
-        # Sets ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
 
-        # Starts the ConnectRetryTimer with the initial value
-        self.connect_retry_timer = self.connect_retry_time
+async def manual_start_with_passive_tcp_establishment(self, event):
+    """ Start waiting for the peer to connect """
 
-        # Listen for a connection that may be initiated by the remote BGP peer
-        pass
+    if event.code == bgp_event.AUTOMATIC_START_WITH_PASSIVE_TCP_ESTABLISHMENT and not self.allow_automatic_start:
+        return
 
-        # Change state to Active
-        self.change_state("Active")
+    self.logger.info(event.name)
+
+    # Set the PassiveTcpEstablishment attribute to True
+    self.passive_tcp_establishment = True
+
+    # Sets ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
+
+    # Starts the ConnectRetryTimer with the initial value
+    self.connect_retry_timer = self.connect_retry_time
+
+    # Listen for a connection that may be initiated by the remote BGP peer
+    pass
+
+    # Change state to Active
+    self.change_state("Active")
+
+
+async def tcp_connection_confirmed(self, event):
+    """ Refuse connection handed over after the FSM stopped listening """
+
+    self.logger.info(event.name)
+
+    # Any incoming connection is refused in Idle state
+    event.writer.close()
+
+
+FSM_IDLE = {
+    bgp_event.MANUAL_START: manual_start,
+    bgp_event.AUTOMATIC_START: manual_start,
+    bgp_event.MANUAL_START_WITH_PASSIVE_TCP_ESTABLISHMENT: manual_start_with_passive_tcp_establishment,
+    bgp_event.AUTOMATIC_START_WITH_PASSIVE_TCP_ESTABLISHMENT: manual_start_with_passive_tcp_establishment,
+    bgp_event.TCP_CONNECTION_CONFIRMED: tcp_connection_confirmed,
+}
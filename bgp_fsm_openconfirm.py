@@ -24,110 +24,156 @@
 ############################################################################
 
 
+import bgp_event
 import bgp_message
 
 
-async def fsm_openconfirm(self, event):
-    """ Finite State Machine - OpenConfirm state """
+async def manual_stop(self, event):
+    """ Close the session on operator request """
 
-    if event.name == "Event 2: ManualStop":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
 
-        # Set ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
+    # Set ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Change state to Idle
+    self.change_state("Idle")
 
-    if event.name == "Event 8: AutomaticStop":
-        self.logger.info(event.name)
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+async def automatic_stop(self, event):
+    """ Close the session """
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    self.logger.info(event.name)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
 
-    if event.name == "Event 10: HoldTimer_Expires":
-        self.logger.info(event.name)
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-        # Send a NOTIFICATION message with the error code Hold Timer Expired
-        await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def hold_timer_expires(self, event):
+    """ Close the session after peer went silent """
 
-    if event.name == "Event 11: KeepaliveTimer_Expires":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Send KEEPALIVE message
-        await self.send_keepalive_message()
+    # Send a NOTIFICATION message with the error code Hold Timer Expired
+    await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
 
-        # Restart the KeepaliveTimer
-        self.keepalive_timer = self.keepalive_time
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
 
-    if event.name in {"Event 18: TcpConnectionFails", "Event 25: NotifMsg"}:
-        self.logger.info(event.name)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def keepalive_timer_expires(self, event):
+    """ Send KEEPALIVE message to the peer """
 
-    if event.name in {"Event 21: BGPHeaderErr", "Event 22: BGPOpenMsgErr"}:
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        message = event.message
+    # Send KEEPALIVE message
+    await self.send_keepalive_message()
 
-        # Send a NOTIFICATION message with the appropriate error code
-        await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
+    # Restart the KeepaliveTimer
+    self.keepalive_timer = self.keepalive_time
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def tcp_connection_fails(self, event):
+    """ Give up on the session """
 
-    if event.name == "Event 24: NotifMsgVerErr":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-    if event.name == "Event 26: KeepAliveMsg":
-        self.logger.info(event.name)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Restart the HoldTimer
-        self.hold_timer = self.hold_time
 
-        # Change state to Established
-        self.change_state("Established")
+async def bgp_header_err(self, event):
+    """ Close the session after receiving malformed message """
 
-    if event.name in {
-        "Event 9: ConnectRetryTimer_Expires",
-        "Event 12: DelayOpenTimer_Expires",
-        "Event 13: IdleHoldTimer_Expires",
-        "Event 20: BGPOpen with DelayOpenTimer running",
-        "Event 27: UpdateMsg",
-        "Event 28: UpdateMsgErr",
-    }:
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Send the NOTIFICATION with the Error Code Finite State Machine Error
-        await self.send_notification_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
+    message = event.message
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    # Send a NOTIFICATION message with the appropriate error code
+    await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
 
-        # Chhange state to Idle
-        self.switch_state("Idle")
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def notif_msg_ver_err(self, event):
+    """ Close the session after receiving version error notification """
+
+    self.logger.info(event.name)
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def keepalive_msg(self, event):
+    """ Complete the session establishment """
+
+    self.logger.info(event.name)
+
+    # Restart the HoldTimer
+    self.hold_timer = self.hold_time
+
+    # Peer came back after restart, its stale routes wait for End-of-RIB unless it lost forwarding state meanwhile
+    if self.adj_rib_in.restarting:
+        if self.peer_forwarding_state:
+            self.adj_rib_in.retain(self.stale_routes_time)
+            self.logger.info(f"{len(self.adj_rib_in.stale)} stale routes kept until End-of-RIB for up to {self.stale_routes_time}s")
+        else:
+            stale = self.adj_rib_in.sweep_stale()
+            self.logger.info(f"Peer did not preserve forwarding state, {len(stale)} stale routes removed")
+
+    # Change state to Established
+    self.change_state("Established")
+
+
+async def unexpected_event(self, event):
+    """ Close the session after receiving event not expected in current state """
+
+    self.logger.info(event.name)
+
+    # Send the NOTIFICATION with the Error Code Finite State Machine Error
+    await self.send_notification_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Chhange state to Idle
+    self.change_state("Idle")
+
+
+FSM_OPENCONFIRM = {
+    bgp_event.MANUAL_STOP: manual_stop,
+    bgp_event.AUTOMATIC_STOP: automatic_stop,
+    bgp_event.HOLD_TIMER_EXPIRES: hold_timer_expires,
+    bgp_event.KEEPALIVE_TIMER_EXPIRES: keepalive_timer_expires,
+    bgp_event.TCP_CONNECTION_FAILS: tcp_connection_fails,
+    bgp_event.NOTIF_MSG: tcp_connection_fails,
+    bgp_event.BGP_HEADER_ERR: bgp_header_err,
+    bgp_event.BGP_OPEN_MSG_ERR: bgp_header_err,
+    bgp_event.NOTIF_MSG_VER_ERR: notif_msg_ver_err,
+    bgp_event.KEEPALIVE_MSG: keepalive_msg,
+    bgp_event.CONNECT_RETRY_TIMER_EXPIRES: unexpected_event,
+    bgp_event.DELAY_OPEN_TIMER_EXPIRES: unexpected_event,
+    bgp_event.IDLE_HOLD_TIMER_EXPIRES: unexpected_event,
+    bgp_event.BGP_OPEN_WITH_DELAY_OPEN_TIMER_RUNNING: unexpected_event,
+    bgp_event.UPDATE_MSG: unexpected_event,
+    bgp_event.UPDATE_MSG_ERR: unexpected_event,
+}
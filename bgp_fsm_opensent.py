@@ -24,135 +24,187 @@
 ############################################################################
 
 
+import bgp_event
 import bgp_message
 
 
-async def fsm_opensent(self, event):
-    """ Finite State Machine - OpenSent state """
+async def manual_stop(self, event):
+    """ Close the session on operator request """
 
-    if event.name == "Event 2: ManualStop":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
 
-        # Set ConnectRetryCounter to zero
-        self.connect_retry_counter = 0
+    # Set ConnectRetryCounter to zero
+    self.connect_retry_counter = 0
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Change state to Idle
+    self.change_state("Idle")
 
-    if event.name == "Event 8: AutomaticStop":
-        self.logger.info(event.name)
 
-        # Send the NOTIFICATION with a Cease
-        await self.send_notification_message(bgp_message.CEASE)
+async def automatic_stop(self, event):
+    """ Close the session """
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    self.logger.info(event.name)
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Send the NOTIFICATION with a Cease
+    await self.send_notification_message(bgp_message.CEASE)
 
-    if event.name == "Event 10: HoldTimer_Expires":
-        self.logger.info(event.name)
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
 
-        # Send a NOTIFICATION message with the error code Hold Timer Expired
-        await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
 
-        # Change state to Idle
-        self.change_state("Idle")
+async def hold_timer_expires(self, event):
+    """ Close the session after peer went silent """
 
-    if event.name == "Event 18: TcpConnectionFails":
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        # Close the TCP connection
-        self.close_connection()
+    # Send a NOTIFICATION message with the error code Hold Timer Expired
+    await self.send_notification_message(bgp_message.HOLD_TIMER_EXPIRED)
 
-        # Restart the ConnectRetryTimer
-        self.connect_retry_timer = self.connect_retry_time
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
 
-        # Set the HoldTimer to zero (not required by RFC4271)0
-        self.hold_timer = 0
+    # Change state to Idle
+    self.change_state("Idle")
 
-        # Stop HoldTimer (not required by RFC4271)
-        self.hold_timer = 0
 
-        # Stop KeepaliveTimer (not required by RFC4271)
-        self.keepalive_timer = 0
+async def tcp_connection_fails(self, event):
+    """ Go back to waiting for the connection """
 
-        # Change state to Active
-        self.change_state("Active")
+    self.logger.info(event.name)
 
-    if event.name == "Event 19: BGPOpen":
-        self.logger.info(event.name)
+    # Close the TCP connection
+    self.close_connection()
 
-        message = event.message
+    # Restart the ConnectRetryTimer
+    self.connect_retry_timer = self.connect_retry_time
 
-        # Set the BGP ConnectRetryTimer to zero
-        self.connect_retry_timer = 0
+    # Set the HoldTimer to zero (not required by RFC4271)0
+    self.hold_timer = 0
 
-        # Send a KeepAlive message
-        await self.send_keepalive_message()
+    # Stop HoldTimer (not required by RFC4271)
+    self.hold_timer = 0
 
-        # Set the HoldTimer according to the negotiated value
-        self.hold_time = min(self.local_hold_time, message.hold_time)
-        self.hold_timer = self.hold_time
+    # Stop KeepaliveTimer (not required by RFC4271)
+    self.keepalive_timer = 0
 
-        # Set a KeepAliveTimer
-        self.keepalive_time = self.hold_time // 3
-        self.keepalive_timer = self.keepalive_time
+    # Change state to Active
+    self.change_state("Active")
 
-        # Save the peer BGP ID to be used for collision detection
-        self.peer_id = message.id
 
-        # Change state to OpenConfirm
-        self.change_state("OpenConfirm")
+async def bgp_open(self, event):
+    """ Accept peer's OPEN message and negotiate session parameters """
 
-    if event.name in {"Event 21: BGPHeaderErr", "Event 22: BGPOpenMsgErr"}:
-        self.logger.info(event.name)
+    self.logger.info(event.name)
 
-        message = event.message
+    message = event.message
 
-        # Send a NOTIFICATION message with the appropriate error code
-        await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
+    # Set the BGP ConnectRetryTimer to zero
+    self.connect_retry_timer = 0
 
-        # Increment ConnectRetryCounter
-        self.connect_retry_counter += 1
+    # Send a KeepAlive message
+    await self.send_keepalive_message()
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Set the HoldTimer according to the negotiated value
+    self.hold_time = min(self.local_hold_time, message.hold_time)
+    self.hold_timer = self.hold_time
 
-    if event.name == "Event 24: NotifMsgVerErr":
-        self.logger.info(event.name)
+    # Set a KeepAliveTimer
+    self.keepalive_time = self.hold_time // 3
+    self.keepalive_timer = self.keepalive_time
 
-        # Change state to Idle
-        self.change_state("Idle")
+    # Save the peer BGP ID to be used for collision detection and best route selection
+    self.peer_id = message.id
+    self.adj_rib_in.peer_id = message.id
 
-    if event.name in {
-        "Event 9: ConnectRetryTimer_Expires",
-        "Event 11: KeepaliveTimer_Expires",
-        "Event 12: DelayOpenTimer_Expires",
-        "Event 13: IdleHoldTimer_Expires",
-        "Event 20: BGPOpen with DelayOpenTimer running",
-        "Event 25: NotifMsg",
-        "Event 26: KeepAliveMsg",
-        "Event 27: UpdateMsg",
-        "Event 28: UpdateMsgErr",
-    }:
-        self.logger.info(event.name)
+    # Messages up to 65535 bytes are allowed only if both sides advertised Extended Message capability
+    if self.extended_message and bgp_message.CAPABILITY_EXTENDED_MESSAGE in message.capabilities:
+        self.max_message_size = bgp_message.EXTENDED_MESSAGE_SIZE
+        self.logger.info(f"Extended messages up to {self.max_message_size} bytes negotiated")
 
-        # Send the NOTIFICATION with the Error Code Finite State Machine Error
-        await self.send_notification_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
+    # Routes can be requested again without session reset, Enhanced Route Refresh also lets stale routes get swept afterwards
+    self.route_refresh_negotiated = self.route_refresh and bgp_message.CAPABILITY_ROUTE_REFRESH in message.capabilities
+    self.enhanced_route_refresh_negotiated = self.route_refresh_negotiated and bgp_message.CAPABILITY_ENHANCED_ROUTE_REFRESH in message.capabilities
 
-        # Set ConnecRetryTimer to zro
-        self.connect_retry_timer = 0
+    # Routes of gracefully restarting peer are kept stale until it comes back and sends End-of-RIB
+    if self.graceful_restart and bgp_message.CAPABILITY_GRACEFUL_RESTART in message.capabilities:
+        self.graceful_restart_negotiated = True
+        restart_time, address_families = bgp_message.decode_graceful_restart(message.capabilities[bgp_message.CAPABILITY_GRACEFUL_RESTART])
+        flags = address_families.get((bgp_message.AFI_IPV4, bgp_message.SAFI_UNICAST))
+        if flags is not None:
+            self.peer_restart_time = restart_time
+            self.peer_forwarding_state = bool(flags & bgp_message.GRACEFUL_RESTART_FORWARDING_STATE)
+        self.logger.info(f"Graceful Restart negotiated - peer restart time: {self.peer_restart_time}s, forwarding state: {self.peer_forwarding_state}")
 
-        # Increment the ConnectRetryCounter by 1
-        self.connect_retry_counter += 1
+    # Change state to OpenConfirm
+    self.change_state("OpenConfirm")
 
-        # Chhange state to Idle
-        self.change_state("Idle")
+
+async def bgp_header_err(self, event):
+    """ Close the session after receiving malformed message """
+
+    self.logger.info(event.name)
+
+    message = event.message
+
+    # Send a NOTIFICATION message with the appropriate error code
+    await self.send_notification_message(message.message_error_code, message.message_error_subcode, message.message_error_data)
+
+    # Increment ConnectRetryCounter
+    self.connect_retry_counter += 1
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def notif_msg_ver_err(self, event):
+    """ Close the session after receiving version error notification """
+
+    self.logger.info(event.name)
+
+    # Change state to Idle
+    self.change_state("Idle")
+
+
+async def unexpected_event(self, event):
+    """ Close the session after receiving event not expected in current state """
+
+    self.logger.info(event.name)
+
+    # Send the NOTIFICATION with the Error Code Finite State Machine Error
+    await self.send_notification_message(bgp_message.FINITE_STATE_MACHINE_ERROR)
+
+    # Set ConnecRetryTimer to zro
+    self.connect_retry_timer = 0
+
+    # Increment the ConnectRetryCounter by 1
+    self.connect_retry_counter += 1
+
+    # Chhange state to Idle
+    self.change_state("Idle")
+
+
+FSM_OPENSENT = {
+    bgp_event.MANUAL_STOP: manual_stop,
+    bgp_event.AUTOMATIC_STOP: automatic_stop,
+    bgp_event.HOLD_TIMER_EXPIRES: hold_timer_expires,
+    bgp_event.TCP_CONNECTION_FAILS: tcp_connection_fails,
+    bgp_event.BGP_OPEN: bgp_open,
+    bgp_event.BGP_HEADER_ERR: bgp_header_err,
+    bgp_event.BGP_OPEN_MSG_ERR: bgp_header_err,
+    bgp_event.NOTIF_MSG_VER_ERR: notif_msg_ver_err,
+    bgp_event.CONNECT_RETRY_TIMER_EXPIRES: unexpected_event,
+    bgp_event.KEEPALIVE_TIMER_EXPIRES: unexpected_event,
+    bgp_event.DELAY_OPEN_TIMER_EXPIRES: unexpected_event,
+    bgp_event.IDLE_HOLD_TIMER_EXPIRES: unexpected_event,
+    bgp_event.BGP_OPEN_WITH_DELAY_OPEN_TIMER_RUNNING: unexpected_event,
+    bgp_event.NOTIF_MSG: unexpected_event,
+    bgp_event.KEEPALIVE_MSG: unexpected_event,
+    bgp_event.UPDATE_MSG: unexpected_event,
+    bgp_event.UPDATE_MSG_ERR: unexpected_event,
+}
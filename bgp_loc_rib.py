@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import socket
+
+
+def peer_preference(adj_rib_in):
+    """ Final tie breaker, lower BGP ID and then lower peer address wins """
+
+    return socket.inet_aton(adj_rib_in.peer_id or "255.255.255.255"), socket.inet_aton(adj_rib_in.peer_ip)
+
+
+def select_best(candidates):
+    """ RFC4271 decision process, candidates are (adj_rib_in, attribute_set) tuples """
+
+    if len(candidates) == 1:
+        return candidates[0]
+
+    # Highest LOCAL_PREF
+    value = max(_[1].local_pref for _ in candidates)
+    candidates = [_ for _ in candidates if _[1].local_pref == value]
+
+    # Shortest AS_PATH
+    if len(candidates) > 1:
+        value = min(_[1].as_path_len for _ in candidates)
+        candidates = [_ for _ in candidates if _[1].as_path_len == value]
+
+    # Lowest ORIGIN
+    if len(candidates) > 1:
+        value = min(_[1].origin for _ in candidates)
+        candidates = [_ for _ in candidates if _[1].origin == value]
+
+    # Lowest MED, compared only between routes received from the same neighbor AS
+    if len(candidates) > 1:
+        candidates = [
+            _ for _ in candidates if not any(__[1].neighbor_as == _[1].neighbor_as and __[1].med < _[1].med for __ in candidates)
+        ]
+
+    # Routes received from eBGP peers over routes received from iBGP peers
+    if len(candidates) > 1 and any(_[0].ebgp for _ in candidates):
+        candidates = [_ for _ in candidates if _[0].ebgp]
+
+    # Lowest BGP ID, lowest peer address
+    return min(candidates, key=lambda _: peer_preference(_[0]))
+
+
+class LocRib:
+    """ Best routes selected from the Adj-RIB-In of every peer """
+
+    def __init__(self):
+        """ Class constructor """
+
+        self.adj_ribs_in = []
+        self.routes = {}
+        self.subscribers = []
+
+    def __len__(self):
+        return len(self.routes)
+
+    def register(self, adj_rib_in):
+        """ Add peer's Adj-RIB-In to the decision process """
+
+        self.adj_ribs_in.append(adj_rib_in)
+
+    def subscribe(self):
+        """ Return queue receiving batches of (key, adj_rib_in, attribute_set) changes, starting with the whole current table """
+
+        queue = asyncio.Queue()
+        if self.routes:
+            queue.put_nowait([(key, adj_rib_in, attribute_set) for key, (adj_rib_in, attribute_set) in self.routes.items()])
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """ Stop publishing changes to the queue """
+
+        self.subscribers.remove(queue)
+
+    def update(self, keys):
+        """ Re-evaluate best route for given prefixes only and publish the ones that changed """
+
+        routes = self.routes
+        adj_ribs_in = self.adj_ribs_in
+        changes = []
+
+        # Stale routes stay candidates until the peer refreshes them or they get swept
+        stale = [_ for _ in adj_ribs_in if _.stale]
+
+        for key in keys:
+            candidates = [(_, _.routes[key]) for _ in adj_ribs_in if key in _.routes]
+            if stale:
+                candidates += [(_, _.stale[key]) for _ in stale if key in _.stale]
+
+            if candidates:
+                best = select_best(candidates)
+                current = routes.get(key)
+                if current is None or current[0] is not best[0] or current[1] is not best[1]:
+                    routes[key] = best
+                    changes.append((key, best[0], best[1]))
+
+            elif routes.pop(key, None):
+                changes.append((key, None, None))
+
+        if changes:
+            for queue in self.subscribers:
+                queue.put_nowait(changes)
+
+        return changes
+
+    def flush(self, adj_rib_in, routes):
+        """ Re-evaluate prefixes dropped from the Adj-RIB-In, only those for which it provided the best route """
+
+        best = self.routes
+        return self.update([key for key in routes if best.get(key, (None,))[0] is adj_rib_in])
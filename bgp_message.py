@@ -26,14 +26,22 @@
 
 import socket
 import struct
+import weakref
 from ipaddress import IPv4Address
 
 OPEN = 1
 UPDATE = 2
 NOTIFICATION = 3
 KEEPALIVE = 4
+ROUTE_REFRESH = 5
 
 HEADER_SIZE = 19
+MAX_MESSAGE_SIZE = 4096
+EXTENDED_MESSAGE_SIZE = 65535
+MARKER = b"\xff" * 16
+
+# Marker, length and type, packed straight into preallocated message buffer
+HEADER = struct.Struct("!16sHB")
 
 # Error codes
 MESSAGE_HEADER_ERROR = 1
@@ -42,6 +50,7 @@ UPDATE_MESSAGE_ERROR = 3
 HOLD_TIMER_EXPIRED = 4
 FINITE_STATE_MACHINE_ERROR = 5
 CEASE = 6
+ROUTE_REFRESH_MESSAGE_ERROR = 7
 
 # Meassage header error subcodes
 CONNECTION_NOT_SYNCHRONISED = 1
@@ -55,6 +64,32 @@ BAD_BGP_IDENTIFIER = 3
 UNSUPPORTED_OPTIONAL_PARAMETER = 4
 UNACCEPTABLE_HOLD_TIME = 6
 
+# OPEN message optional parameter types
+OPT_PARAM_CAPABILITIES = 2
+
+# Capability codes
+CAPABILITY_ROUTE_REFRESH = 2
+CAPABILITY_EXTENDED_MESSAGE = 6
+CAPABILITY_GRACEFUL_RESTART = 64
+CAPABILITY_ENHANCED_ROUTE_REFRESH = 70
+
+# Graceful Restart capability flags, restart state shares 16 bit field with restart time, forwarding state follows each AFI/SAFI
+GRACEFUL_RESTART_STATE = 0x8000
+GRACEFUL_RESTART_TIME_MASK = 0x0FFF
+GRACEFUL_RESTART_FORWARDING_STATE = 0x80
+
+# ROUTE-REFRESH message subtypes
+ROUTE_REFRESH_REQUEST = 0
+BEGINNING_OF_ROUTE_REFRESH = 1
+END_OF_ROUTE_REFRESH = 2
+
+# ROUTE-REFRESH message error subcodes
+INVALID_MESSAGE_LENGTH = 1
+
+# Address family of the only routes supported
+AFI_IPV4 = 1
+SAFI_UNICAST = 1
+
 # UPDATE message error subcodes
 MALFORMED_ATTRIBUTE_LIST = 1
 UNRECOGNIZED_WELL_KNOWN_ATTRIBUTE = 2
@@ -82,9 +117,22 @@ ATTR_LOCAL_PREF = 5
 ATTR_ATOMIC_AGGREGATE = 6
 ATTR_AGGREGATOR = 7
 
+# ORIGIN attribute values
+ORIGIN_IGP = 0
+ORIGIN_EGP = 1
+ORIGIN_INCOMPLETE = 2
+
+DEFAULT_LOCAL_PREF = 100
+
+# Value length of attributes that have only one valid length
+ATTRIBUTE_LENGTHS = {ATTR_ORIGIN: 1, ATTR_NEXT_HOP: 4, ATTR_MED: 4, ATTR_LOCAL_PREF: 4, ATTR_ATOMIC_AGGREGATE: 0, ATTR_AGGREGATOR: 6}
+
 
 class DecodeMessage:
-    def __init__(self, data, local_id="0.0.0.0", peer_asn=0):
+    def __init__(self, data, local_id="0.0.0.0", peer_asn=0, max_size=MAX_MESSAGE_SIZE):
+
+        # All the fields are decoded from the memoryview by offset, nothing gets copied until it needs to be materialized
+        data = memoryview(data)
 
         self.data_len_error = False
         self.data_len_expected = 19
@@ -101,24 +149,22 @@ class DecodeMessage:
             return
 
         # Validate Marker field
-        for m in struct.iter_unpack("!B", data[:16]):
-            if m[0] != 0xFF:
-                self.message_error_code = MESSAGE_HEADER_ERROR
-                self.message_error_subcode = CONNECTION_NOT_SYNCHRONISED
-                return
+        if data[:16] != MARKER:
+            self.message_error_code = MESSAGE_HEADER_ERROR
+            self.message_error_subcode = CONNECTION_NOT_SYNCHRONISED
+            return
 
-        self.len = struct.unpack("!H", data[16:18])[0]
-        self.type = data[18]
+        self.len, self.type = struct.unpack_from("!HB", data, 16)
 
-        # Validate Length field
-        if self.len < 19 or self.len > 4096:
+        # Validate Length field, messages over 4096 bytes are valid only once Extended Message capability got negotiated
+        if self.len < HEADER_SIZE or self.len > max_size:
             self.message_error_code = MESSAGE_HEADER_ERROR
             self.message_error_subcode = BAD_MESSAGE_LENGTH
             self.message_error_data = struct.pack("!H", self.len)
             return
 
         # Validate Type field
-        if self.type not in {OPEN, UPDATE, NOTIFICATION, KEEPALIVE}:
+        if self.type not in {OPEN, UPDATE, NOTIFICATION, KEEPALIVE, ROUTE_REFRESH}:
             self.message_error_code = MESSAGE_HEADER_ERROR
             self.message_error_subcode = BAD_MESSAGE_TYPE
             self.message_error_data = struct.pack("!B", self.type)
@@ -131,19 +177,16 @@ class DecodeMessage:
             return
 
         if self.type == OPEN:
-            # Validate Length field
-            if self.len < 19 + 10:
+            # Validate Length field, OPEN never exceeds 4096 bytes
+            if self.len < 19 + 10 or self.len > MAX_MESSAGE_SIZE:
                 self.message_error_code = MESSAGE_HEADER_ERROR
                 self.message_error_subcode = BAD_MESSAGE_LENGTH
                 self.message_error_data = struct.pack("!H", self.len)
                 return
 
-            self.version = data[19]
-            self.asn = struct.unpack("!H", data[20:22])[0]
-            self.hold_time = struct.unpack("!H", data[23:25])[0]
-            self.id = socket.inet_ntoa(struct.unpack("!4s", data[25:29])[0])
-            self.opt_len = data[29]
-            self.opt_param = data[29 : self.len]
+            self.version, self.asn, self.hold_time, bgp_id, self.opt_len = struct.unpack_from("!BHH4sB", data, 19)
+            self.id = socket.inet_ntoa(bgp_id)
+            self.opt_param = bytes(data[29 : self.len])
 
             if self.version != 4:
                 self.message_error_code = OPEN_MESSAGE_ERROR
@@ -157,7 +200,11 @@ class DecodeMessage:
                 self.message_error_code = OPEN_MESSAGE_ERROR
                 self.message_error_subcode = BAD_BGP_IDENTIFIER
 
-            # <!!!> Need to add check for supported optional parameters
+            # Capabilities are the only optional parameter defined
+            self.capabilities = decode_capabilities(data, 29, min(29 + self.opt_len, self.len))
+            if self.capabilities is None:
+                self.message_error_code = OPEN_MESSAGE_ERROR
+                self.message_error_subcode = UNSUPPORTED_OPTIONAL_PARAMETER
 
             if self.hold_time in {1, 2}:
                 self.message_error_code = OPEN_MESSAGE_ERROR
@@ -173,41 +220,37 @@ class DecodeMessage:
                 self.message_error_data = struct.pack("!H", self.len)
                 return
 
-            prefixes_del_len = struct.unpack("!H", data[19:21])[0]
-            prefixes_del_raw = data[21 : 21 + prefixes_del_len]
-            self.prefixes_del = []
-            i = 0
-            while i < prefixes_del_len:
-                prefix = IPv4Prefix(prefixes_del_raw[i:])
-                self.prefixes_del.append(prefix)
-                i += prefix.size + 1
+            # Section framing gets validated here, attributes and NLRI are decoded by the view when accessed
+            prefixes_del_len = struct.unpack_from("!H", data, 19)[0]
+            if 23 + prefixes_del_len > self.len:
+                self.message_error_code = UPDATE_MESSAGE_ERROR
+                self.message_error_subcode = MALFORMED_ATTRIBUTE_LIST
+                return
+
+            attributes_len = struct.unpack_from("!H", data, 21 + prefixes_del_len)[0]
+            if 23 + prefixes_del_len + attributes_len > self.len:
+                self.message_error_code = UPDATE_MESSAGE_ERROR
+                self.message_error_subcode = MALFORMED_ATTRIBUTE_LIST
+                return
+
+            # View may outlive the receive buffer so it needs to refer to immutable copy of the message
+            if not data.readonly:
+                data = memoryview(bytes(data[: self.len]))
+
+            if not validate_prefixes(data, 21, 21 + prefixes_del_len) or not validate_prefixes(data, 23 + prefixes_del_len + attributes_len, self.len):
+                self.message_error_code = UPDATE_MESSAGE_ERROR
+                self.message_error_subcode = INVALID_NETWORK_FIELD
+                return
 
-            attributes_len = struct.unpack("!H", data[21 + prefixes_del_len : 23 + prefixes_del_len])[0]
+            # Attribute bytes already interned were validated when they were seen first
             attributes_raw = data[23 + prefixes_del_len : 23 + prefixes_del_len + attributes_len]
-            self.attributes = []
-            i = 0
-            while i < attributes_len:
-                attribute = {
-                    ATTR_ORIGIN: AttrOrigin,
-                    ATTR_AS_PATH: AttrAsPath,
-                    ATTR_NEXT_HOP: AttrNextHop,
-                    ATTR_MED: AttrMed,
-                    ATTR_LOCAL_PREF: AttrLocalPref,
-                    ATTR_ATOMIC_AGGREGATE: AttrAtomicAggregate,
-                    ATTR_AGGREGATOR: AttrAggregator,
-                }.get(attributes_raw[i + 1], AttrUnk)(attributes_raw[i:])
-                self.attributes.append(attribute)
-                i += len(attribute)
-
-            prefixes_add_len = self.len - 23 - prefixes_del_len - attributes_len
-            prefixes_add_raw = data[23 + prefixes_del_len + attributes_len : 23 + prefixes_del_len + attributes_len + prefixes_add_len]
-            self.prefixes_add = []
-            i = 0
-            while i < len(prefixes_add_raw):
-                prefix = IPv4Prefix(prefixes_add_raw[i:])
-                self.prefixes_add.append(prefix)
-                i += prefix.size + 1
+            if attributes_raw not in ATTRIBUTE_SETS:
+                self.message_error_subcode = validate_attributes(attributes_raw)
+                if self.message_error_subcode:
+                    self.message_error_code = UPDATE_MESSAGE_ERROR
+                    return
 
+            self.update = UpdateView(data[: self.len], 21 + prefixes_del_len, 23 + prefixes_del_len + attributes_len)
             return
 
         if self.type == NOTIFICATION:
@@ -219,13 +262,206 @@ class DecodeMessage:
                 self.message_error_data = struct.pack("!H", self.len)
                 return
 
-            self.error_code, self.error_subcode = struct.unpack("!BB", data[19:21])
-            self.error_data = data[21 : self.len]
+            self.error_code, self.error_subcode = struct.unpack_from("!BB", data, 19)
+            self.error_data = bytes(data[21 : self.len])
             return
 
         if self.type == KEEPALIVE:
             return
 
+        if self.type == ROUTE_REFRESH:
+            # Validate Length field
+            if self.len != 19 + 4:
+                self.message_error_code = ROUTE_REFRESH_MESSAGE_ERROR
+                self.message_error_subcode = INVALID_MESSAGE_LENGTH
+                self.message_error_data = bytes(data[: self.len])
+                return
+
+            self.afi, self.subtype, self.safi = struct.unpack_from("!HBB", data, 19)
+            return
+
+
+class UpdateView:
+    """ Lazy view of UPDATE message, attributes and NLRI get decoded on first access only """
+
+    __slots__ = ("data", "withdrawn_end", "attributes_end", "decoding", "_attribute_set", "_keys_add", "_keys_del")
+
+    def __init__(self, data, withdrawn_end, attributes_end):
+        self.data = data
+        self.withdrawn_end = withdrawn_end
+        self.attributes_end = attributes_end
+
+        # Future completed by decoder pool once it fills in the prefix keys
+        self.decoding = None
+        self._attribute_set = None
+        self._keys_add = None
+        self._keys_del = None
+
+    @property
+    def attributes_raw(self):
+        """ Raw attribute block, hashable and comparable with bytes without being parsed """
+
+        return self.data[self.withdrawn_end + 2 : self.attributes_end]
+
+    @property
+    def attribute_set(self):
+        """ Shared attribute set, parsed only if the same attribute bytes have not been seen before """
+
+        if self._attribute_set is None:
+            self._attribute_set = intern_attribute_set(self.attributes_raw)
+        return self._attribute_set
+
+    @property
+    def attributes(self):
+        return self.attribute_set.attributes
+
+    @property
+    def end_of_rib(self):
+        """ Empty UPDATE sent by the peer once its initial table is complete """
+
+        return len(self.data) == 23
+
+    @property
+    def keys_add(self):
+        """ Packed keys of announced prefixes """
+
+        if self._keys_add is None:
+            self._keys_add = decode_prefix_keys(self.data, self.attributes_end, len(self.data))
+        return self._keys_add
+
+    @property
+    def keys_del(self):
+        """ Packed keys of withdrawn prefixes """
+
+        if self._keys_del is None:
+            self._keys_del = decode_prefix_keys(self.data, 21, self.withdrawn_end)
+        return self._keys_del
+
+    @property
+    def prefixes_add(self):
+        return decode_prefixes(self.data, self.attributes_end, len(self.data))
+
+    @property
+    def prefixes_del(self):
+        return decode_prefixes(self.data, 21, self.withdrawn_end)
+
+
+def validate_prefixes(data, start, end):
+    """ Check that every prefix of NLRI or withdrawn routes field is at most 32 bits long and fits in the field """
+
+    i = start
+    while i < end:
+        length = data[i]
+        if length > 32:
+            return False
+        i += 1 + ((length + 7) >> 3)
+    return i == end
+
+
+def validate_attributes(data):
+    """ Check framing of every path attribute and value length of the ones with fixed length, return error subcode or zero if they are valid """
+
+    i = 0
+    end = len(data)
+    while i < end:
+        if i + 3 > end or data[i] & FLAG_EXTLEN and i + 4 > end:
+            return MALFORMED_ATTRIBUTE_LIST
+
+        attribute_type = data[i + 1]
+        if data[i] & FLAG_EXTLEN:
+            length = struct.unpack_from("!H", data, i + 2)[0]
+            i += 4
+        else:
+            length = data[i + 2]
+            i += 3
+
+        if i + length > end:
+            return MALFORMED_ATTRIBUTE_LIST
+
+        if ATTRIBUTE_LENGTHS.get(attribute_type, length) != length:
+            return ATTRIBUTE_LENGTH_WRROR
+
+        # Segments of AS_PATH have to fill the attribute exactly
+        if attribute_type == ATTR_AS_PATH:
+            j = i
+            while j < i + length:
+                if j + 2 > i + length:
+                    return MALFORMED_AS_PATH
+                j += 2 + data[j + 1] * 2
+            if j != i + length:
+                return MALFORMED_AS_PATH
+
+        i += length
+    return 0
+
+
+def decode_prefix_keys(data, start, end):
+    """ Decode NLRI field into list of packed prefix keys without creating prefix objects """
+
+    keys = []
+    i = start
+    while i < end:
+        length = data[i]
+        size = (length + 7) >> 3
+        keys.append(int.from_bytes(data[i + 1 : i + 1 + size], "big") << (40 - 8 * size) | length)
+        i += size + 1
+    return keys
+
+
+def decode_prefixes(data, start, end):
+    """ Decode NLRI field into list of prefix objects """
+
+    prefixes = []
+    i = start
+    while i < end:
+        prefix = IPv4Prefix(data, i)
+        prefixes.append(prefix)
+        i += prefix.size + 1
+    return prefixes
+
+
+def decode_capabilities(data, start, end):
+    """ Decode optional parameters of OPEN message into capability code -> value mapping, return None if there is other parameter type """
+
+    capabilities = {}
+    i = start
+    while i + 2 <= end:
+        param_type, param_len = data[i], data[i + 1]
+        if param_type != OPT_PARAM_CAPABILITIES:
+            return None
+        j = i + 2
+        i = min(j + param_len, end)
+        while j + 2 <= i:
+            code, length = data[j], data[j + 1]
+            capabilities[code] = bytes(data[j + 2 : j + 2 + length])
+            j += 2 + length
+    return capabilities
+
+
+def encode_capabilities(capabilities):
+    """ Encode (code, value) pairs into single capabilities optional parameter """
+
+    data = b"".join(struct.pack("!BB", code, len(value)) + value for code, value in capabilities)
+    return struct.pack("!BB", OPT_PARAM_CAPABILITIES, len(data)) + data if data else b""
+
+
+def encode_graceful_restart(restart_time, address_families=((AFI_IPV4, SAFI_UNICAST, 0),), restarted=False):
+    """ Encode value of Graceful Restart capability, address families are (afi, safi, flags) tuples """
+
+    data = struct.pack("!H", (GRACEFUL_RESTART_STATE if restarted else 0) | restart_time & GRACEFUL_RESTART_TIME_MASK)
+    return data + b"".join(struct.pack("!HBB", *_) for _ in address_families)
+
+
+def decode_graceful_restart(value):
+    """ Decode value of Graceful Restart capability into restart time and (afi, safi) -> flags mapping """
+
+    if len(value) < 2:
+        return 0, {}
+
+    restart_time = struct.unpack_from("!H", value)[0] & GRACEFUL_RESTART_TIME_MASK
+    address_families = {(afi, safi): flags for afi, safi, flags in struct.iter_unpack("!HBB", value[2 : 2 + (len(value) - 2) // 4 * 4])}
+    return restart_time, address_families
+
 
 class Open:
     def __init__(self, local_id, local_asn, local_hold_time=180, opt=b"", version=4):
@@ -239,12 +475,11 @@ class Open:
         self.opt = opt
 
     def write(self):
-        return (
-            b"\xff" * 16
-            + struct.pack("!HB", self.len, self.type)
-            + struct.pack("!BHHLB", self.version, self.asn, self.hold_time, self.bgp_id, self.opt_len)
-            + self.opt
-        )
+        buffer = bytearray(self.len)
+        HEADER.pack_into(buffer, 0, MARKER, self.len, self.type)
+        struct.pack_into("!BHHLB", buffer, 19, self.version, self.asn, self.hold_time, self.bgp_id, self.opt_len)
+        buffer[29:] = self.opt
+        return bytes(buffer)
 
 
 class Notification:
@@ -256,12 +491,113 @@ class Notification:
         self.data = data
 
     def write(self):
-        return b"\xff" * 16 + struct.pack("!HB", self.len, self.type) + struct.pack("!BB", self.error_code, self.error_subcode) + self.data
+        if not self.data:
+            message = NOTIFICATION_MESSAGES.get((self.error_code, self.error_subcode))
+            if message:
+                return message
+
+        buffer = bytearray(self.len)
+        HEADER.pack_into(buffer, 0, MARKER, self.len, self.type)
+        struct.pack_into("!BB", buffer, 19, self.error_code, self.error_subcode)
+        buffer[21:] = self.data
+        return bytes(buffer)
+
+
+# Wire templates of messages that never change, sent as they are
+KEEPALIVE_MESSAGE = HEADER.pack(MARKER, HEADER_SIZE, KEEPALIVE)
+
+NOTIFICATION_MESSAGES = {}
+NOTIFICATION_MESSAGES.update({(_, 0): Notification(_).write() for _ in (CEASE, HOLD_TIMER_EXPIRED, FINITE_STATE_MACHINE_ERROR)})
+
+
+class RouteRefresh:
+    def __init__(self, subtype=ROUTE_REFRESH_REQUEST, afi=AFI_IPV4, safi=SAFI_UNICAST):
+        self.len = 19 + 4
+        self.type = ROUTE_REFRESH
+        self.afi = afi
+        self.subtype = subtype
+        self.safi = safi
+
+    def write(self):
+        buffer = bytearray(self.len)
+        HEADER.pack_into(buffer, 0, MARKER, self.len, self.type)
+        struct.pack_into("!HBB", buffer, 19, self.afi, self.subtype, self.safi)
+        return bytes(buffer)
+
+
+ROUTE_REFRESH_MESSAGES = {_: RouteRefresh(_).write() for _ in (ROUTE_REFRESH_REQUEST, BEGINNING_OF_ROUTE_REFRESH, END_OF_ROUTE_REFRESH)}
 
 
 class Update:
-    def __init__(self):
-        pass
+    def __init__(self, withdrawn=b"", attributes=b"", nlri=b""):
+        self.len = 19 + 4 + len(withdrawn) + len(attributes) + len(nlri)
+        self.type = UPDATE
+        self.withdrawn = withdrawn
+        self.attributes = attributes
+        self.nlri = nlri
+
+    def write(self):
+        buffer = bytearray(self.len)
+        HEADER.pack_into(buffer, 0, MARKER, self.len, self.type)
+        i = 19
+        struct.pack_into("!H", buffer, i, len(self.withdrawn))
+        buffer[i + 2 : i + 2 + len(self.withdrawn)] = self.withdrawn
+        i += 2 + len(self.withdrawn)
+        struct.pack_into("!H", buffer, i, len(self.attributes))
+        buffer[i + 2 : i + 2 + len(self.attributes)] = self.attributes
+        buffer[i + 2 + len(self.attributes) :] = self.nlri
+        return bytes(buffer)
+
+
+# UPDATE with no withdrawn routes, attributes and NLRI marks the end of initial table
+END_OF_RIB_MESSAGE = Update().write()
+
+
+def encode_prefix(key):
+    """ Encode packed prefix key into the NLRI wire format """
+
+    length = key & 0xFF
+    return struct.pack("!BL", length, key >> 8)[: 1 + ((length + 7) >> 3)]
+
+
+def encode_updates(prefixes_add=None, prefixes_del=(), max_size=MAX_MESSAGE_SIZE):
+    """ Pack withdrawn prefixes and prefixes announced with shared attribute sets into as few UPDATE messages as fit in max_size """
+
+    space = max_size - 19 - 4
+    messages = []
+
+    # Withdrawn prefixes fill their own messages, the last partially filled one is carried over to the first announcement
+    withdrawn = bytearray()
+    for key in prefixes_del:
+        prefix = encode_prefix(key)
+        if len(withdrawn) + len(prefix) > space:
+            messages.append(Update(withdrawn=bytes(withdrawn)).write())
+            withdrawn.clear()
+        withdrawn += prefix
+
+    # Raw attribute bytes of each set are reused by every message announcing prefixes with it
+    for attribute_set, keys in (prefixes_add or {}).items():
+        attributes = attribute_set.raw_data
+        nlri = bytearray()
+        for key in keys:
+            prefix = encode_prefix(key)
+            if len(withdrawn) + len(attributes) + len(nlri) + len(prefix) > space:
+                if nlri:
+                    messages.append(Update(bytes(withdrawn), attributes, bytes(nlri)).write())
+                    nlri.clear()
+                else:
+                    messages.append(Update(withdrawn=bytes(withdrawn)).write())
+                withdrawn.clear()
+            nlri += prefix
+
+        if nlri:
+            messages.append(Update(bytes(withdrawn), attributes, bytes(nlri)).write())
+            withdrawn.clear()
+
+    if withdrawn:
+        messages.append(Update(withdrawn=bytes(withdrawn)).write())
+
+    return messages
 
 
 class Keepalive:
@@ -271,27 +607,90 @@ class Keepalive:
     def write(self):
         self.len = 19
         self.type = KEEPALIVE
-        return b"\xff" * 16 + struct.pack("!HB", self.len, self.type)
+        return KEEPALIVE_MESSAGE
 
 
-class IPv4Prefix:
+class AttributeSet:
+    """ Immutable set of path attributes shared by all the routes announced with the same raw attribute bytes """
+
+    __slots__ = ("raw_data", "attributes", "origin", "as_path_len", "neighbor_as", "next_hop", "med", "local_pref", "__weakref__")
+
     def __init__(self, raw_data):
-        self.len = raw_data[0]
-        self.size = (self.len >> 3) + ((self.len & 3) and 1)
-        self.bytes = [_ for _ in raw_data[1 : 1 + self.size]]
-        for _ in range(4 - self.size):
-            self.bytes.append(0)
+        self.raw_data = raw_data
+
+        attributes = []
+        i = 0
+        while i < len(raw_data):
+            attribute = ATTRIBUTE_CLASSES.get(raw_data[i + 1], AttrUnk)(raw_data, i)
+            attributes.append(attribute)
+            i += len(attribute)
+        self.attributes = tuple(attributes)
+
+        # Values used by the decision process, defaults apply when attribute is not present
+        self.origin = ORIGIN_INCOMPLETE
+        self.as_path_len = 0
+        self.neighbor_as = None
+        self.next_hop = None
+        self.med = 0
+        self.local_pref = DEFAULT_LOCAL_PREF
+
+        for attribute in attributes:
+            if attribute.type == ATTR_ORIGIN:
+                self.origin = attribute.origin
+            elif attribute.type == ATTR_AS_PATH:
+                self.as_path_len = len(attribute.as_seq) + (1 if attribute.as_set else 0)
+                self.neighbor_as = attribute.as_seq[0] if attribute.as_seq else None
+            elif attribute.type == ATTR_NEXT_HOP:
+                self.next_hop = attribute.next_hop
+            elif attribute.type == ATTR_MED:
+                self.med = attribute.med
+            elif attribute.type == ATTR_LOCAL_PREF:
+                self.local_pref = attribute.local_preference
+
+    def __str__(self):
+        return ", ".join([str(_) for _ in self.attributes])
+
+
+# Process wide intern table, entry goes away as soon as the last route referring to it is dropped
+ATTRIBUTE_SETS = weakref.WeakValueDictionary()
+
+
+def intern_attribute_set(raw_data):
+    """ Return shared attribute set for given raw attribute bytes, parse them only if not seen before """
+
+    attribute_set = ATTRIBUTE_SETS.get(raw_data)
+
+    # Lookup works straight on memoryview of the message, bytes copy is made only for newly stored set
+    if attribute_set is None:
+        raw_data = bytes(raw_data)
+        attribute_set = ATTRIBUTE_SETS[raw_data] = AttributeSet(raw_data)
+
+    return attribute_set
+
+
+class IPv4Prefix:
+    def __init__(self, raw_data, offset=0):
+        self.len = raw_data[offset]
+        self.size = (self.len + 7) >> 3
+
+        # Prefix bytes get copied out of the buffer once, both representations are made from the copy
+        raw_prefix = bytes(raw_data[offset + 1 : offset + 1 + self.size])
+        self.bytes = list(raw_prefix) + [0] * (4 - self.size)
+
+        # Prefix packed into single integer, address in upper 32 bits and length in lower 8 bits
+        self.key = int.from_bytes(raw_prefix, "big") << (40 - 8 * self.size) | self.len
 
     def __str__(self):
         return ".".join([str(_) for _ in self.bytes]) + f"/{self.len}"
 
 
 class AttrOrigin:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
-        self.origin = raw_data[3]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
+        self.origin = raw_data[i]
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -301,21 +700,21 @@ class AttrOrigin:
 
 
 class AttrAsPath:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
         self.as_set = {}
         self.as_seq = []
 
-        i = 4
-        while i < 4 + self.len:
+        while i < offset + len(self):
             seg_type = raw_data[i]
             seg_len = raw_data[i + 1]
             if seg_type == 1:
-                self.as_set = set(struct.unpack(f"!{seg_len}H", raw_data[i + 2 : i + 2 + seg_len * 2]))
+                self.as_set = set(struct.unpack_from(f"!{seg_len}H", raw_data, i + 2))
             if seg_type == 2:
-                self.as_seq = list(struct.unpack(f"!{seg_len}H", raw_data[i + 2 : i + 2 + seg_len * 2]))
+                self.as_seq = list(struct.unpack_from(f"!{seg_len}H", raw_data, i + 2))
             i += 2 + seg_len * 2
 
     def __len__(self):
@@ -326,11 +725,12 @@ class AttrAsPath:
 
 
 class AttrNextHop:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
-        self.next_hop = IPv4Address(raw_data[3:7])
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
+        self.next_hop = IPv4Address(struct.unpack_from("!L", raw_data, i)[0])
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -340,11 +740,12 @@ class AttrNextHop:
 
 
 class AttrMed:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
-        self.med = struct.unpack("!L", raw_data[3:7])[0]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
+        self.med = struct.unpack_from("!L", raw_data, i)[0]
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -354,11 +755,12 @@ class AttrMed:
 
 
 class AttrLocalPref:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
-        self.local_preference = struct.unpack("!L", raw_data[3:7])[0]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
+        self.local_preference = struct.unpack_from("!L", raw_data, i)[0]
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -368,10 +770,10 @@ class AttrLocalPref:
 
 
 class AttrAtomicAggregate:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -381,12 +783,13 @@ class AttrAtomicAggregate:
 
 
 class AttrAggregator:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
-        self.asn = struct.unpack("!H", raw_data[3:5])[0]
-        self.origin = IPv4Address(raw_data[5:9])
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
+        i = offset + 4 if self.flags & FLAG_EXTLEN else offset + 3
+        self.asn, origin = struct.unpack_from("!HL", raw_data, i)
+        self.origin = IPv4Address(origin)
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
@@ -396,13 +799,24 @@ class AttrAggregator:
 
 
 class AttrUnk:
-    def __init__(self, raw_data):
-        self.flags = raw_data[0]
-        self.type = raw_data[1]
-        self.len = struct.unpack("!H", raw_data[2:4])[0] if self.flags & FLAG_EXTLEN else raw_data[2]
+    def __init__(self, raw_data, offset=0):
+        self.flags = raw_data[offset]
+        self.type = raw_data[offset + 1]
+        self.len = struct.unpack_from("!H", raw_data, offset + 2)[0] if self.flags & FLAG_EXTLEN else raw_data[offset + 2]
 
     def __len__(self):
         return self.len + 4 if self.flags & FLAG_EXTLEN else self.len + 3
 
     def __str__(self):
         return f"unknown {self.flags:08b}, {self.type}, {self.len}"
+
+
+ATTRIBUTE_CLASSES = {
+    ATTR_ORIGIN: AttrOrigin,
+    ATTR_AS_PATH: AttrAsPath,
+    ATTR_NEXT_HOP: AttrNextHop,
+    ATTR_MED: AttrMed,
+    ATTR_LOCAL_PREF: AttrLocalPref,
+    ATTR_ATOMIC_AGGREGATE: AttrAtomicAggregate,
+    ATTR_AGGREGATOR: AttrAggregator,
+}
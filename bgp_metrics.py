@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import bisect
+import time
+import weakref
+
+import bgp_message
+
+MESSAGE_TYPE_NAMES = {
+    bgp_message.OPEN: "open",
+    bgp_message.UPDATE: "update",
+    bgp_message.NOTIFICATION: "notification",
+    bgp_message.KEEPALIVE: "keepalive",
+    bgp_message.ROUTE_REFRESH: "route_refresh",
+}
+
+FSM_STATES = ("Idle", "Connect", "Active", "OpenSent", "OpenConfirm", "Established")
+
+# Upper bounds in seconds of time between UPDATE batch arrival and its application to the Adj-RIB-In
+UPDATE_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class FsmMetrics:
+    """ Counters updated by the FSM on the hot path, plain integers so updating them costs next to nothing """
+
+    __slots__ = ("rx_messages", "rx_bytes", "tx_messages", "tx_bytes", "decode_errors", "update_latency", "update_latency_sum")
+
+    def __init__(self):
+        """ Class constructor """
+
+        # Indexed by message type
+        self.rx_messages = [0] * 6
+        self.rx_bytes = [0] * 6
+        self.tx_messages = [0] * 6
+        self.tx_bytes = [0] * 6
+
+        self.decode_errors = 0
+
+        # Non cumulative bucket counts, last bucket counts observations above the highest bound
+        self.update_latency = [0] * (len(UPDATE_LATENCY_BUCKETS) + 1)
+        self.update_latency_sum = 0.0
+
+    def observe_update_latency(self, seconds):
+        """ Add UPDATE processing latency to the histogram """
+
+        self.update_latency[bisect.bisect_left(UPDATE_LATENCY_BUCKETS, seconds)] += 1
+        self.update_latency_sum += seconds
+
+
+class MetricsRegistry:
+    """ Collection of FSMs whose metrics get rendered on scrape, gauges are read from the FSMs only at that time """
+
+    def __init__(self):
+        """ Class constructor """
+
+        self.fsms = weakref.WeakSet()
+        self.loc_rib = None
+
+    def register(self, fsm):
+        """ Add FSM to the registry, it goes away together with the FSM """
+
+        self.fsms.add(fsm)
+
+    def render(self):
+        """ Render all the metrics in Prometheus text exposition format """
+
+        lines = []
+        now = time.monotonic()
+        fsms = sorted(self.fsms, key=lambda _: (_.peer_ip, _.mode))
+
+        def family(name, kind, text):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(fsm):
+            return f'peer="{fsm.peer_ip}",mode="{fsm.mode}"'
+
+        for name, attribute, text in (
+            ("bgp_rx_messages_total", "rx_messages", "Messages received from the peer"),
+            ("bgp_rx_bytes_total", "rx_bytes", "Bytes of messages received from the peer"),
+            ("bgp_tx_messages_total", "tx_messages", "Messages sent to the peer"),
+            ("bgp_tx_bytes_total", "tx_bytes", "Bytes of messages sent to the peer"),
+        ):
+            family(name, "counter", text)
+            for fsm in fsms:
+                values = getattr(fsm.metrics, attribute)
+                for message_type, type_name in MESSAGE_TYPE_NAMES.items():
+                    lines.append(f'{name}{{{labels(fsm)},type="{type_name}"}} {values[message_type]}')
+
+        family("bgp_decode_errors_total", "counter", "Received messages failing validation")
+        for fsm in fsms:
+            lines.append(f"bgp_decode_errors_total{{{labels(fsm)}}} {fsm.metrics.decode_errors}")
+
+        family("bgp_event_queue_depth", "gauge", "Events waiting to be processed by the FSM")
+        for fsm in fsms:
+            lines.append(f"bgp_event_queue_depth{{{labels(fsm)}}} {fsm.event_queue.qsize() + len(fsm.priority_events)}")
+
+        family("bgp_fsm_state", "gauge", "Current FSM state")
+        for fsm in fsms:
+            for state in FSM_STATES:
+                lines.append(f'bgp_fsm_state{{{labels(fsm)},state="{state}"}} {int(fsm.state == state)}')
+
+        family("bgp_fsm_state_seconds", "gauge", "Time spent in current FSM state")
+        for fsm in fsms:
+            lines.append(f"bgp_fsm_state_seconds{{{labels(fsm)}}} {now - fsm.state_time:.3f}")
+
+        family("bgp_update_latency_seconds", "histogram", "Time between UPDATE batch arrival and its application to the Adj-RIB-In")
+        for fsm in fsms:
+            count = 0
+            for bound, bucket in zip(UPDATE_LATENCY_BUCKETS, fsm.metrics.update_latency):
+                count += bucket
+                lines.append(f'bgp_update_latency_seconds_bucket{{{labels(fsm)},le="{bound}"}} {count}')
+            count += fsm.metrics.update_latency[-1]
+            lines.append(f'bgp_update_latency_seconds_bucket{{{labels(fsm)},le="+Inf"}} {count}')
+            lines.append(f"bgp_update_latency_seconds_sum{{{labels(fsm)}}} {fsm.metrics.update_latency_sum:.6f}")
+            lines.append(f"bgp_update_latency_seconds_count{{{labels(fsm)}}} {count}")
+
+        # Both FSMs of the session share the Adj-RIB-In
+        family("bgp_peer_prefixes", "gauge", "Prefixes received from the peer")
+        adj_ribs_in = {id(_.adj_rib_in): _.adj_rib_in for _ in fsms}
+        for adj_rib_in in adj_ribs_in.values():
+            lines.append(f'bgp_peer_prefixes{{peer="{adj_rib_in.peer_ip}"}} {len(adj_rib_in)}')
+
+        family("bgp_peer_stale_prefixes", "gauge", "Prefixes received from the peer waiting to be refreshed")
+        for adj_rib_in in adj_ribs_in.values():
+            lines.append(f'bgp_peer_stale_prefixes{{peer="{adj_rib_in.peer_ip}"}} {len(adj_rib_in.stale)}')
+
+        family("bgp_attribute_sets", "gauge", "Distinct path attribute sets interned")
+        lines.append(f"bgp_attribute_sets {len(bgp_message.ATTRIBUTE_SETS)}")
+
+        if self.loc_rib is not None:
+            family("bgp_loc_rib_prefixes", "gauge", "Prefixes in the Loc-RIB")
+            lines.append(f"bgp_loc_rib_prefixes {len(self.loc_rib)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+async def serve_metrics(reader, writer):
+    """ Answer single HTTP request with the current metrics """
+
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = registry.render().encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        pass
+
+    writer.close()
+
+
+async def start_metrics_server(host="127.0.0.1", port=9179, path=None):
+    """ Serve metrics over HTTP on local TCP port or on Unix socket if path is given """
+
+    if path:
+        return await asyncio.start_unix_server(serve_metrics, path)
+
+    return await asyncio.start_server(serve_metrics, host, port)
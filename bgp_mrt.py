@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import asyncio
+import bz2
+import cProfile
+import gzip
+import pstats
+import socket
+import struct
+import time
+
+import bgp_message
+from bgp_adj_rib_in import AdjRibIn
+from bgp_loc_rib import LocRib
+from bgp_message import DecodeMessage
+
+# MRT record types and subtypes, RFC 6396
+TABLE_DUMP_V2 = 13
+BGP4MP = 16
+BGP4MP_ET = 17
+
+PEER_INDEX_TABLE = 1
+RIB_IPV4_UNICAST = 2
+
+BGP4MP_STATE_CHANGE = 0
+BGP4MP_MESSAGE = 1
+BGP4MP_MESSAGE_AS4 = 4
+BGP4MP_STATE_CHANGE_AS4 = 5
+
+AFI_IPV4 = 1
+
+# Peer type bits of the PEER_INDEX_TABLE entry
+PEER_TYPE_IPV6 = 0b01
+PEER_TYPE_AS4 = 0b10
+
+MRT_HEADER = struct.Struct("!LHHL")
+BGP4MP_ET_HEADER = struct.Struct("!LHHHH4s4s")
+
+BGP4MP_STATES = {"Idle": 1, "Connect": 2, "Active": 3, "OpenSent": 4, "OpenConfirm": 5, "Established": 6}
+
+# Attributes that need rewriting when moving routes between 2-octet and 4-octet AS form, RFC 6793
+ATTR_MP_REACH_NLRI = 14
+ATTR_MP_UNREACH_NLRI = 15
+ATTR_AS4_PATH = 17
+ATTR_AS4_AGGREGATOR = 18
+AS_TRANS = 23456
+
+# AS_PATH segment types, confederation segments do not count into the path length
+AS_SET = 1
+AS_SEQUENCE = 2
+
+# Received messages are flushed to disk at least this often
+MRT_FLUSH_INTERVAL = 1
+
+# Replayed prefixes get applied to the RIB in batches of this size, same as UPDATE batches of live session
+REPLAY_BATCH_SIZE = 10000
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def open_mrt(path, mode="rb"):
+    """ Open MRT file, compressed files get recognized by extension """
+
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".bz2"):
+        return bz2.open(path, mode)
+    return open(path, mode)
+
+
+def read_records(path):
+    """ Yield (timestamp, type, subtype, body) of every MRT record, body is memoryview of the read chunk """
+
+    with open_mrt(path) as file:
+        buffer = b""
+        while chunk := file.read(READ_CHUNK_SIZE):
+            data = buffer + chunk
+            view = memoryview(data)
+            i = 0
+            while i + MRT_HEADER.size <= len(data):
+                timestamp, record_type, subtype, length = MRT_HEADER.unpack_from(data, i)
+                if i + MRT_HEADER.size + length > len(data):
+                    break
+                yield timestamp, record_type, subtype, view[i + MRT_HEADER.size : i + MRT_HEADER.size + length]
+                i += MRT_HEADER.size + length
+            buffer = data[i:]
+
+
+def iter_attributes(raw_data):
+    """ Yield (flags, type, value) of every attribute in raw attribute block """
+
+    i = 0
+    while i < len(raw_data):
+        flags, attribute_type = raw_data[i], raw_data[i + 1]
+        if flags & bgp_message.FLAG_EXTLEN:
+            length = struct.unpack_from("!H", raw_data, i + 2)[0]
+            i += 4
+        else:
+            length = raw_data[i + 2]
+            i += 3
+        yield flags, attribute_type, raw_data[i : i + length]
+        i += length
+
+
+def encode_attribute(flags, attribute_type, value):
+    """ Encode attribute, extended length flag gets set only when needed """
+
+    if len(value) > 255:
+        return struct.pack("!BBH", flags | bgp_message.FLAG_EXTLEN, attribute_type, len(value)) + bytes(value)
+    return struct.pack("!BBB", flags & ~bgp_message.FLAG_EXTLEN, attribute_type, len(value)) + bytes(value)
+
+
+def convert_as_path(value, size_from, size_to):
+    """ Re-encode AS_PATH segments with different AS number size, return the path and whether any AS did not fit into 2 octets """
+
+    path = bytearray()
+    wide = False
+    i = 0
+    while i < len(value):
+        segment_type, count = value[i], value[i + 1]
+        asns = struct.unpack_from(f"!{count}{'L' if size_from == 4 else 'H'}", value, i + 2)
+        i += 2 + count * size_from
+        if size_to == 2 and any(_ > 0xFFFF for _ in asns):
+            wide = True
+            asns = [_ if _ <= 0xFFFF else AS_TRANS for _ in asns]
+        path += struct.pack(f"!BB{count}{'L' if size_to == 4 else 'H'}", segment_type, count, *asns)
+    return bytes(path), wide
+
+
+def attributes_as4_to_as2(raw_data):
+    """ Rewrite attributes of 4-octet AS form into the form 2-octet AS speaker receives them in, drop multiprotocol NLRI """
+
+    attributes = []
+    as4_attributes = {}
+
+    for flags, attribute_type, value in iter_attributes(raw_data):
+        if attribute_type in {ATTR_MP_REACH_NLRI, ATTR_MP_UNREACH_NLRI}:
+            continue
+
+        if attribute_type == bgp_message.ATTR_AS_PATH:
+            path, wide = convert_as_path(value, 4, 2)
+            attributes.append(encode_attribute(flags, attribute_type, path))
+            if wide:
+                as4_attributes.setdefault(ATTR_AS4_PATH, encode_attribute(bgp_message.FLAG_OPTIONAL | bgp_message.FLAG_TANSITIVE, ATTR_AS4_PATH, value))
+
+        elif attribute_type == bgp_message.ATTR_AGGREGATOR and len(value) == 8:
+            asn, address = struct.unpack("!L4s", value)
+            attributes.append(encode_attribute(flags, attribute_type, struct.pack("!H4s", asn if asn <= 0xFFFF else AS_TRANS, address)))
+            if asn > 0xFFFF:
+                as4_attributes.setdefault(
+                    ATTR_AS4_AGGREGATOR, encode_attribute(bgp_message.FLAG_OPTIONAL | bgp_message.FLAG_TANSITIVE, ATTR_AS4_AGGREGATOR, value)
+                )
+
+        # AS4 attributes already present take precedence over the generated ones
+        elif attribute_type in {ATTR_AS4_PATH, ATTR_AS4_AGGREGATOR}:
+            as4_attributes[attribute_type] = encode_attribute(flags, attribute_type, value)
+
+        else:
+            attributes.append(encode_attribute(flags, attribute_type, value))
+
+    return b"".join(attributes + list(as4_attributes.values()))
+
+
+def decode_as_path(value, size):
+    """ Decode AS_PATH into list of (segment type, AS numbers) """
+
+    segments = []
+    i = 0
+    while i < len(value):
+        segment_type, count = value[i], value[i + 1]
+        segments.append((segment_type, struct.unpack_from(f"!{count}{'L' if size == 4 else 'H'}", value, i + 2)))
+        i += 2 + count * size
+    return segments
+
+
+def encode_as_path(segments):
+    """ Encode AS_PATH segments with 4-octet AS numbers """
+
+    return b"".join(struct.pack(f"!BB{len(asns)}L", segment_type, len(asns), *asns) for segment_type, asns in segments)
+
+
+def as_path_length(segments):
+    """ Number of AS numbers in the path, AS_SET counts as one """
+
+    return sum(len(asns) if segment_type == AS_SEQUENCE else segment_type == AS_SET for segment_type, asns in segments)
+
+
+def merge_as4_path(as_path, as4_path):
+    """ Rebuild 4-octet AS path, leading AS numbers AS4_PATH lacks get taken from AS_PATH, RFC 6793 section 4.2.3 """
+
+    as4_path = [_ for _ in as4_path if _[0] in {AS_SET, AS_SEQUENCE}]
+    missing = as_path_length(as_path) - as_path_length(as4_path)
+
+    # AS4_PATH longer than AS_PATH is ignored
+    if missing < 0:
+        return as_path
+
+    segments = []
+    for segment_type, asns in as_path:
+        if missing <= 0:
+            break
+        if segment_type == AS_SEQUENCE:
+            asns = asns[:missing]
+            missing -= len(asns)
+        elif segment_type == AS_SET:
+            missing -= 1
+        segments.append((segment_type, asns))
+
+    # Sequence split between the two attributes goes back into single segment
+    if segments and as4_path and segments[-1][0] == as4_path[0][0] == AS_SEQUENCE and len(segments[-1][1]) + len(as4_path[0][1]) <= 255:
+        segments[-1] = (AS_SEQUENCE, segments[-1][1] + as4_path[0][1])
+        as4_path = as4_path[1:]
+
+    return segments + as4_path
+
+
+def attributes_as2_to_as4(raw_data):
+    """ Rewrite attributes received from 2-octet AS peer into 4-octet AS form TABLE_DUMP_V2 requires, AS4_PATH and AS4_AGGREGATOR get merged in """
+
+    attributes = []
+    as_path = aggregator = as4_path = as4_aggregator = None
+
+    for flags, attribute_type, value in iter_attributes(raw_data):
+        if attribute_type == ATTR_AS4_PATH:
+            as4_path = value
+        elif attribute_type == ATTR_AS4_AGGREGATOR:
+            as4_aggregator = value
+        else:
+            attributes.append([flags, attribute_type, value])
+            if attribute_type == bgp_message.ATTR_AS_PATH:
+                as_path = attributes[-1]
+            elif attribute_type == bgp_message.ATTR_AGGREGATOR and len(value) == 6:
+                aggregator = attributes[-1]
+
+    # AGGREGATOR without AS_TRANS means AS4 attributes were not added by the aggregating speaker and both get ignored
+    if aggregator is not None:
+        asn, address = struct.unpack("!H4s", aggregator[2])
+        if asn == AS_TRANS and as4_aggregator is not None and len(as4_aggregator) == 8:
+            aggregator[2] = as4_aggregator
+        else:
+            aggregator[2] = struct.pack("!L4s", asn, address)
+            if asn != AS_TRANS:
+                as4_path = None
+
+    if as_path is not None:
+        segments = decode_as_path(as_path[2], 2)
+        try:
+            if as4_path is not None:
+                segments = merge_as4_path(segments, decode_as_path(as4_path, 4))
+        except (IndexError, struct.error):
+            # Malformed AS4_PATH is ignored
+            pass
+        as_path[2] = encode_as_path(segments)
+
+    return b"".join(encode_attribute(*_) for _ in attributes)
+
+
+def update_as4_to_as2(data):
+    """ Rewrite UPDATE message received over session with 4-octet AS capability """
+
+    length = struct.unpack_from("!H", data, 16)[0]
+    withdrawn_end = 21 + struct.unpack_from("!H", data, 19)[0]
+    attributes_end = withdrawn_end + 2 + struct.unpack_from("!H", data, withdrawn_end)[0]
+
+    return bgp_message.Update(
+        bytes(data[21:withdrawn_end]), attributes_as4_to_as2(data[withdrawn_end + 2 : attributes_end]), bytes(data[attributes_end:length])
+    ).write()
+
+
+class MrtWriter:
+    """ Writer of BGP4MP_ET records, messages received by both connections of the session go to the same file """
+
+    def __init__(self, path):
+        """ Class constructor """
+
+        self.path = path
+        self.file = open_mrt(path, "ab")
+        self.flush_scheduled = False
+
+    def write(self, record):
+        """ Add record to the file buffer, buffer gets flushed shortly after """
+
+        self.file.write(record)
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_later(MRT_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        """ Write buffered records out """
+
+        self.flush_scheduled = False
+        self.file.flush()
+
+    def close(self):
+        """ Flush and close the file """
+
+        self.file.close()
+
+    def encode(self, fsm, subtype, data, timestamp):
+        """ Encode BGP4MP_ET record, peer and local AS are 2-octet as the sessions do not negotiate 4-octet AS """
+
+        local_ip = fsm.writer.get_extra_info("sockname")[0] if fsm.writer else "0.0.0.0"
+        seconds = int(timestamp)
+
+        return MRT_HEADER.pack(seconds, BGP4MP_ET, subtype, BGP4MP_ET_HEADER.size + len(data)) + (
+            BGP4MP_ET_HEADER.pack(
+                int((timestamp - seconds) * 1000000), fsm.peer_asn, fsm.local_asn, 0, AFI_IPV4, socket.inet_aton(fsm.peer_ip), socket.inet_aton(local_ip)
+            )
+            + data
+        )
+
+    def record_message(self, fsm, data, timestamp):
+        """ Record message received by the FSM """
+
+        self.write(self.encode(fsm, BGP4MP_MESSAGE, data, timestamp))
+
+    def record_state_change(self, fsm, old_state, new_state):
+        """ Record FSM state change """
+
+        self.write(self.encode(fsm, BGP4MP_STATE_CHANGE, struct.pack("!HH", BGP4MP_STATES[old_state], BGP4MP_STATES[new_state]), time.time()))
+
+
+def dump_table(path, peers, local_id, timestamp=None, view_name=""):
+    """ Write TABLE_DUMP_V2 file, peers is list of (peer_ip, peer_id, peer_asn, routes) snapshots of Adj-RIB-In """
+
+    timestamp = int(time.time()) if timestamp is None else timestamp
+
+    with open_mrt(path, "wb") as file:
+        name = view_name.encode()
+        body = [struct.pack("!4sH", socket.inet_aton(local_id), len(name)), name, struct.pack("!H", len(peers))]
+        for peer_ip, peer_id, peer_asn, _ in peers:
+            body.append(struct.pack("!B4s4sL", PEER_TYPE_AS4, socket.inet_aton(peer_id or "0.0.0.0"), socket.inet_aton(peer_ip), peer_asn))
+        body = b"".join(body)
+        file.write(MRT_HEADER.pack(timestamp, TABLE_DUMP_V2, PEER_INDEX_TABLE, len(body)) + body)
+
+        # Each distinct attribute set gets converted into 4-octet AS form only once
+        entries = {}
+        attributes = {}
+        for index, (_, _, _, routes) in enumerate(peers):
+            for key, attribute_set in routes.items():
+                raw_data = attributes.get(attribute_set)
+                if raw_data is None:
+                    raw_data = attributes[attribute_set] = attributes_as2_to_as4(attribute_set.raw_data)
+                entries.setdefault(key, []).append(struct.pack("!HLH", index, timestamp, len(raw_data)) + raw_data)
+
+        # Routes were not timestamped when received, originated time is the time of the dump
+        for sequence, key in enumerate(sorted(entries)):
+            body = bgp_message.encode_prefix(key)
+            body = struct.pack("!L", sequence) + body + struct.pack("!H", len(entries[key])) + b"".join(entries[key])
+            file.write(MRT_HEADER.pack(timestamp, TABLE_DUMP_V2, RIB_IPV4_UNICAST, len(body)) + body)
+
+    return len(entries)
+
+
+async def table_dump_loop(path, loc_rib, local_id, interval):
+    """ Periodically dump every Adj-RIB-In registered with the Loc-RIB, file name gets formatted with strftime """
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep(interval)
+
+        # Snapshot is taken on the loop, encoding and writing happen in executor thread
+        peers = [(_.peer_ip, _.peer_id, _.peer_asn, {**_.stale, **_.routes}) for _ in loc_rib.adj_ribs_in]
+        timestamp = int(time.time())
+        await loop.run_in_executor(None, dump_table, time.strftime(path, time.localtime(timestamp)), peers, local_id, timestamp)
+
+
+class MrtReplay:
+    """ Feed routes from MRT file through UPDATE decoding into Adj-RIB-In of every peer found in it, no sockets involved """
+
+    def __init__(self, loc_rib=None, local_asn=None, batch_size=REPLAY_BATCH_SIZE):
+        """ Class constructor """
+
+        self.loc_rib = loc_rib
+        self.local_asn = local_asn
+        self.batch_size = batch_size
+
+        self.adj_ribs_in = {}
+        self.peer_table = []
+
+        # UPDATE messages decoded from BGP4MP records and routes from TABLE_DUMP_V2 records waiting to be applied, per peer
+        self.pending_messages = {}
+        self.pending_routes = {}
+        self.pending_count = 0
+
+        # Same attributes repeat over and over, each distinct block gets converted once
+        self.attributes = {}
+
+        self.records = 0
+        self.messages = 0
+        self.prefixes = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def peer(self, peer_ip, peer_asn):
+        """ Return Adj-RIB-In of the peer, create it on first use """
+
+        adj_rib_in = self.adj_ribs_in.get((peer_ip, peer_asn))
+        if adj_rib_in is None:
+            adj_rib_in = self.adj_ribs_in[(peer_ip, peer_asn)] = AdjRibIn(peer_ip, peer_asn, self.local_asn, self.loc_rib)
+        return adj_rib_in
+
+    def replay(self, path):
+        """ Replay the whole file """
+
+        handlers = {
+            (TABLE_DUMP_V2, PEER_INDEX_TABLE): self.peer_index_table,
+            (TABLE_DUMP_V2, RIB_IPV4_UNICAST): self.rib_ipv4_unicast,
+        }
+
+        for _, record_type, subtype, body in read_records(path):
+            self.records += 1
+
+            try:
+                if record_type in {BGP4MP, BGP4MP_ET}:
+                    self.bgp4mp(subtype, body[4:] if record_type == BGP4MP_ET else body)
+                elif (record_type, subtype) in handlers:
+                    handlers[(record_type, subtype)](body)
+                else:
+                    self.skipped += 1
+
+            except (struct.error, IndexError, ValueError):
+                self.errors += 1
+
+        self.apply()
+
+        return self
+
+    def bgp4mp(self, subtype, body):
+        """ Decode message received from the peer, IPv4 peers only """
+
+        if subtype not in {BGP4MP_MESSAGE, BGP4MP_MESSAGE_AS4, BGP4MP_STATE_CHANGE, BGP4MP_STATE_CHANGE_AS4}:
+            self.skipped += 1
+            return
+
+        as4 = subtype in {BGP4MP_MESSAGE_AS4, BGP4MP_STATE_CHANGE_AS4}
+        header = "!LLHH" if as4 else "!HHHH"
+        peer_asn, _, _, afi = struct.unpack_from(header, body)
+        if afi != AFI_IPV4:
+            self.skipped += 1
+            return
+
+        i = struct.calcsize(header)
+        adj_rib_in = self.peer(socket.inet_ntoa(body[i : i + 4]), peer_asn)
+        data = body[i + 8 :]
+
+        # Session going down takes all the routes of the peer with it
+        if subtype in {BGP4MP_STATE_CHANGE, BGP4MP_STATE_CHANGE_AS4}:
+            old_state, new_state = struct.unpack_from("!HH", data)
+            if old_state == BGP4MP_STATES["Established"] and new_state != old_state:
+                self.apply()
+                adj_rib_in.flush()
+            return
+
+        self.messages += 1
+
+        if data[18] == bgp_message.OPEN:
+            adj_rib_in.peer_id = socket.inet_ntoa(data[24:28])
+            return
+
+        if data[18] != bgp_message.UPDATE:
+            return
+
+        # Recorded session may have negotiated Extended Message capability
+        message = DecodeMessage(update_as4_to_as2(data) if as4 else data, peer_asn=peer_asn, max_size=bgp_message.EXTENDED_MESSAGE_SIZE)
+        if message.message_error_code or message.data_len_error:
+            self.errors += 1
+            return
+
+        self.pending_messages.setdefault(adj_rib_in, []).append(message)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.apply()
+
+    def peer_index_table(self, body):
+        """ Map peer indexes used by RIB entries to peers, IPv6 peers are not supported """
+
+        name_len = struct.unpack_from("!H", body, 4)[0]
+        i = 6 + name_len
+        count = struct.unpack_from("!H", body, i)[0]
+        i += 2
+
+        self.peer_table = []
+        for _ in range(count):
+            peer_type = body[i]
+            peer_id = socket.inet_ntoa(body[i + 1 : i + 5])
+            i += 5
+            if peer_type & PEER_TYPE_IPV6:
+                peer_ip = None
+                i += 16
+            else:
+                peer_ip = socket.inet_ntoa(body[i : i + 4])
+                i += 4
+            if peer_type & PEER_TYPE_AS4:
+                peer_asn = struct.unpack_from("!L", body, i)[0]
+                i += 4
+            else:
+                peer_asn = struct.unpack_from("!H", body, i)[0]
+                i += 2
+
+            adj_rib_in = None
+            if peer_ip is not None:
+                adj_rib_in = self.peer(peer_ip, peer_asn)
+                adj_rib_in.peer_id = peer_id
+            self.peer_table.append(adj_rib_in)
+
+    def rib_ipv4_unicast(self, body):
+        """ Queue prefix entry of every peer, routes get applied in batches grouped by attributes """
+
+        length = body[4]
+        size = (length + 7) >> 3
+        key = int.from_bytes(body[5 : 5 + size], "big") << (40 - 8 * size) | length
+        count = struct.unpack_from("!H", body, 5 + size)[0]
+        i = 7 + size
+
+        for _ in range(count):
+            index, _, attributes_len = struct.unpack_from("!HLH", body, i)
+            raw_data = body[i + 8 : i + 8 + attributes_len]
+            i += 8 + attributes_len
+
+            adj_rib_in = self.peer_table[index]
+            if adj_rib_in is None:
+                self.skipped += 1
+                continue
+
+            # TABLE_DUMP_V2 attributes are always in 4-octet AS form
+            attributes = self.attributes.get(raw_data)
+            if attributes is None:
+                attributes = self.attributes[bytes(raw_data)] = attributes_as4_to_as2(raw_data)
+
+            self.pending_routes.setdefault(adj_rib_in, {}).setdefault(attributes, []).append(key)
+            self.pending_count += 1
+
+        if self.pending_count >= self.batch_size:
+            self.apply()
+
+    def apply(self):
+        """ Apply everything pending, routes from table dump get encoded into UPDATE messages so they take the same path """
+
+        for adj_rib_in, routes in self.pending_routes.items():
+            messages = bgp_message.encode_updates(
+                {bgp_message.intern_attribute_set(_): keys for _, keys in routes.items()}, max_size=bgp_message.EXTENDED_MESSAGE_SIZE
+            )
+            self.pending_messages.setdefault(adj_rib_in, []).extend(DecodeMessage(_, max_size=bgp_message.EXTENDED_MESSAGE_SIZE) for _ in messages)
+
+        for adj_rib_in, messages in self.pending_messages.items():
+            self.prefixes += len(adj_rib_in.update(messages))
+
+        self.pending_routes = {}
+        self.pending_messages = {}
+        self.pending_count = 0
+
+
+def peer_table(path, max_size=bgp_message.MAX_MESSAGE_SIZE):
+    """ Replay MRT file and encode the largest table found in it into UPDATE messages """
+
+    replay = MrtReplay().replay(path)
+    adj_rib_in = max(replay.adj_ribs_in.values(), key=len)
+
+    routes = {}
+    for key, attribute_set in adj_rib_in.routes.items():
+        routes.setdefault(attribute_set, []).append(key)
+
+    return bgp_message.encode_updates(routes, max_size=max_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay MRT file into the Loc-RIB at full speed")
+    parser.add_argument("path", help="MRT file with TABLE_DUMP_V2 or BGP4MP records, may be compressed with gzip or bzip2")
+    parser.add_argument("--local-asn", type=int, default=None, help="local AS number, tells eBGP peers apart from iBGP ones")
+    parser.add_argument("--batch-size", type=int, default=REPLAY_BATCH_SIZE, help="prefixes applied to the RIB at once")
+    parser.add_argument("--profile", action="store_true", help="profile the replay and print the top functions")
+    args = parser.parse_args()
+
+    loc_rib = LocRib()
+    replay = MrtReplay(loc_rib, args.local_asn, args.batch_size)
+
+    profile = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profile:
+        profile.enable()
+    replay.replay(args.path)
+    if profile:
+        profile.disable()
+    elapsed = time.perf_counter() - start
+
+    print(f"Records:     {replay.records} ({replay.skipped} skipped, {replay.errors} errors)")
+    print(f"Messages:    {replay.messages}")
+    print(f"Peers:       {len(replay.adj_ribs_in)}")
+    print(f"Prefixes:    {replay.prefixes} applied, {sum(len(_) for _ in replay.adj_ribs_in.values())} in Adj-RIB-In, {len(loc_rib)} in Loc-RIB")
+    print(f"Time:        {elapsed:.2f}s, {replay.prefixes / max(elapsed, 1e-6):.0f} prefixes/s")
+
+    if profile:
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+from array import array
+
+# Network masks indexed by prefix length
+MASKS = [(0xFFFFFFFF << (32 - _)) & 0xFFFFFFFF for _ in range(33)]
+
+# Address bit following the prefix of given length, none for /32
+BITS = [1 << (31 - _) for _ in range(32)] + [0]
+
+# Marks glue nodes that only join two branches and do not hold any prefix
+EMPTY = object()
+
+
+class PrefixTrie:
+    """ Path compressed binary trie of IPv4 prefixes, nodes are stored in flat arrays and referred to by index """
+
+    def __init__(self):
+        """ Class constructor """
+
+        self.addresses = array("L")
+        self.lengths = array("B")
+        self.left = array("i")
+        self.right = array("i")
+        self.values = []
+
+        self.root = -1
+        self.free = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.find(key) != -1
+
+    def new_node(self, address, length, value):
+        """ Allocate node, reuse slot of a deleted one if possible """
+
+        if self.free:
+            node = self.free.pop()
+            self.addresses[node] = address
+            self.lengths[node] = length
+            self.left[node] = -1
+            self.right[node] = -1
+            self.values[node] = value
+            return node
+
+        self.addresses.append(address)
+        self.lengths.append(length)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.values.append(value)
+        return len(self.values) - 1
+
+    def child(self, node, address):
+        """ Child of the node on the side given by the address bit following the node prefix """
+
+        return self.right[node] if address & BITS[self.lengths[node]] else self.left[node]
+
+    def set_child(self, parent, address, node):
+        """ Attach node to the parent, or make it the root if there is no parent """
+
+        if parent == -1:
+            self.root = node
+        elif address & BITS[self.lengths[parent]]:
+            self.right[parent] = node
+        else:
+            self.left[parent] = node
+
+    def insert(self, key, value):
+        """ Add prefix given by packed key (address in upper 32 bits, length in lower 8 bits) or replace its value """
+
+        length = key & 0xFF
+        address = (key >> 8) & MASKS[length]
+        addresses, lengths = self.addresses, self.lengths
+
+        parent = -1
+        node = self.root
+
+        while node != -1:
+            node_length = lengths[node]
+            common = min(length, node_length, 32 - (address ^ addresses[node]).bit_length())
+
+            if common < node_length:
+                break
+
+            if node_length == length:
+                if self.values[node] is EMPTY:
+                    self.count += 1
+                self.values[node] = value
+                return
+
+            parent = node
+            node = self.child(node, address)
+
+        new = self.new_node(address, length, value)
+        self.count += 1
+
+        if node != -1:
+            node_address = addresses[node]
+            common = min(length, 32 - (address ^ node_address).bit_length())
+
+            # New prefix covers the existing node
+            if common == length:
+                self.set_child(new, node_address, node)
+
+            # New prefix and the existing node branch off at the common part of their addresses
+            else:
+                glue = self.new_node(address & MASKS[common], common, EMPTY)
+                self.set_child(glue, address, new)
+                self.set_child(glue, node_address, node)
+                new = glue
+
+        self.set_child(parent, address, new)
+
+    def bulk_load(self, items):
+        """ Load (key, value) pairs from table dump, empty trie gets built bottom up in a single pass over sorted prefixes """
+
+        if self.root != -1:
+            for key, value in items:
+                self.insert(key, value)
+            return
+
+        addresses, lengths = self.addresses, self.lengths
+
+        # Prefixes sorted by address and length never cover the ones before them, so each of them hangs off the rightmost path
+        stack = []
+        for key, value in sorted(items, key=lambda _: (_[0] >> 8, _[0] & 0xFF)):
+            length = key & 0xFF
+            address = (key >> 8) & MASKS[length]
+
+            if stack and lengths[stack[-1]] == length and addresses[stack[-1]] == address:
+                self.values[stack[-1]] = value
+                continue
+
+            # Leave the part of the path that does not cover the new prefix, last node left becomes its sibling
+            sibling = -1
+            while stack and addresses[stack[-1]] != address & MASKS[lengths[stack[-1]]]:
+                sibling = stack.pop()
+
+            parent = stack[-1] if stack else -1
+            node = self.new_node(address, length, value)
+            self.count += 1
+
+            if sibling != -1:
+                common = 32 - (address ^ addresses[sibling]).bit_length()
+                if parent == -1 or common > lengths[parent]:
+                    glue = self.new_node(address & MASKS[common], common, EMPTY)
+                    self.set_child(glue, addresses[sibling], sibling)
+                    self.set_child(parent, address, glue)
+                    stack.append(glue)
+                    parent = glue
+
+            self.set_child(parent, address, node)
+            stack.append(node)
+
+    def find(self, key):
+        """ Index of the node holding exactly given prefix or -1 """
+
+        length = key & 0xFF
+        address = (key >> 8) & MASKS[length]
+        addresses, lengths = self.addresses, self.lengths
+
+        left, right = self.left, self.right
+
+        # Follow the address bits and compare the prefix only at the end, nodes passed on the way share it
+        node = self.root
+        while node != -1 and lengths[node] < length:
+            node = right[node] if address & BITS[lengths[node]] else left[node]
+
+        if node == -1 or lengths[node] != length or addresses[node] != address or self.values[node] is EMPTY:
+            return -1
+
+        return node
+
+    def get(self, key, default=None):
+        """ Exact match lookup """
+
+        node = self.find(key)
+        return default if node == -1 else self.values[node]
+
+    def longest_match(self, address):
+        """ Longest prefix match of 32 bit address, return (key, value) or None """
+
+        addresses, lengths, values, left, right = self.addresses, self.lengths, self.values, self.left, self.right
+
+        # Descend along the address bits without comparing prefixes, path compressed nodes get verified on the way back
+        candidates = []
+        node = self.root
+        while node != -1:
+            if values[node] is not EMPTY:
+                candidates.append(node)
+            node = right[node] if address & BITS[lengths[node]] else left[node]
+
+        for node in reversed(candidates):
+            length = lengths[node]
+            if addresses[node] == address & MASKS[length]:
+                return addresses[node] << 8 | length, values[node]
+
+        return None
+
+    def more_specifics(self, key):
+        """ Iterate (key, value) of the prefix and all prefixes covered by it """
+
+        length = key & 0xFF
+        address = (key >> 8) & MASKS[length]
+        addresses, lengths = self.addresses, self.lengths
+
+        node = self.root
+        while node != -1 and lengths[node] < length:
+            node = self.child(node, address)
+
+        if node == -1 or addresses[node] & MASKS[length] != address:
+            return
+
+        yield from self.subtree(node)
+
+    def subtree(self, node):
+        """ Iterate (key, value) of all prefixes stored under given node in address order """
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.values[node] is not EMPTY:
+                yield self.addresses[node] << 8 | self.lengths[node], self.values[node]
+            if self.right[node] != -1:
+                stack.append(self.right[node])
+            if self.left[node] != -1:
+                stack.append(self.left[node])
+
+    def items(self):
+        """ Iterate (key, value) of all prefixes in address order """
+
+        return self.subtree(self.root) if self.root != -1 else iter(())
+
+    def delete(self, key):
+        """ Remove prefix, return True if it was present """
+
+        length = key & 0xFF
+        address = (key >> 8) & MASKS[length]
+        addresses, lengths = self.addresses, self.lengths
+
+        grandparent = parent = -1
+        node = self.root
+        while node != -1 and lengths[node] < length:
+            if addresses[node] != address & MASKS[lengths[node]]:
+                return False
+            grandparent, parent = parent, node
+            node = self.child(node, address)
+
+        if node == -1 or lengths[node] != length or addresses[node] != address or self.values[node] is EMPTY:
+            return False
+
+        self.count -= 1
+        left, right = self.left[node], self.right[node]
+
+        # Node still joins two branches, keep it as glue
+        if left != -1 and right != -1:
+            self.values[node] = EMPTY
+            return True
+
+        self.release(node)
+        child = left if left != -1 else right
+        self.set_child(parent, address, child)
+
+        # Parent glue left with single child is not needed anymore
+        if child == -1 and parent != -1 and self.values[parent] is EMPTY:
+            sibling = self.left[parent] if self.left[parent] != -1 else self.right[parent]
+            self.release(parent)
+            self.set_child(grandparent, address, sibling)
+
+        return True
+
+    def release(self, node):
+        """ Return node slot to the free list """
+
+        self.values[node] = EMPTY
+        self.free.append(node)
@@ -30,12 +30,36 @@ import struct
 
 import loguru
 
+import bgp_event
+import bgp_mrt
+from bgp_adj_rib_in import AdjRibIn
 from bgp_event import BgpEvent
 from bgp_fsm import BgpFsm
 
 
 class BgpSession:
-    def __init__(self, local_id, local_asn, local_hold_time, peer_ip, peer_asn, bgp_listeners=None, active_mode=True, passive_mode=True):
+    def __init__(
+        self,
+        local_id,
+        local_asn,
+        local_hold_time,
+        peer_ip,
+        peer_asn,
+        bgp_listeners=None,
+        active_mode=True,
+        passive_mode=True,
+        loc_rib=None,
+        update_groups=None,
+        export_policy=None,
+        decoder_pool=None,
+        trace_prefixes=False,
+        bgp_port=179,
+        mrt_messages=None,
+        extended_message=True,
+        route_refresh=True,
+        graceful_restart=True,
+        import_policy=None,
+    ):
         """ Class constructor """
 
         self.local_id = local_id
@@ -46,29 +70,98 @@ class BgpSession:
         self.bgp_listeners = bgp_listeners
         self.active_mode = active_mode
         self.passive_mode = passive_mode
+        self.loc_rib = loc_rib
+        self.update_groups = update_groups
+        self.export_policy = export_policy
+        self.decoder_pool = decoder_pool
+        self.trace_prefixes = trace_prefixes
+        self.bgp_port = bgp_port
+        self.extended_message = extended_message
+        self.route_refresh = route_refresh
+        self.graceful_restart = graceful_restart
+        self.import_policy = import_policy
+
+        # Messages received from the peer get recorded into MRT file, shared by both FSMs
+        self.mrt_writer = bgp_mrt.MrtWriter(mrt_messages) if mrt_messages else None
 
         self.active_fsm = None
         self.passive_fsm = None
 
-        self.active_fsm = BgpFsm(self.local_id, self.local_asn, self.local_hold_time, self.peer_ip, self.peer_asn, mode="A")
-        self.passive_fsm = BgpFsm(self.local_id, self.local_asn, self.local_hold_time, self.peer_ip, self.peer_asn, mode="P")
+        # Both FSMs share the same Adj-RIB-In as only one of them can stay in Established state
+        self.adj_rib_in = AdjRibIn(self.peer_ip, self.peer_asn, self.local_asn, self.loc_rib, self.import_policy)
+
+        self.active_fsm = BgpFsm(
+            self.local_id,
+            self.local_asn,
+            self.local_hold_time,
+            self.peer_ip,
+            self.peer_asn,
+            mode="A",
+            adj_rib_in=self.adj_rib_in,
+            update_groups=self.update_groups,
+            export_policy=self.export_policy,
+            decoder_pool=self.decoder_pool,
+            trace_prefixes=self.trace_prefixes,
+            bgp_port=self.bgp_port,
+            mrt_writer=self.mrt_writer,
+            extended_message=self.extended_message,
+            route_refresh=self.route_refresh,
+            graceful_restart=self.graceful_restart,
+        )
+        self.passive_fsm = BgpFsm(
+            self.local_id,
+            self.local_asn,
+            self.local_hold_time,
+            self.peer_ip,
+            self.peer_asn,
+            mode="P",
+            adj_rib_in=self.adj_rib_in,
+            update_groups=self.update_groups,
+            export_policy=self.export_policy,
+            decoder_pool=self.decoder_pool,
+            trace_prefixes=self.trace_prefixes,
+            bgp_port=self.bgp_port,
+            mrt_writer=self.mrt_writer,
+            extended_message=self.extended_message,
+            route_refresh=self.route_refresh,
+            graceful_restart=self.graceful_restart,
+        )
 
         asyncio.create_task(self.connection_state_tracking())
         asyncio.create_task(self.connection_collision_detection())
 
+    def refresh_routes(self):
+        """ Get the routes from the peer again, session gets reset if the peer does not support Route Refresh """
+
+        for fsm in (self.active_fsm, self.passive_fsm):
+            if fsm.state == "Established":
+                fsm.enqueue_event(BgpEvent(bgp_event.ROUTE_REFRESH_REQUEST if fsm.route_refresh_negotiated else bgp_event.AUTOMATIC_STOP))
+
+    def set_import_policy(self, import_policy):
+        """ Replace import policy, routes already received get evaluated against it once the peer sends them again """
+
+        self.import_policy = import_policy
+        self.adj_rib_in.import_policy = import_policy
+        self.refresh_routes()
+
     async def connection_state_tracking(self):
-        """ Restart both connections if both of them are in Idle state """
+        """ Restart both connections if both of them are in Idle state, keep listening for restarted peer while the session is Established """
 
         await asyncio.sleep(1)
 
         while True:
             if self.active_mode and self.active_fsm.state == "Idle" and self.passive_fsm.state != "Established":
-                self.active_fsm.enqueue_event(BgpEvent("Event 3: AutomaticStart"))
+                self.active_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_START))
 
             if self.passive_mode and self.passive_fsm.state == "Idle" and self.active_fsm.state != "Established":
-                self.passive_fsm.enqueue_event(BgpEvent("Event 5: AutomaticStart_with_PassiveTcpEstablishment"))
+                self.passive_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_START_WITH_PASSIVE_TCP_ESTABLISHMENT))
                 self.bgp_listeners[self.peer_ip] = self.passive_fsm
 
+            # Peer that negotiated Graceful Restart may connect again after it restarted, established FSM takes the connection over
+            for fsm in (self.active_fsm, self.passive_fsm):
+                if fsm.state == "Established" and fsm.graceful_restart_negotiated:
+                    self.bgp_listeners[self.peer_ip] = fsm
+
             await asyncio.sleep(10)
 
     async def connection_collision_detection(self):
@@ -84,18 +177,18 @@ class BgpSession:
 
                 if self.active_fsm.state == "Established" and self.passive_fsm.state != "Established":
                     self.logger.debug("Collision detection E/!E - Closing passive connection")
-                    self.passive_fsm.enqueue_event(BgpEvent("Event 8: AutomaticStop"))
+                    self.passive_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_STOP))
 
                 if self.passive_fsm.state == "Established" and self.active_fsm.state != "Established":
                     self.logger.debug("Collision detection !E/E - Closing active connection")
-                    self.active_fsm.enqueue_event(BgpEvent("Event 8: AutomaticStop"))
+                    self.active_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_STOP))
 
                 if self.active_fsm.state == "OpenConfirm" and self.passive_fsm.state == "OpenConfirm":
                     if struct.unpack("!L", socket.inet_aton(self.local_id))[0] > struct.unpack("!L", socket.inet_aton(self.active_fsm.peer_id))[0]:
                         self.logger.debug("Collision detection OC/OC LID > PID - Closing passive connection")
-                        self.passive_fsm.enqueue_event(BgpEvent("Event 8: AutomaticStop"))
+                        self.passive_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_STOP))
                     else:
                         self.logger.debug("Collision detection OC/OC LID < PID - Closing active connection")
-                        self.active_fsm.enqueue_event(BgpEvent("Event 8: AutomaticStop"))
+                        self.active_fsm.enqueue_event(BgpEvent(bgp_event.AUTOMATIC_STOP))
 
             await asyncio.sleep(0.1)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import multiprocessing
+import socket
+import struct
+import weakref
+
+import loguru
+
+import bgp_event
+from bgp_adj_rib_in import AdjRibIn
+from bgp_event import BgpEvent
+from bgp_loc_rib import LocRib
+from bgp_message import intern_attribute_set
+from bgp_session import BgpSession
+from bgp_update_group import UpdateGroups
+
+# IPC record types, every record starts with its type byte
+RECORD_ROUTE_ADD = 1
+RECORD_ROUTE_DEL = 2
+RECORD_ATTRIBUTES = 3
+RECORD_ATTRIBUTES_FREE = 4
+RECORD_PEER = 5
+
+# Type, prefix address, prefix length, peer index, attribute set id
+ROUTE_ADD = struct.Struct("!BLBHL")
+
+# Type, prefix address, prefix length
+ROUTE_DEL = struct.Struct("!BLB")
+
+# Type, attribute set id, length of raw attribute bytes following the record
+ATTRIBUTES = struct.Struct("!BLH")
+
+# Type, attribute set id
+ATTRIBUTES_FREE = struct.Struct("!BL")
+
+# Type, peer index, peer ASN, eBGP flag, peer BGP ID, peer address
+PEER = struct.Struct("!BHLB4s4s")
+
+# Records are sent in frames prefixed with their total length
+FRAME = struct.Struct("!L")
+
+
+class RibFeed:
+    """ Sending side of the IPC channel, encodes Loc-RIB changes into records """
+
+    def __init__(self):
+        """ Class constructor """
+
+        self.peers = {}
+
+        # Raw attribute bytes cross the channel once, routes refer to them by id
+        self.attribute_ids = weakref.WeakKeyDictionary()
+        self.attribute_id = 0
+        self.released = []
+
+    def encode(self, changes):
+        """ Encode batch of (key, adj_rib_in, attribute_set) changes into single frame """
+
+        records = bytearray()
+
+        for key, adj_rib_in, attribute_set in changes:
+            if adj_rib_in is None:
+                records += ROUTE_DEL.pack(RECORD_ROUTE_DEL, key >> 8, key & 0xFF)
+                continue
+
+            # Peer gets described again whenever its BGP ID changes after reconnection
+            peer = self.peers.get(adj_rib_in)
+            if peer is None or peer[1] != adj_rib_in.peer_id:
+                if peer is None:
+                    peer = self.peers[adj_rib_in] = [len(self.peers), None]
+                peer[1] = adj_rib_in.peer_id
+                records += PEER.pack(
+                    RECORD_PEER,
+                    peer[0],
+                    adj_rib_in.peer_asn,
+                    adj_rib_in.ebgp,
+                    socket.inet_aton(adj_rib_in.peer_id or "0.0.0.0"),
+                    socket.inet_aton(adj_rib_in.peer_ip),
+                )
+
+            attribute_id = self.attribute_ids.get(attribute_set)
+            if attribute_id is None:
+                self.attribute_id += 1
+                attribute_id = self.attribute_ids[attribute_set] = self.attribute_id
+                weakref.finalize(attribute_set, self.released.append, attribute_id)
+                records += ATTRIBUTES.pack(RECORD_ATTRIBUTES, attribute_id, len(attribute_set.raw_data)) + attribute_set.raw_data
+
+            records += ROUTE_ADD.pack(RECORD_ROUTE_ADD, key >> 8, key & 0xFF, peer[0], attribute_id)
+
+        # Ids are never reused so the central RIB can forget released sets right away
+        released, self.released = self.released, []
+        for attribute_id in released:
+            records += ATTRIBUTES_FREE.pack(RECORD_ATTRIBUTES_FREE, attribute_id)
+
+        return FRAME.pack(len(records)) + records if records else b""
+
+
+class RibMirror:
+    """ Receiving side of the IPC channel, keeps best routes of the other side as Adj-RIB-In of their peers """
+
+    def __init__(self, loc_rib):
+        """ Class constructor """
+
+        self.loc_rib = loc_rib
+        self.peers = {}
+        self.attribute_sets = {}
+        self.best = {}
+
+    def apply(self, data):
+        """ Apply frame of records, return keys of all affected prefixes """
+
+        data = memoryview(data)
+        keys = []
+        i = 0
+
+        while i < len(data):
+            record_type = data[i]
+
+            if record_type == RECORD_ROUTE_ADD:
+                _, address, length, peer_index, attribute_id = ROUTE_ADD.unpack_from(data, i)
+                i += ROUTE_ADD.size
+                key = address << 8 | length
+                adj_rib_in = self.peers[peer_index]
+                current = self.best.get(key)
+                if current is not None and current is not adj_rib_in:
+                    current.routes.pop(key, None)
+                adj_rib_in.routes[key] = self.attribute_sets[attribute_id]
+                self.best[key] = adj_rib_in
+                keys.append(key)
+
+            elif record_type == RECORD_ROUTE_DEL:
+                _, address, length = ROUTE_DEL.unpack_from(data, i)
+                i += ROUTE_DEL.size
+                key = address << 8 | length
+                current = self.best.pop(key, None)
+                if current is not None:
+                    current.routes.pop(key, None)
+                keys.append(key)
+
+            elif record_type == RECORD_ATTRIBUTES:
+                _, attribute_id, length = ATTRIBUTES.unpack_from(data, i)
+                i += ATTRIBUTES.size
+                self.attribute_sets[attribute_id] = intern_attribute_set(data[i : i + length])
+                i += length
+
+            elif record_type == RECORD_ATTRIBUTES_FREE:
+                _, attribute_id = ATTRIBUTES_FREE.unpack_from(data, i)
+                i += ATTRIBUTES_FREE.size
+                self.attribute_sets.pop(attribute_id, None)
+
+            elif record_type == RECORD_PEER:
+                _, peer_index, peer_asn, ebgp, peer_id, peer_ip = PEER.unpack_from(data, i)
+                i += PEER.size
+                adj_rib_in = self.peers.get(peer_index)
+                if adj_rib_in is None:
+                    adj_rib_in = self.peers[peer_index] = AdjRibIn(socket.inet_ntoa(peer_ip), peer_asn, loc_rib=self.loc_rib)
+                adj_rib_in.ebgp = bool(ebgp)
+                adj_rib_in.peer_id = socket.inet_ntoa(peer_id) if peer_id != b"\x00\x00\x00\x00" else None
+
+            else:
+                raise ValueError(f"Unknown IPC record type {record_type}")
+
+        return keys
+
+    def flush(self):
+        """ Drop all the routes of the other side """
+
+        self.best.clear()
+        for adj_rib_in in self.peers.values():
+            adj_rib_in.flush()
+
+
+class ShardPool:
+    """ BGP sessions spread across worker processes, main process accepts connections and hands them over to the owning worker """
+
+    def __init__(self, sessions, workers, logger_setup=None):
+        """ Class constructor, sessions is list of BgpSession keyword arguments """
+
+        self.logger = loguru.logger.bind(peer="Shard pool", state="")
+
+        context = multiprocessing.get_context("spawn")
+
+        self.owners = {}
+        self.channels = []
+        self.processes = []
+        self.worker_sockets = []
+        rib_sockets = []
+
+        for index in range(workers):
+            shard = sessions[index::workers]
+            for session in shard:
+                self.owners[session["peer_ip"]] = index
+
+            # Accepted connections go over SOCK_SEQPACKET so every descriptor arrives with its own peer address
+            channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            rib_socket, worker_rib_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.channels.append(channel)
+            self.worker_sockets += [worker_channel, worker_rib_socket]
+            rib_sockets.append(rib_socket)
+
+            self.processes.append(context.Process(target=worker_main, args=(shard, worker_channel, worker_rib_socket, logger_setup), daemon=True))
+
+        self.processes.append(context.Process(target=rib_main, args=(rib_sockets, logger_setup), daemon=True))
+        self.worker_sockets += rib_sockets
+
+    def start(self):
+        """ Start worker and central RIB processes """
+
+        for process in self.processes:
+            process.start()
+
+        # Child processes hold their own copies now
+        for sock in self.worker_sockets:
+            sock.close()
+        self.worker_sockets = []
+
+        self.logger.info(f"Started {len(self.channels)} workers")
+
+    async def broker(self, listener):
+        """ Accept incoming BGP connections and pass them to the worker owning the peer """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            sock, peer = await loop.sock_accept(listener)
+            index = self.owners.get(peer[0])
+
+            if index is not None:
+                socket.send_fds(self.channels[index], [socket.inet_aton(peer[0])], [sock.fileno()])
+
+            sock.close()
+
+
+def worker_main(sessions, channel, rib_socket, logger_setup=None):
+    """ Worker process entry point """
+
+    if logger_setup:
+        logger_setup()
+
+    asyncio.run(worker(sessions, channel, rib_socket))
+
+
+async def worker(sessions, channel, rib_socket):
+    """ Run BGP sessions of the shard, stream their best routes to the central RIB and advertise best routes selected by it """
+
+    loop = asyncio.get_running_loop()
+
+    bgp_listeners = {}
+    loc_rib = LocRib()
+
+    # Peers get routes selected across all the workers, mirrored from the central RIB
+    global_rib = LocRib()
+    update_groups = UpdateGroups(global_rib)
+
+    for session in sessions:
+        BgpSession(**session, bgp_listeners=bgp_listeners, loc_rib=loc_rib, update_groups=update_groups)
+
+    # Worker exits once the main process closes its end of the channel
+    closed = loop.create_future()
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), receive_connection, channel, bgp_listeners, closed)
+
+    reader, writer = await asyncio.open_connection(sock=rib_socket)
+    tasks = [asyncio.create_task(rib_feed(loc_rib, writer)), asyncio.create_task(receive_rib_feed(RibMirror(global_rib), reader))]
+
+    await closed
+    for task in tasks:
+        task.cancel()
+
+
+def receive_connection(channel, bgp_listeners, closed):
+    """ Take over connection accepted by the main process """
+
+    try:
+        peer_ip, fds, _, _ = socket.recv_fds(channel, 4, 1)
+    except BlockingIOError:
+        return
+
+    if not fds:
+        asyncio.get_running_loop().remove_reader(channel.fileno())
+        closed.set_result(None)
+        return
+
+    sock = socket.socket(fileno=fds[0])
+    passive_fsm = bgp_listeners.pop(socket.inet_ntoa(peer_ip), None)
+
+    if passive_fsm:
+        asyncio.create_task(confirm_connection(passive_fsm, sock))
+
+    else:
+        sock.close()
+
+
+async def confirm_connection(passive_fsm, sock):
+    """ Wrap received socket into streams and hand it to the passive FSM """
+
+    sock.setblocking(False)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    peer = writer.get_extra_info("peername")
+    passive_fsm.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_CONFIRMED, reader=reader, writer=writer, peer_ip=peer[0], peer_port=peer[1]))
+
+
+async def rib_feed(loc_rib, writer):
+    """ Stream Loc-RIB changes to the other side of the IPC channel, starting with the whole current table """
+
+    feed = RibFeed()
+    queue = loc_rib.subscribe()
+
+    try:
+        while True:
+            changes = await queue.get()
+
+            # Everything queued meanwhile goes out in the same frame
+            while not queue.empty():
+                changes = changes + queue.get_nowait()
+
+            writer.write(feed.encode(changes))
+            await writer.drain()
+
+    except ConnectionError:
+        pass
+
+    finally:
+        loc_rib.unsubscribe(queue)
+
+
+def rib_main(rib_sockets, logger_setup=None):
+    """ Central RIB process entry point """
+
+    if logger_setup:
+        logger_setup()
+
+    asyncio.run(central_rib(rib_sockets))
+
+
+async def central_rib(rib_sockets):
+    """ Select best routes across all the workers and stream them back to every worker """
+
+    logger = loguru.logger.bind(peer="Central RIB", state="")
+    loc_rib = LocRib()
+
+    # Central RIB runs until all the workers are gone
+    tasks = []
+    for rib_socket in rib_sockets:
+        reader, writer = await asyncio.open_connection(sock=rib_socket)
+        tasks.append(asyncio.create_task(receive_rib_feed(RibMirror(loc_rib), reader)))
+        asyncio.create_task(rib_feed(loc_rib, writer))
+
+    size = 0
+    while not all(_.done() for _ in tasks):
+        await asyncio.sleep(10)
+        if len(loc_rib) != size:
+            size = len(loc_rib)
+            logger.info(f"Loc-RIB {size} prefixes")
+
+
+async def receive_rib_feed(mirror, reader):
+    """ Apply frames received from the other side of the IPC channel """
+
+    while True:
+        try:
+            length = FRAME.unpack(await reader.readexactly(FRAME.size))[0]
+            data = await reader.readexactly(length)
+
+        except asyncio.IncompleteReadError:
+            mirror.flush()
+            return
+
+        mirror.loc_rib.update(mirror.apply(data))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import argparse
+import asyncio
+import socket
+import struct
+
+import bgp_message
+import bgp_mrt
+from bgp_message import AttributeSet
+
+# Simulated peers listen on consecutive loopback addresses starting with this one
+SIMULATOR_BASE_ADDRESS = "127.0.1.1"
+SIMULATOR_PORT = 1179
+
+
+def synthetic_table(prefix_count, asn, next_hop, path_length=2, first_prefix="10.0.0.0", prefix_length=24, max_size=bgp_message.MAX_MESSAGE_SIZE):
+    """ Encode table of consecutive prefixes announced with single attribute set into UPDATE messages """
+
+    as_path = [asn] + [64512 + _ for _ in range(path_length - 1)]
+    attributes = (
+        bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, bgp_message.ORIGIN_IGP])
+        + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 2 + 2 * len(as_path), 2, len(as_path)])
+        + struct.pack(f"!{len(as_path)}H", *as_path)
+        + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4])
+        + socket.inet_aton(next_hop)
+    )
+
+    first = struct.unpack("!L", socket.inet_aton(first_prefix))[0]
+    step = 1 << (32 - prefix_length)
+    keys = [(first + _ * step) << 8 | prefix_length for _ in range(prefix_count)]
+
+    return bgp_message.encode_updates({AttributeSet(attributes): keys}, max_size=max_size)
+
+
+def recorded_table(path, max_size=bgp_message.MAX_MESSAGE_SIZE):
+    """ Load UPDATE messages from file holding raw BGP messages one after another, or the largest table from MRT file """
+
+    with open(path, "rb") as _:
+        data = _.read()
+
+    if not data.startswith(bgp_message.MARKER):
+        return bgp_mrt.peer_table(path, max_size)
+
+    messages = []
+    i = 0
+    while i + bgp_message.HEADER_SIZE <= len(data):
+        length, message_type = struct.unpack_from("!HB", data, i + 16)
+        if message_type == bgp_message.UPDATE:
+            messages.append(data[i : i + length])
+        i += length
+
+    return messages
+
+
+def table_prefix_count(table):
+    """ Count prefixes the table leaves announced once all its messages are applied """
+
+    prefixes = set()
+    for data in table:
+        update = bgp_message.DecodeMessage(data, max_size=bgp_message.EXTENDED_MESSAGE_SIZE).update
+        prefixes.difference_update(update.keys_del)
+        prefixes.update(update.keys_add)
+    return len(prefixes)
+
+
+class SimulatedPeer:
+    """ Minimal BGP speaker accepting connection from the tested BgpSession and streaming table to it """
+
+    def __init__(self, address, port, asn, bgp_id, table, hold_time=90, extended_message=False, graceful_restart=False):
+        """ Class constructor """
+
+        self.address = address
+        self.port = port
+        self.asn = asn
+        self.table = table
+        capabilities = [(bgp_message.CAPABILITY_EXTENDED_MESSAGE, b"")] if extended_message else []
+
+        # Restarting peer claims to keep forwarding state so the tested speaker holds its routes until End-of-RIB
+        if graceful_restart:
+            address_families = ((bgp_message.AFI_IPV4, bgp_message.SAFI_UNICAST, bgp_message.GRACEFUL_RESTART_FORWARDING_STATE),)
+            capabilities.append((bgp_message.CAPABILITY_GRACEFUL_RESTART, bgp_message.encode_graceful_restart(120, address_families)))
+            self.table = table + [bgp_message.END_OF_RIB_MESSAGE]
+
+        self.open_message = bgp_message.Open(
+            local_id=bgp_id, local_asn=asn, local_hold_time=hold_time, opt=bgp_message.encode_capabilities(capabilities)
+        ).write()
+        self.hold_time = hold_time
+
+        self.server = None
+        self.writer = None
+        self.sessions = 0
+        self.rx_messages = 0
+        self.rx_bytes = 0
+
+    async def start(self):
+        """ Start listening for connection from the tested speaker """
+
+        self.server = await asyncio.start_server(self.session, self.address, self.port)
+
+    async def stop(self):
+        """ Stop listening and drop the current session """
+
+        self.server.close()
+        await self.server.wait_closed()
+        self.flap()
+
+    def flap(self):
+        """ Drop the current session, tested speaker reconnects on its own """
+
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    async def session(self, reader, writer):
+        """ Exchange OPEN and KEEPALIVE, send the table once the session is up, then keep it alive and discard whatever arrives """
+
+        self.flap()
+        self.writer = writer
+        self.sessions += 1
+
+        writer.write(self.open_message + bgp_message.KEEPALIVE_MESSAGE)
+        keepalive = asyncio.create_task(self.send_keepalives(writer))
+
+        buffer = bytearray()
+        established = False
+
+        try:
+            while data := await reader.read(65536):
+                buffer += data
+                self.rx_bytes += len(data)
+
+                # Only message boundaries matter here, KEEPALIVE from the tested speaker means the session is up
+                i = 0
+                while len(buffer) - i >= bgp_message.HEADER_SIZE:
+                    length, message_type = struct.unpack_from("!HB", buffer, i + 16)
+                    if len(buffer) - i < length:
+                        break
+                    i += length
+                    self.rx_messages += 1
+
+                    if message_type == bgp_message.KEEPALIVE and not established:
+                        established = True
+                        writer.writelines(self.table)
+
+                    if message_type == bgp_message.NOTIFICATION:
+                        writer.close()
+
+                del buffer[:i]
+                await writer.drain()
+
+        except OSError:
+            pass
+
+        finally:
+            keepalive.cancel()
+            writer.close()
+            if self.writer is writer:
+                self.writer = None
+
+    async def send_keepalives(self, writer):
+        """ Keep the session alive """
+
+        while True:
+            await asyncio.sleep(self.hold_time / 3)
+            writer.write(bgp_message.KEEPALIVE_MESSAGE)
+
+
+class Simulator:
+    """ Set of simulated peers on consecutive loopback addresses """
+
+    def __init__(
+        self,
+        peer_count,
+        prefix_count,
+        port=SIMULATOR_PORT,
+        base_address=SIMULATOR_BASE_ADDRESS,
+        first_asn=65001,
+        recorded=None,
+        extended_message=False,
+        graceful_restart=False,
+    ):
+        """ Class constructor, all the peers announce the same prefixes with AS_PATH of different length """
+
+        base = struct.unpack("!L", socket.inet_aton(base_address))[0]
+        self.peers = []
+
+        # Tested speaker is expected to support Extended Message capability if the peers advertise it
+        max_size = bgp_message.EXTENDED_MESSAGE_SIZE if extended_message else bgp_message.MAX_MESSAGE_SIZE
+
+        # Recorded table is the same for every peer
+        if recorded:
+            recorded = recorded_table(recorded, max_size)
+            prefix_count = table_prefix_count(recorded)
+        self.prefix_count = prefix_count
+
+        for index in range(peer_count):
+            address = socket.inet_ntoa(struct.pack("!L", base + index))
+            asn = first_asn + index
+            table = recorded or synthetic_table(prefix_count, asn, address, path_length=1 + index % 3, max_size=max_size)
+            self.peers.append(SimulatedPeer(address, port, asn, address, table, extended_message=extended_message, graceful_restart=graceful_restart))
+
+    async def start(self):
+        """ Start all the peers """
+
+        for peer in self.peers:
+            await peer.start()
+
+    async def stop(self):
+        """ Stop all the peers and let their sessions finish """
+
+        for peer in self.peers:
+            await peer.stop()
+
+        await asyncio.sleep(0.1)
+
+    def flap(self, index=None):
+        """ Drop session of single peer or all of them """
+
+        for peer in self.peers if index is None else [self.peers[index]]:
+            peer.flap()
+
+
+async def run_simulator(peer_count, prefix_count, port, base_address, recorded=None, flap_interval=0, extended_message=False, graceful_restart=False):
+    """ Run simulator until interrupted, flap peers one after another if interval is set """
+
+    simulator = Simulator(peer_count, prefix_count, port, base_address, recorded=recorded, extended_message=extended_message, graceful_restart=graceful_restart)
+    await simulator.start()
+
+    print(f"Simulating {peer_count} peers on {simulator.peers[0].address} - {simulator.peers[-1].address} port {port}")
+
+    index = 0
+    while True:
+        await asyncio.sleep(flap_interval or 3600)
+        if flap_interval:
+            print(f"Flapping peer {simulator.peers[index].address}")
+            simulator.flap(index)
+            index = (index + 1) % len(simulator.peers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated BGP peers streaming tables on loopback")
+    parser.add_argument("--peers", type=int, default=4, help="number of simulated peers")
+    parser.add_argument("--prefixes", type=int, default=100000, help="number of prefixes in synthetic table")
+    parser.add_argument("--port", type=int, default=SIMULATOR_PORT, help="TCP port peers listen on")
+    parser.add_argument("--address", default=SIMULATOR_BASE_ADDRESS, help="address of the first peer")
+    parser.add_argument("--recorded", help="file with raw BGP messages or MRT file to stream instead of synthetic table")
+    parser.add_argument("--extended-message", action="store_true", help="advertise Extended Message capability and send UPDATE messages up to 65535 bytes")
+    parser.add_argument("--graceful-restart", action="store_true", help="advertise Graceful Restart capability and send End-of-RIB after the table")
+    parser.add_argument("--flap-interval", type=float, default=0, help="seconds between session flaps, zero disables flapping")
+    args = parser.parse_args()
+
+    asyncio.run(
+        run_simulator(args.peers, args.prefixes, args.port, args.address, args.recorded, args.flap_interval, args.extended_message, args.graceful_restart)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -25,56 +25,135 @@
 
 
 import asyncio
+import math
 
+import bgp_event
 from bgp_event import BgpEvent
 
+TIMER_WHEEL_TICK = 0.1
+TIMER_WHEEL_SIZE = 4096
 
-async def decrease_connect_retry_timer(self):
-    """ Decrease connect_retry_timer every second if its value is greater than zero """
 
-    self.logger.debug("Starting decrease_connect_retry_timer() coroutine")
+class Timer:
+    """ Single deadline registered with the timer wheel """
 
-    if not hasattr(self, "connect_retry_timer"):
-        self.connect_retry_timer = 0
+    __slots__ = ("callback", "deadline")
 
-    while True:
-        await asyncio.sleep(1)
-        if self.connect_retry_timer:
-            self.logger.debug(f"connect_retry_timer = {self.connect_retry_timer}")
-            self.connect_retry_timer -= 1
-            if not self.connect_retry_timer:
-                self.enqueue_event(BgpEvent("Event 9: ConnectRetryTimer_Expires"))
+    def __init__(self, callback):
+        self.callback = callback
+        self.deadline = None
 
 
-async def decrease_hold_timer(self):
-    """ Decrease hold_timer every second if its value is greater than zero """
+class TimerWheel:
+    """ Hashed timing wheel shared by all the FSMs in the process """
 
-    self.logger.debug("Starting decrease_hold_timer() coroutine")
+    def __init__(self, tick=TIMER_WHEEL_TICK, size=TIMER_WHEEL_SIZE):
+        """ Class constructor """
 
-    if not hasattr(self, "hold_timer"):
-        self.hold_timer = 0
+        self.tick = tick
+        self.size = size
+        self.slots = [{} for _ in range(size)]
+        self.timer_count = 0
+        self.processed_tick = None
+        self.origin = None
+        self.wakeup = None
+        self.task = None
 
-    while True:
-        await asyncio.sleep(1)
-        if self.hold_timer:
-            self.logger.debug(f"hold_timer = {self.hold_timer}")
-            self.hold_timer -= 1
-            if not self.hold_timer:
-                self.enqueue_event(BgpEvent("Event 10: HoldTimer_Expires"))
+    def now(self):
+        """ Current tick number """
 
+        return int((asyncio.get_running_loop().time() - self.origin) / self.tick)
 
-async def decrease_keepalive_timer(self):
-    """ Decrease keepalive_timer every second if its value is greater than zero """
+    def arm(self, timer, seconds):
+        """ Schedule timer to expire after given number of seconds, rearming already armed timer is O(1) """
 
-    self.logger.debug("Starting decrease_keepalive_timer() coroutine")
+        if self.task is None:
+            self.origin = asyncio.get_running_loop().time()
+            self.processed_tick = 0
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
 
-    if not hasattr(self, "keepalive_timer"):
-        self.keepalive_timer = 0
+        self.cancel(timer)
 
-    while True:
-        await asyncio.sleep(1)
-        if self.keepalive_timer:
-            self.logger.debug(f"keepalive_timer = {self.keepalive_timer}")
-            self.keepalive_timer -= 1
-            if not self.keepalive_timer:
-                self.enqueue_event(BgpEvent("Event 11: KeepaliveTimer_Expires"))
+        timer.deadline = max(self.now(), self.processed_tick) + max(1, math.ceil(seconds / self.tick))
+        self.slots[timer.deadline % self.size][timer] = None
+        self.timer_count += 1
+        self.wakeup.set()
+
+    def cancel(self, timer):
+        """ Remove timer from the wheel if it is armed """
+
+        if timer.deadline is not None:
+            del self.slots[timer.deadline % self.size][timer]
+            timer.deadline = None
+            self.timer_count -= 1
+
+    def remaining(self, timer):
+        """ Number of seconds left before timer expires, zero if timer is not armed """
+
+        if timer.deadline is None:
+            return 0
+
+        return math.ceil((timer.deadline - self.now()) * self.tick)
+
+    async def run(self):
+        """ Advance the wheel and fire expired timers, sleep until a timer gets armed when the wheel is empty """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self.timer_count:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                self.processed_tick = max(self.processed_tick, self.now())
+                continue
+
+            await asyncio.sleep(self.origin + (self.processed_tick + 1) * self.tick - loop.time())
+
+            now = self.now()
+            while self.processed_tick < now and self.timer_count:
+                self.processed_tick += 1
+                slot = self.slots[self.processed_tick % self.size]
+                for timer in [_ for _ in slot if _.deadline <= self.processed_tick]:
+                    del slot[timer]
+                    timer.deadline = None
+                    self.timer_count -= 1
+                    timer.callback()
+
+            self.processed_tick = max(self.processed_tick, now)
+
+
+timer_wheel = TimerWheel()
+
+
+def fsm_timer(name, event_code):
+    """ Create FSM attribute that arms timer on the shared wheel when set to number of seconds and cancels it when set to zero """
+
+    def get_timer(self):
+        timer = self.timers.get(name)
+        return timer_wheel.remaining(timer) if timer else 0
+
+    def set_timer(self, seconds):
+        timer = self.timers.get(name)
+
+        if timer is None:
+            timer = self.timers[name] = Timer(lambda: self.enqueue_event(BgpEvent(event_code)))
+
+        if seconds:
+            timer_wheel.arm(timer, seconds)
+        else:
+            timer_wheel.cancel(timer)
+
+    return property(get_timer, set_timer)
+
+
+connect_retry_timer = fsm_timer("connect_retry_timer", bgp_event.CONNECT_RETRY_TIMER_EXPIRES)
+hold_timer = fsm_timer("hold_timer", bgp_event.HOLD_TIMER_EXPIRES)
+keepalive_timer = fsm_timer("keepalive_timer", bgp_event.KEEPALIVE_TIMER_EXPIRES)
+
+
+def cancel_timers(self):
+    """ Remove all the FSM timers from the wheel """
+
+    for timer in self.timers.values():
+        timer_wheel.cancel(timer)
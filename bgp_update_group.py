@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+
+import bgp_event
+import bgp_message
+from bgp_event import BgpEvent
+
+
+def encode_changes(changes, export_policy, max_size, split_horizon=None):
+    """ Encode batch of Loc-RIB changes into UPDATE messages joined into single buffer, return it with the message count """
+
+    prefixes_add = {}
+    prefixes_del = []
+
+    # Routes learned from the peer given as split horizon are withdrawn instead of being sent back to it, peer is matched by address
+    # as routes selected by the central RIB in sharded mode refer to mirrored copies of Adj-RIB-In
+    for key, adj_rib_in, attribute_set in changes:
+        if attribute_set is not None and adj_rib_in.peer_ip != split_horizon and (export_policy is None or export_policy(key, adj_rib_in, attribute_set)):
+            prefixes_add.setdefault(attribute_set, []).append(key)
+        else:
+            prefixes_del.append(key)
+
+    messages = bgp_message.encode_updates(prefixes_add, prefixes_del, max_size)
+    return b"".join(messages), len(messages)
+
+
+class UpdateGroupMember:
+    """ Single peer of the update group with its own position in the shared UPDATE stream """
+
+    def __init__(self, group, fsm, backlog):
+        """ Class constructor """
+
+        self.group = group
+        self.fsm = fsm
+        self.backlog = backlog
+        self.position = group.log_base + len(group.log)
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """ Write the initial table and then every buffer appended to the group log, at the pace of this peer only """
+
+        group = self.group
+
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            while self.backlog or self.position < group.log_base + len(group.log):
+                # Backlog holds table copies made for this peer only, possibly wrapped in route refresh markers
+                if self.backlog:
+                    data, message_type, count = self.backlog.pop(0)
+                else:
+                    data, count, split_horizon = group.log[self.position - group.log_base]
+                    data, count = split_horizon.get(self.fsm.peer_ip, (data, count))
+                    message_type = bgp_message.UPDATE
+                    self.position += 1
+
+                if not self.fsm.tcp_connection_established:
+                    return
+
+                try:
+                    self.fsm.queue_output(data, message_type, count)
+                    await self.fsm.drain_output()
+
+                except OSError:
+                    self.fsm.logger.opt(ansi=True).info("<magenta>[TX-ERR]</> UPDATE")
+                    self.fsm.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
+                    self.fsm.tcp_connection_established = False
+                    return
+
+                group.trim()
+
+
+class UpdateGroup:
+    """ Peers with the same export policy and negotiated capabilities, every UPDATE gets encoded once for all of them """
+
+    def __init__(self, loc_rib, export_policy, max_message_size):
+        """ Class constructor """
+
+        self.loc_rib = loc_rib
+        self.export_policy = export_policy
+        self.max_message_size = max_message_size
+
+        self.members = {}
+
+        # Encoded UPDATE buffers not yet written to every member, log_base is the absolute position of the first one
+        # Every entry carries its own copies for the members whose routes are in it, with those routes withdrawn instead
+        self.log = []
+        self.log_base = 0
+
+        self.queue = loc_rib.subscribe()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """ Encode Loc-RIB changes once and hand the buffer to every member """
+
+        while True:
+            self.publish(await self.queue.get())
+
+    def publish(self, changes):
+        """ Append encoded changes to the log and wake up the members """
+
+        # Skip the encoding when nobody listens, members joining later get their own copy of the table
+        if not self.members:
+            return
+
+        data, count = encode_changes(changes, self.export_policy, self.max_message_size)
+
+        # Members are not sent their own routes back, only the ones announcing a route in this batch need their own copy
+        sources = {_[1].peer_ip for _ in changes if _[2] is not None}
+        split_horizon = {}
+        for fsm in self.members:
+            if fsm.peer_ip in sources and fsm.peer_ip not in split_horizon:
+                split_horizon[fsm.peer_ip] = encode_changes(changes, self.export_policy, self.max_message_size, fsm.peer_ip)
+
+        if data:
+            self.log.append((data, count, split_horizon))
+            for member in self.members.values():
+                member.wakeup.set()
+
+    def add(self, fsm):
+        """ Add peer to the group, it first receives the current table and then follows the shared stream """
+
+        # Changes still waiting in the queue are already in the Loc-RIB table, existing members get them now so the new one does not get them twice
+        while not self.queue.empty():
+            self.publish(self.queue.get_nowait())
+
+        # Peer supporting Graceful Restart gets End-of-RIB after the initial table
+        backlog = self.encode_table(fsm)
+        if fsm.graceful_restart_negotiated:
+            backlog.append((bgp_message.END_OF_RIB_MESSAGE, bgp_message.UPDATE, 1))
+
+        self.members[fsm] = UpdateGroupMember(self, fsm, backlog)
+
+    def encode_table(self, fsm):
+        """ Encode the whole current Loc-RIB table as backlog of single member, routes learned from the member itself are left out """
+
+        table = [(key, adj_rib_in, attribute_set) for key, (adj_rib_in, attribute_set) in self.loc_rib.routes.items() if adj_rib_in.peer_ip != fsm.peer_ip]
+        data, count = encode_changes(table, self.export_policy, self.max_message_size)
+        return [(data, bgp_message.UPDATE, count)] if data else []
+
+    def refresh(self, fsm, enhanced=False):
+        """ Send the whole table to the member again on its request, wrapped in BoRR and EoRR if Enhanced Route Refresh is negotiated """
+
+        member = self.members.get(fsm)
+        if member is None:
+            return
+
+        while not self.queue.empty():
+            self.publish(self.queue.get_nowait())
+
+        backlog = self.encode_table(fsm)
+        if enhanced:
+            backlog.insert(0, (bgp_message.ROUTE_REFRESH_MESSAGES[bgp_message.BEGINNING_OF_ROUTE_REFRESH], bgp_message.ROUTE_REFRESH, 1))
+            backlog.append((bgp_message.ROUTE_REFRESH_MESSAGES[bgp_message.END_OF_ROUTE_REFRESH], bgp_message.ROUTE_REFRESH, 1))
+        member.backlog += backlog
+
+        # Log entries the member did not write yet still follow the table, they may withdraw routes the table no longer has
+        member.wakeup.set()
+
+    def remove(self, fsm):
+        """ Remove peer from the group """
+
+        member = self.members.pop(fsm, None)
+        if member:
+            member.task.cancel()
+            self.trim()
+
+    def trim(self):
+        """ Drop buffers already written to all the members """
+
+        position = min((_.position for _ in self.members.values()), default=self.log_base + len(self.log))
+        if position > self.log_base:
+            del self.log[: position - self.log_base]
+            self.log_base = position
+
+
+class UpdateGroups:
+    """ Automatic grouping of Established peers by their export policy and negotiated capabilities """
+
+    def __init__(self, loc_rib):
+        """ Class constructor """
+
+        self.loc_rib = loc_rib
+        self.groups = {}
+
+    def join(self, fsm):
+        """ Add peer to the group matching its outbound parameters, create the group if needed """
+
+        key = (fsm.export_policy, fsm.max_message_size)
+        group = self.groups.get(key)
+
+        if group is None:
+            group = self.groups[key] = UpdateGroup(self.loc_rib, *key)
+
+        group.add(fsm)
+        fsm.update_group = group
+
+    def leave(self, fsm):
+        """ Remove peer from its group, drop the group when it becomes empty """
+
+        group = fsm.update_group
+        fsm.update_group = None
+
+        if group:
+            group.remove(fsm)
+            if not group.members:
+                group.task.cancel()
+                self.loc_rib.unsubscribe(group.queue)
+                del self.groups[(group.export_policy, group.max_message_size)]
@@ -25,22 +25,31 @@
 
 
 import asyncio
+import struct
+import time
 
+import bgp_event
 import bgp_message
 from bgp_event import BgpEvent
 
+# Queued messages get written out at once when this much of them accumulates or when the loop runs out of other work
+OUTPUT_FLUSH_SIZE = 64 * 1024
+
+# Senders of UPDATE messages wait while the transport holds more unsent data than this
+OUTPUT_HIGH_WATER = 256 * 1024
+
 
 async def open_connection(self):
     """ Open TCP connection to the BGP peer """
 
     self.logger.opt(depth=0).debug("Opening connection to peer")
     try:
-        reader, writer = await asyncio.open_connection(self.peer_ip, 179)
-        self.enqueue_event(BgpEvent("Event 16: Tcp_CR_Acked", reader=reader, writer=writer, peer_ip=self.peer_ip, peer_port=179))
+        reader, writer = await asyncio.open_connection(self.peer_ip, self.bgp_port)
+        self.enqueue_event(BgpEvent(bgp_event.TCP_CR_ACKED, reader=reader, writer=writer, peer_ip=self.peer_ip, peer_port=self.bgp_port))
 
     except OSError:
         self.tcp_connection_established = False
-        self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
+        self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
 
 
 def close_connection(self):
@@ -57,21 +66,61 @@ def close_connection(self):
     self.tcp_connection_established = False
     self.reader = None
     self.writer = None
+    self.rx_buffer.clear()
+    self.tx_buffer.clear()
+    self.tx_buffer_size = 0
+
+
+def queue_output(self, data, message_type, count=1, flush=False):
+    """ Add encoded message to the output queue, queued messages get coalesced into single write """
+
+    self.metrics.tx_messages[message_type] += count
+    self.metrics.tx_bytes[message_type] += len(data)
+
+    self.tx_buffer.append(data)
+    self.tx_buffer_size += len(data)
+
+    if flush or self.tx_buffer_size >= self.output_flush_size:
+        self.flush_output()
+
+    elif not self.tx_flush_scheduled:
+        self.tx_flush_scheduled = True
+        asyncio.get_running_loop().call_soon(self.flush_output)
+
+
+def flush_output(self):
+    """ Write everything queued so far to the transport """
+
+    self.tx_flush_scheduled = False
+
+    if not self.tx_buffer:
+        return
+
+    if self.writer:
+        self.writer.write(b"".join(self.tx_buffer) if len(self.tx_buffer) > 1 else self.tx_buffer[0])
+
+    self.tx_buffer.clear()
+    self.tx_buffer_size = 0
+
+
+async def drain_output(self):
+    """ Apply backpressure, wait until the transport gets below its high-water mark """
+
+    if self.writer:
+        await self.writer.drain()
 
 
 async def send_keepalive_message(self):
     """ Send Keepalive message """
 
     if self.tcp_connection_established:
-        message = bgp_message.Keepalive()
-
+        # Latency sensitive, goes out right away together with anything queued before it
         try:
-            self.writer.write(message.write())
-            await self.writer.drain()
+            self.queue_output(bgp_message.KEEPALIVE_MESSAGE, bgp_message.KEEPALIVE, flush=True)
 
         except OSError:
             self.logger.opt(ansi=True, depth=1).error("<magenta>[TX-ERR]</> KEEPALIVE")
-            self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
             self.tcp_connection_established = False
             await asyncio.sleep(1)
             return
@@ -89,12 +138,11 @@ async def send_notification_message(self, error_code, error_subcode=0, data=b"")
         message = bgp_message.Notification(error_code, error_subcode, data)
 
         try:
-            self.writer.write(message.write())
-            await self.writer.drain()
+            self.queue_output(message.write(), bgp_message.NOTIFICATION, flush=True)
 
         except OSError:
             self.logger.opt(ansi=True, depth=1).info(f"<magenta>[TX-ERR]</> NOTIFICATION - {error_code}, {error_subcode}")
-            self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
             self.tcp_connection_established = False
             await asyncio.sleep(1)
             return
@@ -105,19 +153,36 @@ async def send_notification_message(self, error_code, error_subcode=0, data=b"")
         self.logger.opt(ansi=True, depth=1).info(f"<magenta>[TX-ERR]</> NOTIFICATION {error_code}, {error_subcode}")
 
 
+async def send_route_refresh_message(self, subtype=bgp_message.ROUTE_REFRESH_REQUEST):
+    """ Send Route Refresh message """
+
+    if self.tcp_connection_established:
+        try:
+            self.queue_output(bgp_message.ROUTE_REFRESH_MESSAGES[subtype], bgp_message.ROUTE_REFRESH, flush=True)
+
+        except OSError:
+            self.logger.opt(ansi=True, depth=1).error(f"<magenta>[TX-ERR]</> ROUTE-REFRESH - subtype: {subtype}")
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
+            self.tcp_connection_established = False
+            await asyncio.sleep(1)
+            return
+
+        self.logger.opt(ansi=True, depth=1).info(f"<magenta>[TX]</> ROUTE-REFRESH - subtype: {subtype}")
+
+    else:
+        self.logger.opt(ansi=True, depth=1).error(f"<magenta>[TX-ERR]</> ROUTE-REFRESH - subtype: {subtype}")
+
+
 async def send_open_message(self):
     """ Send Open message """
 
     if self.tcp_connection_established:
-        message = bgp_message.Open(local_id=self.local_id, local_asn=self.local_asn, local_hold_time=self.local_hold_time)
-
         try:
-            self.writer.write(message.write())
-            await self.writer.drain()
+            self.queue_output(self.open_message, bgp_message.OPEN, flush=True)
 
         except OSError:
             self.logger.opt(ansi=True, depth=1).info("<magenta>[TX-ERR]</> OPEN")
-            self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
             self.tcp_connection_established = False
             await asyncio.sleep(1)
             return
@@ -128,11 +193,28 @@ async def send_open_message(self):
         self.logger.opt(ansi=True, depth=1).info("<magenta>[TX-ERR]</> OPEN")
 
 
-async def send_update_message(self):
-    """ Send Open message """
+async def send_update_message(self, prefixes_add=None, prefixes_del=()):
+    """ Send Update messages, prefixes_add maps attribute set to list of prefix keys announced with it """
+
+    if self.tcp_connection_established:
+        messages = bgp_message.encode_updates(prefixes_add, prefixes_del, self.max_message_size)
+
+        try:
+            for message in messages:
+                self.queue_output(message, bgp_message.UPDATE)
+            await self.drain_output()
+
+        except OSError:
+            self.logger.opt(ansi=True, depth=1).info("<magenta>[TX-ERR]</> UPDATE")
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
+            self.tcp_connection_established = False
+            await asyncio.sleep(1)
+            return
+
+        self.logger.opt(ansi=True, depth=1).info(f"<magenta>[TX]</> UPDATE x {len(messages)}")
 
-    # <!!!> Need valid implementation here
-    pass
+    else:
+        self.logger.opt(ansi=True, depth=1).info("<magenta>[TX-ERR]</> UPDATE")
 
 
 async def message_input_loop(self):
@@ -146,77 +228,133 @@ async def message_input_loop(self):
             await asyncio.sleep(1)
             continue
 
-        data = await self.reader.read(4096)
-        self.logger.debug(f"Received {len(data)} bytes of data")
+        reader = self.reader
+
+        try:
+            # Single read fits the largest message the peer is allowed to send
+            data = await reader.read(self.max_message_size)
+        except OSError:
+            data = b""
+
+        # Connection got closed while waiting for data, FSM may have taken over new one from restarted peer already
+        if reader is not self.reader:
+            continue
+
+        # Hot path logging passes arguments separately so nothing gets formatted unless the level is enabled
+        self.logger.debug("Received {} bytes of data", len(data))
 
         if len(data) == 0:
-            self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
+            self.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
             self.tcp_connection_established = False
+            self.rx_buffer.clear()
             await asyncio.sleep(1)
             continue
 
-        while len(data) >= 19:
-            message = bgp_message.DecodeMessage(data, local_id=self.local_id, peer_asn=self.peer_asn)
+        self.rx_buffer += data
 
-            if message.data_len_error:
-                self.logger.warning(f"Received {message.data_len_received} bytes of data, expected at least {message.data_len_expected}")
-                self.tcp_connection_established = False
-                self.enqueue_event(BgpEvent("Event 18: TcpConnectionFails"))
-                await asyncio.sleep(1)
-                break
+        # UPDATE messages decoded from single read are handed to the FSM as one batch
+        updates = []
+
+        # All the messages from single read share the same timestamp in MRT record
+        rx_time = time.time() if self.mrt_writer else 0
 
-            data = data[message.len :]
+        # Decode every complete message present in the buffer, partial message stays there until rest of it arrives
+        while len(self.rx_buffer) >= bgp_message.HEADER_SIZE:
+            message_len = struct.unpack_from("!H", self.rx_buffer, 16)[0]
+
+            if bgp_message.HEADER_SIZE <= message_len <= self.max_message_size:
+                if len(self.rx_buffer) < message_len:
+                    break
+                data = bytes(self.rx_buffer[:message_len])
+                del self.rx_buffer[:message_len]
+
+                if self.mrt_writer:
+                    self.mrt_writer.record_message(self, data, rx_time)
+
+            else:
+                # Invalid length, decode just the header so the error gets reported
+                data = bytes(self.rx_buffer[: bgp_message.HEADER_SIZE])
+
+            message = bgp_message.DecodeMessage(data, local_id=self.local_id, peer_asn=self.peer_asn, max_size=self.max_message_size)
+
+            if message.message_error_code:
+                self.metrics.decode_errors += 1
+            else:
+                self.metrics.rx_messages[message.type] += 1
+                self.metrics.rx_bytes[message.type] += len(data)
+
+            # Any other message ends the batch so the events stay in the order messages arrived
+            if updates and (message.message_error_code or message.type != bgp_message.UPDATE):
+                self.enqueue_updates(updates)
+                updates = []
 
             if message.message_error_code == bgp_message.MESSAGE_HEADER_ERROR:
-                self.enqueue_event(BgpEvent("Event 21: BGPHeaderErr", message))
+                self.enqueue_event(BgpEvent(bgp_event.BGP_HEADER_ERR, message))
+                self.rx_buffer.clear()
                 break
 
             if message.message_error_code == bgp_message.OPEN_MESSAGE_ERROR:
-                self.enqueue_event(BgpEvent("Event 22: BGPOpenMsgErr", message))
+                self.enqueue_event(BgpEvent(bgp_event.BGP_OPEN_MSG_ERR, message))
+                self.rx_buffer.clear()
+                break
+
+            if message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR:
+                self.enqueue_event(BgpEvent(bgp_event.UPDATE_MSG_ERR, message))
+                self.rx_buffer.clear()
+                break
+
+            if message.message_error_code == bgp_message.ROUTE_REFRESH_MESSAGE_ERROR:
+                self.enqueue_event(BgpEvent(bgp_event.ROUTE_REFRESH_MSG_ERR, message))
+                self.rx_buffer.clear()
                 break
 
             if message.type == bgp_message.OPEN:
                 self.logger.opt(ansi=True).info(f"<green>[RX]</> OPEN - peer_id: {message.id}")
-                self.enqueue_event(BgpEvent("Event 19: BGPOpen", message))
+                self.enqueue_event(BgpEvent(bgp_event.BGP_OPEN, message))
 
             if message.type == bgp_message.UPDATE:
-                self.logger.opt(ansi=True).info(f"<green>[RX]</> UPDATE - add {len(message.prefixes_add)}, del {len(message.prefixes_del)}")
-                for attribute in message.attributes:
-                    self.logger.opt(ansi=True).info(f"<green>[RX]</> attr: {attribute}")
-                for prefix_add in message.prefixes_add:
-                    self.logger.opt(ansi=True).info(f"<green>[RX]</> prefix_add: {prefix_add}")
-                for prefix_del in message.prefixes_del:
-                    self.logger.opt(ansi=True).info(f"<green>[RX]</> prefix_del: {prefix_del}")
+                # Per prefix tracing is opt-in per peer, it needs the message decoded right here
+                if self.trace_prefixes:
+                    self.trace_update(message.update)
+                elif self.decoder_pool:
+                    self.decoder_pool.submit(message.update)
+                updates.append(message)
 
             if message.type == bgp_message.NOTIFICATION:
                 self.logger.opt(ansi=True).info(f"<green>[RX]</> NOTIFICATION - {message.error_code}, {message.error_subcode}")
 
-                if message.error_code == bgp_message.MESSAGE_HEADER_ERROR:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
-
+                # Version error is the only NOTIFICATION with event of its own, any other error code including ones not known yet ends the session
                 if message.error_code == bgp_message.OPEN_MESSAGE_ERROR and message.error_subcode == bgp_message.UNSUPPORTED_VERSION_NUMBER:
-                    self.enqueue_event(BgpEvent("Event 24: NotifMsgVerErr"))
+                    self.enqueue_event(BgpEvent(bgp_event.NOTIF_MSG_VER_ERR))
+                else:
+                    self.enqueue_event(BgpEvent(bgp_event.NOTIF_MSG))
 
-                if message.error_code == bgp_message.OPEN_MESSAGE_ERROR and message.error_subcode != bgp_message.UNSUPPORTED_VERSION_NUMBER:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
+            if message.type == bgp_message.KEEPALIVE:
+                self.logger.opt(ansi=True).info("<green>[RX]</> KEEPALIVE")
+                self.enqueue_event(BgpEvent(bgp_event.KEEPALIVE_MSG))
 
-                if message.error_code == bgp_message.UPDATE_MESSAGE_ERROR:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
+            if message.type == bgp_message.ROUTE_REFRESH:
+                self.logger.opt(ansi=True).info(f"<green>[RX]</> ROUTE-REFRESH - afi: {message.afi}, safi: {message.safi}, subtype: {message.subtype}")
+                self.enqueue_event(BgpEvent(bgp_event.ROUTE_REFRESH_MSG, message))
 
-                if message.error_code == bgp_message.HOLD_TIMER_EXPIRED:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
+        if updates:
+            self.enqueue_updates(updates)
 
-                if message.error_code == bgp_message.FINITE_STATE_MACHINE_ERROR:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
 
-                if message.error_code == bgp_message.CEASE:
-                    self.enqueue_event(BgpEvent("Event 25: NotifMsg"))
+def enqueue_updates(self, updates):
+    """ Hand batch of UPDATE messages over to the FSM, log single summary line for the whole batch """
 
-            if message.type == bgp_message.KEEPALIVE:
-                self.logger.opt(ansi=True).info("<green>[RX]</> KEEPALIVE")
-                self.enqueue_event(BgpEvent("Event 26: KeepAliveMsg"))
+    self.logger.opt(ansi=True, depth=1).info("<green>[RX]</> UPDATE x {} - {} bytes", len(updates), sum(len(_.update.data) for _ in updates))
+    self.enqueue_event(BgpEvent(bgp_event.UPDATE_MSG, messages=updates))
 
-            await asyncio.sleep(1)
 
-        else:
-            await asyncio.sleep(1)
+def trace_update(self, update):
+    """ Log every attribute and prefix of UPDATE message """
+
+    self.logger.opt(ansi=True).debug("<green>[RX]</> UPDATE - add {}, del {}", len(update.keys_add), len(update.keys_del))
+    for attribute in update.attributes:
+        self.logger.opt(ansi=True).debug("<green>[RX]</> attr: {}", attribute)
+    for prefix_add in update.prefixes_add:
+        self.logger.opt(ansi=True).debug("<green>[RX]</> prefix_add: {}", prefix_add)
+    for prefix_del in update.prefixes_del:
+        self.logger.opt(ansi=True).debug("<green>[RX]</> prefix_del: {}", prefix_del)
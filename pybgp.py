@@ -25,14 +25,87 @@
 
 
 import asyncio
+import socket
 import sys
 
 import loguru
 
+import bgp_event
+import bgp_metrics
+import bgp_mrt
+from bgp_decoder_pool import DecoderPool
 from bgp_event import BgpEvent
+from bgp_loc_rib import LocRib
 from bgp_session import BgpSession
+from bgp_shard import ShardPool
+from bgp_update_group import UpdateGroups
+
+# Number of worker processes sessions get spread across, zero runs everything in the main process
+SHARD_WORKERS = 0
+
+# Number of processes decoding received UPDATE messages, zero decodes them on the event loop
+DECODER_PROCESSES = 0
+
+# Local endpoint serving metrics in Prometheus format, Unix socket gets used instead of TCP port if path is set, zero port disables it
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9179
+METRICS_PATH = None
+
+# Routes of every peer get dumped in MRT TABLE_DUMP_V2 format this often, path is formatted with strftime, None disables it
+MRT_TABLE_DUMP_PATH = None
+MRT_TABLE_DUMP_INTERVAL = 7200
+
+# MRT file replayed into the Loc-RIB before sessions start, lab instance gets full table without waiting for live peer
+MRT_PRELOAD_PATH = None
+
+SESSIONS = [
+    {
+        "local_id": "1.1.1.1",
+        "local_asn": 65201,
+        "local_hold_time": 180,
+        "peer_ip": "192.168.9.201",
+        "peer_asn": 65201,
+        "active_mode": True,
+        "passive_mode": True,
+        "trace_prefixes": False,
+        "mrt_messages": None,
+        "extended_message": True,
+        "route_refresh": True,
+        "graceful_restart": True,
+    },
+    # {
+    #     "local_id": "1.1.1.1",
+    #     "local_asn": 65000,
+    #     "local_hold_time": 180,
+    #     "peer_ip": "192.168.9.203",
+    #     "peer_asn": 65000,
+    #     "active_mode": True,
+    #     "passive_mode": True,
+    #     "trace_prefixes": False,
+    #     "mrt_messages": None,
+    #     "extended_message": True,
+    #     "route_refresh": True,
+    #     "graceful_restart": True,
+    # },
+    # {
+    #     "local_id": "1.1.1.1",
+    #     "local_asn": 65000,
+    #     "local_hold_time": 180,
+    #     "peer_ip": "192.168.9.204",
+    #     "peer_asn": 65000,
+    #     "active_mode": True,
+    #     "passive_mode": True,
+    #     "trace_prefixes": False,
+    #     "mrt_messages": None,
+    #     "extended_message": True,
+    #     "route_refresh": True,
+    #     "graceful_restart": True,
+    # },
+]
 
 BGP_LISTENERS = {}
+LOC_RIB = LocRib()
+UPDATE_GROUPS = UpdateGroups(LOC_RIB)
 
 
 async def bgp_broker(reader, writer):
@@ -42,21 +115,30 @@ async def bgp_broker(reader, writer):
     passive_fsm = BGP_LISTENERS.pop(peer[0], None)
 
     if passive_fsm:
-        passive_fsm.enqueue_event(BgpEvent("Event 17: TcpConnectionConfirmed", reader=reader, writer=writer, peer_ip=peer[0], peer_port=peer[1]))
+        passive_fsm.enqueue_event(BgpEvent(bgp_event.TCP_CONNECTION_CONFIRMED, reader=reader, writer=writer, peer_ip=peer[0], peer_port=peer[1]))
 
     else:
         writer.close()
         await writer.wait_closed()
 
 
-async def start_bgp_broker():
+async def start_bgp_broker(shard_pool=None):
     """ Start listening for incoming BGP connections on port 179"""
 
-    await asyncio.start_server(bgp_broker, "0.0.0.0", 179)
+    if shard_pool is None:
+        await asyncio.start_server(bgp_broker, "0.0.0.0", 179)
+        return
 
+    # Accepted sockets get passed to worker processes before any data is read from them
+    listener = socket.create_server(("0.0.0.0", 179))
+    listener.setblocking(False)
+    asyncio.create_task(shard_pool.broker(listener))
 
-async def main():
-    loguru.logger.remove(0)
+
+def setup_logger():
+    """ Configure logger, called in the main process and in every worker process """
+
+    loguru.logger.remove()
     loguru.logger.add(
         sys.stdout,
         colorize=True,
@@ -65,42 +147,33 @@ async def main():
         + f"|</level> <level>{{extra[peer]:21}} | <normal><cyan>{{function:33}}</cyan></normal> | {{extra[state]:11}} | {{message}}</level>",
     )
 
-    await start_bgp_broker()
-
-    BgpSession(
-        local_id="1.1.1.1",
-        local_asn=65201,
-        local_hold_time=180,
-        peer_ip="192.168.9.201",
-        peer_asn=65201,
-        bgp_listeners=BGP_LISTENERS,
-        active_mode=True,
-        passive_mode=True,
-    )
 
-    """
-    BgpSession(
-        local_id="1.1.1.1",
-        local_asn=65000,
-        local_hold_time=180,
-        peer_ip="192.168.9.203",
-        peer_asn=65000,
-        bgp_listeners=BGP_LISTENERS,
-        active_mode=True,
-        passive_mode=True,
-    )
+async def main():
+    setup_logger()
 
-    BgpSession(
-        local_id="1.1.1.1",
-        local_asn=65000,
-        local_hold_time=180,
-        peer_ip="192.168.9.204",
-        peer_asn=65000,
-        bgp_listeners=BGP_LISTENERS,
-        active_mode=True,
-        passive_mode=True,
-    )
-    """
+    if SHARD_WORKERS:
+        shard_pool = ShardPool(SESSIONS, SHARD_WORKERS, setup_logger)
+        shard_pool.start()
+        await start_bgp_broker(shard_pool)
+
+    else:
+        await start_bgp_broker()
+
+        if METRICS_PORT or METRICS_PATH:
+            bgp_metrics.registry.loc_rib = LOC_RIB
+            await bgp_metrics.start_metrics_server(METRICS_HOST, METRICS_PORT, METRICS_PATH)
+
+        if MRT_PRELOAD_PATH:
+            replay = bgp_mrt.MrtReplay(LOC_RIB, SESSIONS[0]["local_asn"]).replay(MRT_PRELOAD_PATH)
+            loguru.logger.bind(peer="MRT", state="").info(f"Preloaded {len(LOC_RIB)} prefixes from {len(replay.adj_ribs_in)} peers in {MRT_PRELOAD_PATH}")
+
+        if MRT_TABLE_DUMP_PATH:
+            asyncio.create_task(bgp_mrt.table_dump_loop(MRT_TABLE_DUMP_PATH, LOC_RIB, SESSIONS[0]["local_id"], MRT_TABLE_DUMP_INTERVAL))
+
+        decoder_pool = DecoderPool(DECODER_PROCESSES) if DECODER_PROCESSES else None
+
+        for session in SESSIONS:
+            BgpSession(**session, bgp_listeners=BGP_LISTENERS, loc_rib=LOC_RIB, update_groups=UPDATE_GROUPS, decoder_pool=decoder_pool)
 
     while True:
         await asyncio.sleep(1)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import struct
+from array import array
+
+import bgp_message
+from bgp_adj_rib_in import AdjRibIn
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, bgp_message.ORIGIN_IGP])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 4, 2, 1])
+    + struct.pack("!H", 65001)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+PREFIX_1 = (10 << 24 | 1 << 8) << 8 | 24
+PREFIX_2 = (10 << 24 | 2 << 8) << 8 | 24
+PREFIX_3 = (10 << 24 | 3 << 8) << 8 | 24
+
+
+def test_import_policy_rejects_array_keys():
+    adj_rib_in = AdjRibIn("10.0.0.1", 65001, 65000, import_policy=lambda key, adj_rib_in, attribute_set: key != PREFIX_2)
+    attribute_set = bgp_message.intern_attribute_set(ATTRIBUTES)
+    adj_rib_in.store(attribute_set, [PREFIX_2, PREFIX_3], [])
+
+    # Keys decoded by the decoder pool come as arrays
+    keys = adj_rib_in.store(attribute_set, array("Q", [PREFIX_1, PREFIX_2]), array("Q", [PREFIX_3]))
+
+    assert sorted(keys) == [PREFIX_1, PREFIX_2, PREFIX_3]
+    assert adj_rib_in.routes == {PREFIX_1: attribute_set}
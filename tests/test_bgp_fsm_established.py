@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import struct
+
+import loguru
+
+import bgp_event
+import bgp_fsm_established
+import bgp_message
+from bgp_adj_rib_in import AdjRibIn
+from bgp_event import BgpEvent
+from bgp_loc_rib import LocRib
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, bgp_message.ORIGIN_IGP])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 4, 2, 1])
+    + struct.pack("!H", 65001)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+PREFIX_1 = (10 << 24 | 1 << 8) << 8 | 24
+PREFIX_2 = (10 << 24 | 2 << 8) << 8 | 24
+
+
+class Metrics:
+    def observe_update_latency(self, seconds):
+        pass
+
+
+class Fsm:
+    """ Stand-in for Established FSM of peer that negotiated Graceful Restart """
+
+    def __init__(self, peer_restart_time):
+        self.logger = loguru.logger
+        self.adj_rib_in = AdjRibIn("10.0.0.1", 65001, 65000, LocRib())
+        self.adj_rib_in.apply(bgp_message.intern_attribute_set(ATTRIBUTES), [PREFIX_1, PREFIX_2], [])
+        self.peer_restart_time = peer_restart_time
+        self.decoder_pool = None
+        self.metrics = Metrics()
+        self.connect_retry_counter = 0
+        self.hold_time = 0
+        self.hold_timer = 0
+        self.state = "Established"
+
+    def change_state(self, state):
+        self.state = state
+
+
+def test_stale_timer_removes_routes_of_peer_that_did_not_come_back():
+    async def run():
+        fsm = Fsm(peer_restart_time=0.2)
+        await bgp_fsm_established.tcp_connection_fails(fsm, BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
+
+        assert fsm.state == "Idle"
+        assert fsm.adj_rib_in.restarting
+        assert set(fsm.adj_rib_in.stale) == {PREFIX_1, PREFIX_2}
+        assert PREFIX_1 in fsm.adj_rib_in.loc_rib.routes
+
+        await asyncio.sleep(0.5)
+
+        assert not fsm.adj_rib_in.restarting
+        assert len(fsm.adj_rib_in) == 0
+        assert PREFIX_1 not in fsm.adj_rib_in.loc_rib.routes
+
+    asyncio.run(run())
+
+
+def test_end_of_rib_removes_routes_not_announced_again():
+    async def run():
+        fsm = Fsm(peer_restart_time=120)
+        await bgp_fsm_established.tcp_connection_fails(fsm, BgpEvent(bgp_event.TCP_CONNECTION_FAILS))
+
+        # Restarted peer announces only one of its routes again before End-of-RIB
+        fsm.state = "Established"
+        messages = [
+            bgp_message.DecodeMessage(bgp_message.Update(attributes=ATTRIBUTES, nlri=bgp_message.encode_prefix(PREFIX_1)).write()),
+            bgp_message.DecodeMessage(bgp_message.END_OF_RIB_MESSAGE),
+        ]
+        await bgp_fsm_established.update_msg(fsm, BgpEvent(bgp_event.UPDATE_MSG, messages=messages))
+
+        assert not fsm.adj_rib_in.restarting
+        assert fsm.adj_rib_in.stale == {}
+        assert set(fsm.adj_rib_in.routes) == {PREFIX_1}
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import struct
+
+import bgp_message
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, bgp_message.ORIGIN_IGP])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 6, 2, 2])
+    + struct.pack("!HH", 65001, 65002)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+
+def build_update(attributes=ATTRIBUTES, nlri=b"\x18\x0a\x00\x00", withdrawn=b""):
+    """ Build UPDATE message out of raw sections """
+
+    body = struct.pack("!H", len(withdrawn)) + withdrawn + struct.pack("!H", len(attributes)) + attributes + nlri
+    return bgp_message.MARKER + struct.pack("!HB", bgp_message.HEADER_SIZE + len(body), bgp_message.UPDATE) + body
+
+
+def test_valid_update():
+    message = bgp_message.DecodeMessage(build_update())
+
+    assert message.message_error_code == 0
+    assert message.update.keys_add == [(10 << 24) << 8 | 24]
+
+
+def test_prefix_longer_than_32_bits():
+    message = bgp_message.DecodeMessage(build_update(nlri=b"\x30" + b"\x0a" * 6))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.INVALID_NETWORK_FIELD
+
+
+def test_truncated_prefix():
+    message = bgp_message.DecodeMessage(build_update(nlri=b"\x18\x0a\x00"))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.INVALID_NETWORK_FIELD
+
+
+def test_truncated_withdrawn_prefix():
+    message = bgp_message.DecodeMessage(build_update(withdrawn=b"\x18\x0a"))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.INVALID_NETWORK_FIELD
+
+
+def test_truncated_attribute():
+    message = bgp_message.DecodeMessage(build_update(attributes=ATTRIBUTES[:-2]))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.MALFORMED_ATTRIBUTE_LIST
+
+
+def test_attribute_with_invalid_length():
+    attributes = ATTRIBUTES[:-7] + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 2, 10, 0])
+    message = bgp_message.DecodeMessage(build_update(attributes=attributes))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.ATTRIBUTE_LENGTH_WRROR
+
+
+def test_malformed_as_path():
+    attributes = bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 3, 2, 2, 0])
+    message = bgp_message.DecodeMessage(build_update(attributes=attributes))
+
+    assert message.message_error_code == bgp_message.UPDATE_MESSAGE_ERROR
+    assert message.message_error_subcode == bgp_message.MALFORMED_AS_PATH
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import struct
+
+import bgp_message
+import bgp_mrt
+
+ATTRIBUTES = (
+    bgp_mrt.encode_attribute(bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, bytes([bgp_message.ORIGIN_IGP]))
+    + bgp_mrt.encode_attribute(
+        bgp_message.FLAG_TANSITIVE,
+        bgp_message.ATTR_AS_PATH,
+        struct.pack("!BB3L", bgp_mrt.AS_SEQUENCE, 3, 65001, 4200000001, 65003) + struct.pack("!BB2L", bgp_mrt.AS_SET, 2, 4200000002, 65004),
+    )
+    + bgp_mrt.encode_attribute(bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, bytes([10, 0, 0, 1]))
+    + bgp_mrt.encode_attribute(
+        bgp_message.FLAG_OPTIONAL | bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AGGREGATOR, struct.pack("!L4B", 4200000009, 10, 0, 0, 1)
+    )
+)
+
+
+def test_as4_attributes_survive_round_trip():
+    assert bgp_mrt.attributes_as2_to_as4(bgp_mrt.attributes_as4_to_as2(ATTRIBUTES)) == ATTRIBUTES
+
+
+def test_as_path_prepended_by_2_octet_speaker_gets_merged():
+    attributes = [list(_) for _ in bgp_mrt.iter_attributes(bgp_mrt.attributes_as4_to_as2(ATTRIBUTES))]
+    for attribute in attributes:
+        if attribute[1] == bgp_message.ATTR_AS_PATH:
+            attribute[2] = struct.pack("!BBHH", bgp_mrt.AS_SEQUENCE, 2, 65100, 65100) + attribute[2]
+
+    raw_data = bgp_mrt.attributes_as2_to_as4(b"".join(bgp_mrt.encode_attribute(*_) for _ in attributes))
+    attributes = {_[1]: _[2] for _ in bgp_mrt.iter_attributes(raw_data)}
+
+    assert bgp_mrt.decode_as_path(attributes[bgp_message.ATTR_AS_PATH], 4) == [
+        (bgp_mrt.AS_SEQUENCE, (65100, 65100, 65001, 4200000001, 65003)),
+        (bgp_mrt.AS_SET, (4200000002, 65004)),
+    ]
+    assert bgp_mrt.ATTR_AS4_PATH not in attributes
+    assert bgp_mrt.ATTR_AS4_AGGREGATOR not in attributes
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+############################################################################
+#                                                                          #
+#  PyBGP - Python BGP implementation                                       #
+#  Copyright (C) 2020  Sebastian Majewski                                  #
+#                                                                          #
+#  This program is free software: you can redistribute it and/or modify    #
+#  it under the terms of the GNU General Public License as published by    #
+#  the Free Software Foundation, either version 3 of the License, or       #
+#  (at your option) any later version.                                     #
+#                                                                          #
+#  This program is distributed in the hope that it will be useful,         #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#  GNU General Public License for more details.                            #
+#                                                                          #
+#  You should have received a copy of the GNU General Public License       #
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.  #
+#                                                                          #
+#  Author's email: ccie18643@gmail.com                                     #
+#  Github repository: https://github.com/ccie18643/PyBGP                   #
+#                                                                          #
+############################################################################
+
+
+import asyncio
+import struct
+
+import bgp_message
+from bgp_adj_rib_in import AdjRibIn
+from bgp_loc_rib import LocRib
+from bgp_update_group import UpdateGroups
+
+ATTRIBUTES = (
+    bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_ORIGIN, 1, bgp_message.ORIGIN_IGP])
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_AS_PATH, 4, 2, 1])
+    + struct.pack("!H", 65001)
+    + bytes([bgp_message.FLAG_TANSITIVE, bgp_message.ATTR_NEXT_HOP, 4, 10, 0, 0, 1])
+)
+
+PREFIX = (10 << 24) << 8 | 24
+
+
+class Peer:
+    """ Stand-in for Established FSM, keeps the routes written to it """
+
+    def __init__(self, peer_ip, peer_asn, loc_rib):
+        self.peer_ip = peer_ip
+        self.adj_rib_in = AdjRibIn(peer_ip, peer_asn, 65000, loc_rib)
+        self.export_policy = None
+        self.max_message_size = bgp_message.MAX_MESSAGE_SIZE
+        self.graceful_restart_negotiated = False
+        self.tcp_connection_established = True
+        self.routes = set()
+        self.withdrawn = []
+
+    def queue_output(self, data, message_type, count=1):
+        i = 0
+        while i < len(data):
+            message = bgp_message.DecodeMessage(data[i:])
+            i += message.len
+            if message.type == bgp_message.UPDATE:
+                self.withdrawn += message.update.keys_del
+                self.routes.difference_update(message.update.keys_del)
+                self.routes.update(message.update.keys_add)
+
+    async def drain_output(self):
+        pass
+
+
+def test_refresh_keeps_pending_withdraw():
+    async def run():
+        loc_rib = LocRib()
+        update_groups = UpdateGroups(loc_rib)
+        source = Peer("10.0.0.1", 65001, loc_rib)
+        peer = Peer("10.0.0.2", 65002, loc_rib)
+        update_groups.join(source)
+        update_groups.join(peer)
+
+        source.adj_rib_in.apply(bgp_message.intern_attribute_set(ATTRIBUTES), [PREFIX], [])
+        await asyncio.sleep(0.01)
+        assert peer.routes == {PREFIX}
+
+        # Withdraw gets into the log, the table sent on refresh does not have the prefix anymore
+        source.adj_rib_in.apply(None, [], [PREFIX])
+        peer.update_group.refresh(peer)
+        await asyncio.sleep(0.01)
+
+        assert PREFIX in peer.withdrawn
+        assert peer.routes == set()
+
+    asyncio.run(run())